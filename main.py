@@ -14,6 +14,7 @@
 import argparse
 import logging
 import logging.handlers
+import multiprocessing
 import os
 import platform
 import scandir
@@ -22,18 +23,18 @@ import sys
 import traceback
 from typing import Optional
 
-from PyQt5.QtCore import QFile, Qt
-from PyQt5.QtWidgets import QApplication
-
-from version.database import db, db_constants
-from version import app
-from version import app_constants
-from version import gallerydb
-from version import utils
-
 
 # IMPORTANT STUFF
 def start(test=False):
+    # imported here, the thumbnail worker processes import this module and only need the renderer
+    from PyQt5.QtCore import QFile, Qt
+    from PyQt5.QtWidgets import QApplication
+
+    from version.database import db, db_constants
+    from version import app
+    from version import app_constants
+    from version import utils
+
     app_constants.APP_RESTART_CODE = -123456789
 
     if os.name == 'posix':
@@ -261,6 +262,9 @@ def start(test=False):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    from version import app_constants
+
     current_exit_code = 0
     while current_exit_code == app_constants.APP_RESTART_CODE:
         current_exit_code = start()
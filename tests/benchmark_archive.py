@@ -0,0 +1,54 @@
+"""
+Compares directory queries on a synthetic 10k entry zip with and without the ArchiveFile name index.
+Run from the repository root: python -m tests.benchmark_archive [amount of directories] [images per directory]
+"""
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+from version import utils
+
+
+def _scan_dir_contents(names, dir_name):
+    """dir_contents the way it was done before the index, a scan over every name"""
+    if not dir_name:
+        return [x for x in names if x.count('/') == 0 or (x.count('/') == 1 and x.endswith('/'))]
+    dir_con_start = [x for x in names if x.startswith(dir_name)]
+    return [x for x in dir_con_start if x.count('/') == dir_name.count('/')
+            and (x.count('/') == dir_name.count('/') and not x.endswith('/'))
+            or (x.count('/') == 1 + dir_name.count('/') and x.endswith('/'))]
+
+
+def main(dirs=200, images=50):
+    with tempfile.TemporaryDirectory() as path:
+        zip_path = os.path.join(path, 'synthetic.zip')
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            for d in range(dirs):
+                z.writestr('chapter {}/'.format(d), b'')
+                for i in range(images):
+                    z.writestr('chapter {}/{:03}.jpg'.format(d, i), b'')
+        print('{} entries'.format(dirs * (images + 1)))
+
+        arch = utils.ArchiveFile(zip_path)
+        start = time.perf_counter()
+        names = arch.archive.namelist()
+        scanned = [_scan_dir_contents(names, d) for d in [''] + [x for x in names if x.endswith('/')]]
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        indexed = [arch.dir_contents(d) for d in [''] + arch.dir_list()]
+        index_time = time.perf_counter() - start
+        assert scanned == indexed
+        arch.close()
+
+        start = time.perf_counter()
+        utils.check_archive(zip_path)
+        check_time = time.perf_counter() - start
+        print('dir_contents of every directory: scan {:.3f}s, index {:.3f}s'.format(scan_time, index_time))
+        print('check_archive: {:.3f}s'.format(check_time))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
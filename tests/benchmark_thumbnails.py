@@ -0,0 +1,60 @@
+"""
+Compares thumbnail generation throughput of the thread pool (Qt) and the process pool (PIL) paths.
+Run from the repository root: python -m tests.benchmark_thumbnails [amount of images]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent import futures
+
+from PIL import Image
+
+
+def _make_images(path, amount):
+    images = []
+    for n in range(amount):
+        img_path = os.path.join(path, '{}.jpg'.format(n))
+        # noise so every cover is unique and compresses like a real page
+        Image.effect_noise((1400, 2000), 40 + n % 50).convert('RGB').save(img_path, quality=90)
+        images.append(img_path)
+    return images
+
+
+def _run(images, process_pool):
+    from version import app_constants, executors
+    from version.thumbnail_store import thumbnail_store
+    app_constants.THUMBNAIL_PROCESS_POOL = process_pool
+    thumbnail_store.clear()
+    workers = max(3, executors.thumbnail_workers()) if process_pool else 3
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(workers) as pool:
+        paths = list(pool.map(lambda p: executors._task_thumbnail(p, img=p), images))
+    elapsed = time.perf_counter() - start
+    assert app_constants.NO_IMAGE_PATH not in paths
+    return elapsed
+
+
+def main(amount=200):
+    # imported here, the worker processes import this module like they import main.py
+    from PyQt5.QtWidgets import QApplication
+    from version import app_constants, executors
+    from version.thumbnail_store import thumbnail_store
+
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841
+    with tempfile.TemporaryDirectory() as path:
+        images = _make_images(path, amount)
+        thumbnail_store.path = os.path.join(path, 'thumbnails')
+        thumbnail_store._entries = None
+        # start the worker processes before timing
+        start = time.perf_counter()
+        executors.Executors.render_thumbnails(images[0], app_constants.THUMB_SIZES)
+        print('{:<16} {:6.2f}s'.format('pool start', time.perf_counter() - start))
+        for name, process_pool in (('threads (Qt)', False), ('processes (PIL)', True)):
+            elapsed = _run(images, process_pool)
+            print('{:<16} {:6.2f}s {:7.1f} thumbnails/s'.format(name, elapsed, amount / elapsed))
+        print('{} worker processes'.format(executors.thumbnail_workers()))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
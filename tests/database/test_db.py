@@ -24,26 +24,27 @@ def test_init_db(path_isfile_retval, check_dbv_retval, path_is_dbc_path):
             path = m_dbc.DB_PATH
         else:
             path = mock.Mock()
+        cached_statements = m_dbc.CONNECTION_PROFILES.get.return_value.get.return_value
         # run
         res = db.init_db(path)
         # test
         if path_isfile_retval:
             if path == m_dbc.DB_PATH and not check_dbv_retval:
                 m_sl3.assert_has_calls([
-                    mock.call.connect(path, check_same_thread=False),
+                    mock.call.connect(path, check_same_thread=False, cached_statements=cached_statements),
                 ])
                 assert res is None
                 return
             else:
                 m_sl3.assert_has_calls([
-                    mock.call.connect(path, check_same_thread=False),
+                    mock.call.connect(path, check_same_thread=False, cached_statements=cached_statements),
                     mock.call.connect().execute('PRAGMA foreign_keys = on')
                 ])
         else:
             m_create_db_path.assert_called_once_with()
 
             m_sl3.assert_has_calls([
-                mock.call.connect(path, check_same_thread=False),
+                mock.call.connect(path, check_same_thread=False, cached_statements=cached_statements),
                 mock.call.connect().cursor(),
                 mock.call.connect().cursor().execute(
                     'CREATE TABLE IF NOT EXISTS version(version REAL)'),
@@ -57,3 +58,28 @@ def test_init_db(path_isfile_retval, check_dbv_retval, path_is_dbc_path):
             ])
         assert res == m_sl3.connect.return_value
         assert res.isolation_level is None
+
+
+def test_query_stats():
+    """statements should be counted without formatting their parameters"""
+    import sqlite3
+    from version.database import db
+    conn = sqlite3.connect(':memory:')
+    conn.isolation_level = None
+    with mock.patch.object(db.DBBase, '_DB_CONN', conn), \
+            mock.patch.object(db.DBBase, '_STATS', {}), \
+            mock.patch('version.database.db.log_d') as m_log_d:
+        db.DBBase.execute('CREATE TABLE t(v INTEGER)')
+        db.DBBase.executemany('INSERT INTO t VALUES(?)', [(x,) for x in range(10)])
+        db.DBBase.executemany('INSERT INTO t VALUES(?)', [(x,) for x in range(5)])
+        stats = dict(db.DBBase.query_stats())
+        assert stats['INSERT INTO t VALUES(?)'].count == 2
+        assert stats['INSERT INTO t VALUES(?)'].rows == 15
+        assert stats['CREATE TABLE t(v INTEGER)'].count == 1
+        m_log_d.assert_any_call('DB Query: %s (executemany)', 'INSERT INTO t VALUES(?)')
+        for n in range(1, 4):
+            db.DBBase.execute('SELECT v FROM t WHERE v IN ({})'.format(','.join('?' * n)), tuple(range(n)))
+        stats = dict(db.DBBase.query_stats())
+        assert stats['SELECT v FROM t WHERE v IN (?, ...)'].count == 3
+        assert len(stats) == 3
+    conn.close()
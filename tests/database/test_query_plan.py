@@ -0,0 +1,99 @@
+"""test that the hot gallerydb queries are served by an index."""
+import sqlite3
+
+import pytest
+
+from version.database import db, db_constants
+from version.gallerydb import ChapterDB, GalleryDB, HashDB, ListDB, TagDB
+
+HOT_QUERIES = [
+    # GalleryDB.get_gallery_by_path
+    (GalleryDB._BY_PATH_SQL, (b'',)),
+    # ChapterDB.get_chapters_for_gallery
+    (ChapterDB._GALLERY_CHAPTERS_SQL, (1,)),
+    # ChapterDB.get_chapter_id
+    (ChapterDB._CHAPTER_ID_SQL, (1, 0)),
+    # TagDB.get_gallery_tags
+    (TagDB._GALLERY_TAGS_SQL + ' WHERE series_tags_map.series_id=?', (1,)),
+    # TagDB.get_galleries_tags
+    (TagDB._GALLERY_TAGS_SQL + ' WHERE series_tags_map.series_id IN (?, ?)', (1, 2)),
+    # ListDB.query_gallery
+    (ListDB._GALLERY_LISTS_SQL, (1,)),
+    # HashDB.count_matches, used by find_gallery
+    (HashDB._COUNT_MATCHES_SQL.format('?, ?'), (b'', b'')),
+    # HashDB.get_gallery_hashes
+    (HashDB._GALLERY_HASHES_SQL, (1,)),
+    # HashDB.get_gallery_hash and gen_gallery_hash
+    (HashDB._CHAPTER_HASHES_SQL, (1, 1)),
+    (HashDB._PAGE_HASH_SQL, (1, 1, 0)),
+]
+
+
+def _uses_index(conn, query, params):
+    plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+    # joined tables are looked up by their primary key, grouping the found rows in a temp b-tree is fine
+    reads = [step for step in plan if step.startswith(('SEARCH', 'SCAN'))]
+    return all('USING' in step and ('INDEX' in step or 'PRIMARY KEY' in step) for step in reads), plan
+
+
+@pytest.fixture
+def conn():
+    c = sqlite3.connect(':memory:')
+    c.executescript(db.STRUCTURE_SCRIPT)
+    yield c
+    c.close()
+
+
+@pytest.mark.parametrize('query, params', HOT_QUERIES)
+def test_hot_query_uses_index(conn, query, params):
+    """every hot query should search an index instead of scanning the table"""
+    uses_index, plan = _uses_index(conn, query, params)
+    assert uses_index, plan
+
+
+def test_add_db_revisions_creates_indexes(tmp_path):
+    """upgrading a db without indexes should add them"""
+    path = str(tmp_path / 'happypanda.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE version(version REAL)')
+    conn.execute('INSERT INTO version(version) VALUES(?)', (0.26,))
+    conn.executescript(''.join(f()[0] for f in db.STRUCTURE_SCRIPT_FUNCS))
+    conn.commit()
+    conn.close()
+
+    db.add_db_revisions(path)
+
+    conn = sqlite3.connect(path)
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    version = conn.execute('SELECT version FROM version').fetchone()[0]
+    conn.close()
+    for index in db.indexes_sql()[1]:
+        assert index.split()[0] in indexes
+    assert version == db_constants.CURRENT_DB_VERSION
+
+
+def test_db_revisions_match_fresh_schema(tmp_path):
+    """upgrading a 0.26 db should give the same tables and indexes as a new db"""
+    def schema(conn):
+        return {r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'index') AND name NOT LIKE 'sqlite_%'")}
+
+    path = str(tmp_path / 'happypanda.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE version(version REAL)')
+    conn.execute('INSERT INTO version(version) VALUES(?)', (0.26,))
+    conn.executescript(''.join(f()[0] for f in db.STRUCTURE_SCRIPT_FUNCS if f is not db.phashes_sql))
+    conn.commit()
+    conn.close()
+
+    db.add_db_revisions(path)
+
+    conn = sqlite3.connect(path)
+    upgraded = schema(conn)
+    conn.close()
+    fresh = sqlite3.connect(':memory:')
+    fresh.execute('CREATE TABLE version(version REAL)')
+    fresh.executescript(db.STRUCTURE_SCRIPT)
+    assert upgraded - {'sqlite_stat1'} == schema(fresh)
+    fresh.close()
+    assert max(db.DB_REVISIONS) == db_constants.CURRENT_DB_VERSION
@@ -0,0 +1,121 @@
+"""test duplicates module."""
+import io
+import os
+import random
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+
+from version.duplicates import (BKTree, dhash, find_similar, from_blob, fuzzy_title, gallery_buckets,
+                                SimilarGroups, group_duplicates, hamming, sample_pages, to_blob)
+
+
+def _image(seed, size=(400, 600)):
+    rnd = random.Random(seed)
+    im = Image.new('RGB', size, (255, 255, 255))
+    draw = ImageDraw.Draw(im)
+    for _ in range(30):
+        x, y = rnd.randrange(size[0]), rnd.randrange(size[1])
+        draw.ellipse((x, y, x + rnd.randint(20, 150), y + rnd.randint(20, 150)),
+                     fill=tuple(rnd.randrange(256) for _ in range(3)))
+    return im
+
+
+def _encoded(im, fmt='PNG', **kwargs):
+    buffer = io.BytesIO()
+    im.save(buffer, fmt, **kwargs)
+    buffer.seek(0)
+    return buffer
+
+
+def test_dhash_resized_and_reencoded():
+    """copies of an image should hash close, other images far"""
+    im = _image(0)
+    h = dhash(_encoded(im))
+    assert hamming(h, dhash(_encoded(im.resize((200, 300)), 'JPEG', quality=60))) <= 6
+    assert hamming(h, dhash(_encoded(_image(1)))) > 10
+    assert from_blob(to_blob(h)) == h
+
+
+def test_bktree_search():
+    """the tree should find exactly what comparing with every hash finds"""
+    rnd = random.Random(0)
+    hashes = [rnd.getrandbits(64) for _ in range(500)]
+    hashes += [h ^ (1 << rnd.randrange(64)) for h in hashes[:50]]
+    tree = BKTree()
+    for n, h in enumerate(hashes):
+        tree.add(h, n)
+    assert len(tree) == len(hashes)
+    for h in hashes[:60]:
+        for distance in (0, 3, 20):
+            expected = sorted((hamming(h, x), n) for n, x in enumerate(hashes) if hamming(h, x) <= distance)
+            assert sorted(tree.search(h, distance)) == expected
+
+
+def test_find_similar():
+    """galleries sharing most of their sampled pages should be paired once"""
+    base = [1 << n | 1 for n in range(40, 44)]
+    galleries = [
+        ('a', base),
+        ('b', [h ^ 0b110 for h in base[:3]] + [0xFFFF]),
+        ('c', [0xFFFF0000, 0xFFFF]),
+        ('d', []),
+        ('e', [base[0]]),
+    ]
+    assert sorted(find_similar(galleries, 4)) == [('a', 'b'), ('a', 'e'), ('b', 'e')]
+
+
+def test_group_similar():
+    """galleries similar to each other should be one group, not a pair for each two"""
+    base = [1 << n | 1 for n in range(40, 44)]
+    galleries = [
+        ('a', base),
+        ('x', [0xFFFF0000]),
+        ('b', [h ^ 0b1 for h in base]),
+        ('c', [h ^ 0b10 for h in base]),
+        ('d', [h ^ 0b100 for h in base[:3]]),
+        ('y', [0xFFFF0000 ^ 0b1]),
+    ]
+    assert sorted(find_similar(galleries, 4)) == [('a', 'b'), ('a', 'c'), ('a', 'd'), ('b', 'c'), ('b', 'd'),
+                                                   ('c', 'd'), ('x', 'y')]
+    groups = SimilarGroups()
+    found = [groups.add(a, b) for a, b in find_similar(galleries, 4)]
+    assert groups.groups() == [['a', 'b', 'c', 'd'], ['x', 'y']]
+    # each pair updates the group at once instead of when every gallery was hashed
+    assert found[:2] == [(['a', 'b'], ['a', 'b']), (['a', 'b', 'c'], ['c'])]
+    assert found.count(None) == 3 and len(groups) == 2
+
+
+def test_similar_groups_merge():
+    """a pair joining two groups should merge them into the oldest one"""
+    groups = SimilarGroups()
+    groups.add(1, 2)
+    groups.add(3, 4)
+    assert groups.add(4, 2) == ([1, 2, 3, 4], [])
+    assert groups.add(3, 1) is None
+    assert groups.groups() == [[1, 2, 3, 4]]
+
+
+def test_sample_pages():
+    assert sample_pages(3, 4) == [0, 1, 2]
+    assert sample_pages(100, 4) == [0, 25, 50, 75]
+    assert sample_pages(0, 4) == []
+
+
+def test_group_duplicates():
+    """keys sharing a bucket should be grouped, transitively"""
+    items = [(1, ['a']), (2, ['b']), (3, ['c', 'a']), (4, ['d']), (5, ['b', 'c']), (6, [])]
+    assert group_duplicates(items) == [[1, 2, 3, 5]]
+    assert group_duplicates([(1, ['a']), (2, ['b']), (3, ['b']), (4, ['a'])]) == [[1, 4], [2, 3]]
+
+
+def test_gallery_buckets():
+    """titles and paths should match like the old pairwise check, empty ones never"""
+    galleries = [SimpleNamespace(title=t, path=p) for t, p in [
+        (' Love Story', '/a'), ('love story ', '/b'), ('Other', '/A'), ('', '/c'), ('', '/d'),
+        ('[Artist] Café Days (C90) [English]', '/e'), ('cafe days!', '/f')]]
+    groups = group_duplicates((n, gallery_buckets(g)) for n, g in enumerate(galleries))
+    assert groups == ([[0, 1, 2]] if os.path.normcase('/A') == os.path.normcase('/a') else [[0, 1]])
+    groups = group_duplicates((n, gallery_buckets(g, True)) for n, g in enumerate(galleries))
+    assert [5, 6] in groups
+    assert fuzzy_title('[Artist] Café Days (C90) [English]') == 'cafe days'
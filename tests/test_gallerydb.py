@@ -0,0 +1,125 @@
+"""test gallerydb module."""
+import threading
+
+import pytest
+
+from version import gallerydb
+
+
+def test_execute_returns_own_result():
+    """concurrent callers should never receive each other's results"""
+    results = {}
+
+    def worker(n):
+        results[n] = [gallerydb.execute(lambda x: x, False, n * 100 + i) for i in range(20)]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    for n in range(8):
+        assert results[n] == [n * 100 + i for i in range(20)]
+
+
+def test_execute_raises():
+    """exceptions should reach the caller instead of stopping the queue"""
+
+    def fail():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        gallerydb.execute(fail, False)
+    assert gallerydb.execute(lambda: 1, False) == 1
+    assert gallerydb.submit(lambda: 2).result() == 2
+
+
+def test_read_after_deferred_write():
+    """a thread's reads should come after the writes it queued, in the order they were queued"""
+    written = []
+    release = threading.Event()
+
+    def write(n):
+        release.wait(5)
+        written.append(n)
+
+    @gallerydb.read_only
+    def read():
+        return list(written)
+
+    blocker = gallerydb.submit(lambda: release.wait(5))
+    gallerydb.execute(write, True, 1)
+    gallerydb.execute(write, True, 2, priority=1000)
+    future = gallerydb.submit(read)
+    release.set()
+    assert future.result(5) == [1, 2]
+    blocker.result(5)
+    assert gallerydb._pending_writes.get(threading.get_ident()) is None
+
+
+def test_hash_pages(tmp_path):
+    """pages should be hashed like generate_img_hash, stored hashes reused"""
+    import hashlib
+    import io
+
+    pages = {}
+    for n in range(6):
+        path = tmp_path / '{}.jpg'.format(n)
+        path.write_bytes(bytes([n]) * (n * 700000 + 1))
+        pages[n] = str(path)
+    pages[6] = lambda: io.BytesIO(b'in archive')
+    hashes = gallerydb.HashDB._hash_pages(pages, {2: 'stored'}, None, None)
+    assert list(hashes) == list(range(7))
+    assert hashes[2] == 'stored'
+    assert hashes[5] == hashlib.sha1(bytes([5]) * 3500001).hexdigest()
+    assert hashes[6] == hashlib.sha1(b'in archive').hexdigest()
+
+
+@pytest.fixture
+def hash_db(monkeypatch):
+    import sqlite3
+    from version.database import db
+
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(db.STRUCTURE_SCRIPT)
+    conn.executemany('INSERT INTO hashes(hash, series_id, chapter_id, page) VALUES(?, ?, ?, ?)',
+                     [('a', 1, 1, 0), ('b', 1, 1, 1), ('c', 1, 1, 2),
+                      ('a', 2, 2, 0), ('b', 2, 2, 1), ('d', 3, 3, 0)])
+    monkeypatch.setattr(db.DBBase, '_DB_CONN', conn)
+    monkeypatch.setattr(gallerydb, 'MAX_SQL_VARIABLES', 2)
+    yield conn
+    conn.close()
+
+
+def test_count_matches(hash_db):
+    """matches should be counted per gallery across chunks"""
+    assert gallerydb.HashDB.count_matches(['a', 'b', 'c', 'd', 'x', 'a']) == {1: 3, 2: 2, 3: 1}
+    assert gallerydb.HashDB.count_matches([]) == {}
+    # a hash repeated across chunks is counted once
+    assert gallerydb.HashDB.count_matches(['a', 'x', 'a', 'b']) == {1: 2, 2: 2}
+    assert gallerydb.HashDB.find_gallery(['a', 'x', 'a']) is None
+
+
+def test_find_gallery(hash_db):
+    """a gallery should be found only if it has every hash"""
+    assert gallerydb.HashDB.find_gallery(['a', 'b', 'c']).id == 1
+    assert gallerydb.HashDB.find_gallery(['a', 'b']).id == 1
+    # every hash is known, but no gallery has them all
+    assert gallerydb.HashDB.find_gallery(['a', 'd']) is None
+    assert gallerydb.HashDB.find_gallery(['a', 'x']) is None
+    assert gallerydb.HashDB.find_gallery([]) is None
+
+
+def test_gen_galleries_tags(hash_db, monkeypatch):
+    """the tags of the galleries should be fetched in batches, not per gallery"""
+    hash_db.executescript("""
+        INSERT INTO namespaces(namespace_id, namespace) VALUES(1, 'artist'), (2, 'default');
+        INSERT INTO tags(tag_id, tag) VALUES(1, 'foo'), (2, 'bar');
+        INSERT INTO tags_mappings(tags_mappings_id, namespace_id, tag_id) VALUES(1, 1, 1), (2, 2, 2), (3, 2, 1);
+        INSERT INTO series_tags_map(series_id, tags_mappings_id) VALUES(1, 1), (1, 2), (3, 3);""")
+    for s_id in (1, 2, 3):
+        hash_db.execute('INSERT INTO series(series_id, title, profile, series_path) VALUES(?, ?, ?, ?)',
+                        (s_id, 'g{}'.format(s_id), b'', b'missing'))
+    monkeypatch.setattr(gallerydb.TagDB, 'get_gallery_tags', None)
+    rows = hash_db.execute('SELECT * FROM series ORDER BY series_id').fetchall()
+    galleries = gallerydb.GalleryDB.gen_galleries(rows, chapters=False, hashes=False)
+    assert [g.tags for g in galleries] == [{'artist': ['foo'], 'default': ['bar']}, {}, {'default': ['foo']}]
@@ -0,0 +1,58 @@
+"""test monitor module."""
+import os
+
+from watchdog.events import (DirCreatedEvent, DirDeletedEvent, FileDeletedEvent, FileMovedEvent,
+                             FileSystemEventHandler)
+from watchdog.observers import Observer
+
+from version.monitor import ManifestPoller, is_network_path, probe, snapshot_events
+
+
+def test_is_network_path():
+    """the deepest mount point holding the path should decide"""
+    mounts = [('/', 'ext4'), ('/mnt/share', 'cifs'), ('/mnt/share/local', 'ext4'), ('/mnt/nas', 'nfs4')]
+    assert is_network_path('/mnt/share/galleries', mounts)
+    assert is_network_path('/mnt/nas', mounts)
+    assert not is_network_path('/mnt/share/local/x', mounts)
+    assert not is_network_path('/mnt/shared', mounts)
+
+
+def test_snapshot_events(tmp_path):
+    """renamed entries should be moves, by inode"""
+    root = str(tmp_path)
+    (tmp_path / 'new').mkdir()
+    (tmp_path / 'b.zip').write_bytes(b'x')
+    old = {'a.zip': [1, 1, 7], 'gone': [1, 1, 8], 'gone.cbz': [1, 1, 0], 'same': [1, 1, 9]}
+    new = {'b.zip': [1, 1, 7], 'new': [2, 2, 10], 'same': [1, 1, 9]}
+    events = sorted(snapshot_events(root, old, new), key=lambda e: e.src_path)
+    assert [type(e) for e in events] == [FileMovedEvent, DirDeletedEvent, FileDeletedEvent, DirCreatedEvent]
+    assert events[0].src_path == os.path.join(root, 'a.zip') and events[0].dest_path == os.path.join(root, 'b.zip')
+    assert events[3].src_path == os.path.join(root, 'new')
+
+
+def test_poller(tmp_path):
+    """the first poll should only record, later polls dispatch the changes"""
+    events = []
+    poller = ManifestPoller(events.append, 60)
+    poller._roots.append(str(tmp_path))
+    (tmp_path / 'old').mkdir()
+    poller.poll()
+    assert events == []
+    os.rename(str(tmp_path / 'old'), str(tmp_path / 'renamed'))
+    (tmp_path / 'g').mkdir()
+    poller.poll()
+    assert sorted((e.event_type, os.path.basename(e.src_path)) for e in events) == [('created', 'g'), ('moved', 'old')]
+
+
+def test_probe(tmp_path):
+    """a local folder should get events, one that can't be written to can't be probed"""
+    observer = Observer()
+    observer.start()
+    try:
+        watch = observer.schedule(FileSystemEventHandler(), str(tmp_path), recursive=True)
+        assert probe(observer, watch, str(tmp_path))
+        assert probe(observer, watch, str(tmp_path / 'missing')) is None
+        assert os.listdir(str(tmp_path)) == []
+    finally:
+        observer.stop()
+        observer.join()
@@ -0,0 +1,74 @@
+"""test path_index module."""
+import os
+
+from version.gallerydb import Gallery, GalleryDB
+from version.path_index import PathIndex, gallery_paths
+
+
+def _gallery(path, g_id=None, path_in_archive=None):
+    g = Gallery()
+    g.id = g_id
+    g.path = path
+    if path_in_archive is not None:
+        g.is_archive = 1
+        g.path_in_archive = path_in_archive
+    return g
+
+
+def test_contains():
+    """paths should match normalized, galleries in archives by archive and path inside"""
+    index = PathIndex()
+    folder = _gallery(os.path.join('lib', 'Folder'), 1)
+    archive = _gallery(os.path.join('lib', 'a.zip'), 2, 'b/')
+    index.add([folder, archive])
+    assert index.contains(os.path.join('lib', 'Folder', ''))
+    assert not index.contains(os.path.join('lib', 'Other'))
+    assert index.contains(os.path.join('lib', 'a.zip'))
+    assert index.contains(os.path.join('lib', 'a.zip'), 'b')
+    assert index.contains(os.path.join('lib', 'a.zip'), 'b/')
+    assert not index.contains(os.path.join('lib', 'a.zip'), 'c/')
+    assert not index.contains(os.path.join('lib', 'Folder'), '')
+
+
+def test_update_remove():
+    """moving a gallery should reindex it, a shared path should stay until its last gallery is gone"""
+    index = PathIndex()
+    g1 = _gallery(os.path.join('lib', 'a.zip'), 1, 'x/')
+    g2 = _gallery(os.path.join('lib', 'a.zip'), 2, 'y/')
+    index.add([g1, g2])
+    g1.path = os.path.join('moved', 'a.zip')
+    index.update(1)
+    assert index.contains(os.path.join('moved', 'a.zip'), 'x/')
+    assert not index.contains(os.path.join('lib', 'a.zip'), 'x/')
+    assert index.contains(os.path.join('lib', 'a.zip'))
+    index.remove([g2])
+    assert not index.contains(os.path.join('lib', 'a.zip'))
+    assert len(index) == 1
+
+    unindexed = _gallery('other')
+    index.update(unindexed)
+    index.remove([unindexed])
+    assert not index.contains('other') and len(index) == 1
+
+
+def test_check_exists():
+    """check_exists should look in the index unless given a list"""
+    g = _gallery(os.path.join('lib', 'indexed'))
+    gallery_paths.add([g])
+    try:
+        assert GalleryDB.check_exists(os.path.join('lib', 'indexed'))
+        assert not GalleryDB.check_exists(os.path.join('lib', 'missing'))
+        assert not GalleryDB.check_exists(os.path.join('lib', 'indexed'), [_gallery('x')])
+    finally:
+        gallery_paths.remove([g])
+
+
+def test_lookup():
+    """lookup should return the galleries in the DB at each path"""
+    index = PathIndex()
+    g1 = _gallery(os.path.join('lib', 'a.zip'), 2, 'x/')
+    g2 = _gallery(os.path.join('lib', 'a.zip'), 1, 'y/')
+    new = _gallery(os.path.join('lib', 'new'))
+    index.add([g1, g2, new])
+    paths = [os.path.join('lib', 'a.zip'), os.path.join('lib', 'new'), os.path.join('lib', 'missing')]
+    assert index.lookup(paths) == {os.path.join('lib', 'a.zip'): [g2, g1]}
@@ -0,0 +1,70 @@
+"""test scan_manifest module."""
+import os
+
+from version.scan_manifest import ScanManifest
+
+
+def _later(path):
+    """bumps the mtime, file systems with coarse timestamps might not see a quick change"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_only_changed_entries(tmp_path):
+    """a rescan should only return new and changed entries"""
+    root = tmp_path / 'galleries'
+    root.mkdir()
+    for n in range(5):
+        (root / 'g{}'.format(n)).mkdir()
+    (root / 'a.zip').write_bytes(b'zip')
+    manifest = ScanManifest(str(tmp_path / 'manifest.json'))
+    snap = manifest.snapshot(str(root))
+    assert len(manifest.changed(str(root), snap)) == 6
+    manifest.record(str(root), snap)
+    assert manifest.changed(str(root), manifest.snapshot(str(root))) == []
+
+    (root / 'g1' / '1.jpg').write_bytes(b'')
+    _later(str(root / 'g1'))
+    (root / 'new').mkdir()
+    (root / 'a.zip').write_bytes(b'bigger zip')
+    changed = manifest.changed(str(root), manifest.snapshot(str(root)))
+    assert sorted(os.path.basename(p) for p in changed) == ['a.zip', 'g1', 'new']
+    assert all(os.path.dirname(p) == str(root) for p in changed)
+
+
+def test_manifest_persists(tmp_path):
+    """the manifest should survive a restart and forget should force a full scan"""
+    root = tmp_path / 'galleries'
+    root.mkdir()
+    (root / 'g').mkdir()
+    path = str(tmp_path / 'db' / 'manifest.json')
+    manifest = ScanManifest(path)
+    manifest.record(str(root), manifest.snapshot(str(root)))
+    manifest.save()
+    manifest = ScanManifest(path)
+    assert manifest.changed(str(root), manifest.snapshot(str(root))) == []
+    manifest.forget(str(root))
+    assert len(manifest.changed(str(root), manifest.snapshot(str(root)))) == 1
+
+
+def test_corrupt_manifest(tmp_path):
+    """a corrupt manifest should mean scanning everything"""
+    path = tmp_path / 'manifest.json'
+    path.write_text('{')
+    root = tmp_path / 'galleries'
+    root.mkdir()
+    (root / 'g').mkdir()
+    manifest = ScanManifest(str(path))
+    assert len(manifest.changed(str(root), manifest.snapshot(str(root)))) == 1
+
+
+def test_forget_entry(tmp_path):
+    """forgetting a gallery path should rescan the top level entry holding it"""
+    root = tmp_path / 'galleries'
+    (root / 'series' / 'g1').mkdir(parents=True)
+    (root / 'g2').mkdir()
+    manifest = ScanManifest(None)
+    manifest.record(str(root), manifest.snapshot(str(root)))
+    manifest.forget_entry(str(root / 'series' / 'g1'))
+    manifest.forget_entry(str(tmp_path / 'elsewhere'))
+    assert manifest.changed(str(root), manifest.snapshot(str(root))) == [str(root / 'series')]
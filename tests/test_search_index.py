@@ -0,0 +1,97 @@
+"""test search_index module."""
+import datetime
+import random
+from itertools import product
+
+import pytest
+
+from version import app_constants
+from version.gallerydb import Gallery
+from version.search_index import SearchIndex, SearchTerm, narrows
+
+WORDS = ['love', 'Lovely', 'sister', 'school', 'LIVE', 'lo', 'Vanilla', 'maid', 'x']
+NAMESPACES = ['default', 'female', 'male', 'Artist', 'Rating']
+TERMS = [
+    'lo', 'love', 'Love', 'ove', 'x', '-lo', 'school', 'artist:van', 'Artist:vanilla', 'title:sis',
+    'female:maid', 'Female:maid', 'language:eng', 'lang:jap', 'type:manga', 'status:none', 'descr:live',
+    'rating:3', 'rating:>3', 'rating:<3', 'stars:>x', 'chapters:2', 'chapter:>1', 'read_count:<1',
+    'date_added:>2016-01-01', 'date_added:<02/01/2016', 'pub_date:2015-05-05', 'last_read:>2000-01-01',
+    'artist:>1', 'url:none', ':maid', 'tag:none', '-female:maid', '-rating:>2', 'lo:ve',
+    'l.ve', '^sis', '[', 'fe.*:ma', 'path:none', 'pub_date:none', 'lang:none', 'rating:x', 'date_added:x', '-',
+    'lov', 'title:sist', 'artist:v', 'female:mai', '-l', 'rating:>30', 'Artist:none', 'artist:nonex',
+]
+ARGS = [[], [app_constants.Search.Case], [app_constants.Search.Strict], [app_constants.Search.Regex],
+        [app_constants.Search.Case, app_constants.Search.Strict]]
+
+
+def _random_gallery(rnd, g_id):
+    g = Gallery()
+    g.id = g_id
+    g.title = ' '.join(rnd.sample(WORDS, rnd.randint(0, 3)))
+    g.artist = rnd.choice(WORDS + [''])
+    g.language = rnd.choice(['English', 'Japanese', ''])
+    g.type = rnd.choice(['Manga', 'Doujinshi', ''])
+    g.status = rnd.choice(['Completed', 'Unknown', ''])
+    g.info = rnd.choice(['live action', 'No description..', ''])
+    g.rating = rnd.randint(0, 5)
+    g.times_read = rnd.randint(0, 2)
+    g.date_added = datetime.datetime(2015 + rnd.randint(0, 2), rnd.randint(1, 12), rnd.randint(1, 28))
+    g.pub_date = rnd.choice([None, datetime.datetime(2015, 5, 5)])
+    g.last_read = rnd.choice([None, datetime.datetime(2016, 1, 1)])
+    g.tags = {ns: rnd.sample(WORDS, rnd.randint(0, 3)) for ns in rnd.sample(NAMESPACES, rnd.randint(0, 3))}
+    for n in range(rnd.randint(1, 3)):
+        g.chapters.create_chapter(n)
+    return g
+
+
+@pytest.fixture(scope='module')
+def galleries():
+    rnd = random.Random(0)
+    return [_random_gallery(rnd, n) for n in range(1, 301)]
+
+
+@pytest.mark.parametrize('term, args', list(product(TERMS, ARGS)))
+def test_search_parity(galleries, term, args):
+    """the index should find exactly what Gallery.contains finds"""
+    index = SearchIndex()
+    index.add(galleries)
+    expected = [g for g in galleries if g.contains(term, args)]
+    assert index.search(galleries, [term], args) == expected
+
+
+@pytest.mark.parametrize('term, args', list(product(TERMS, ARGS)))
+def test_compiled_term_parity(galleries, term, args):
+    """a compiled term should match exactly like Gallery.contains"""
+    compiled = SearchTerm(term, args)
+    for g in galleries:
+        assert compiled.matches(g) == g.contains(term, args), g.id
+
+
+def test_incremental_update(galleries):
+    """modified and removed galleries should be reflected in the search results"""
+    index = SearchIndex()
+    index.add(galleries)
+    g = galleries[0]
+    old_title = g.title
+    g.title = 'unique snowflake'
+    index.update(g.id)
+    assert index.search(galleries, ['snowflake'], []) == [g]
+    index.remove([g.id])
+    assert index.match(['snowflake'], [])[0] == set()
+    # not indexed galleries are still searched
+    assert index.search(galleries, ['snowflake'], []) == [g]
+    g.title = old_title
+
+
+@pytest.mark.parametrize('args', ARGS)
+def test_narrows(galleries, args):
+    """a search narrowing the previous one should only find galleries the previous one found"""
+    found = {t: {g.id for g in galleries if g.contains(t, args)} for t in TERMS}
+    narrowed = 0
+    for new, old in product(TERMS, TERMS):
+        if narrows([SearchTerm(new, args)], [SearchTerm(old, args)]):
+            narrowed += 1
+            assert found[new] <= found[old], (new, old)
+    assert narrowed >= len(TERMS)
+    assert narrows([SearchTerm('lo', args), SearchTerm('x', args)], [SearchTerm('lo', args)])
+    assert not narrows([SearchTerm('lo', args)], [SearchTerm('lo', args), SearchTerm('x', args)])
@@ -0,0 +1,19 @@
+"""test thumbnail_render module."""
+import io
+
+from PIL import Image
+
+from version.thumbnail_render import render_thumbnails
+
+
+def test_render_thumbnails(tmp_path):
+    """every size should be rendered keeping the aspect ratio, with transparent corners"""
+    path = str(tmp_path / 'cover.jpg')
+    Image.new('RGB', (800, 1200), 'red').save(path)
+    thumbs = render_thumbnails(path, [(143, 200), (140, 93)])
+    sizes = {size: Image.open(io.BytesIO(data)) for size, data in thumbs.items()}
+    assert sizes[(143, 200)].size == (133, 200)
+    assert sizes[(140, 93)].size == (62, 93)
+    for im in sizes.values():
+        assert im.getpixel((0, 0))[3] < 16
+        assert im.getpixel((im.width // 2, im.height // 2))[3] == 255
@@ -0,0 +1,92 @@
+"""test thumbnail_store module."""
+import os
+
+from version import thumbnail_store as ts
+from version.thumbnail_store import ThumbnailStore
+
+
+def _writer(data):
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+        return True
+    return write
+
+
+def _source(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_dedupe(tmp_path):
+    """the same cover should only be stored once per size"""
+    store = ThumbnailStore(str(tmp_path / 'thumbs'))
+    a = _source(tmp_path, 'a.jpg', b'cover')
+    b = _source(tmp_path, 'b.jpg', b'cover')
+    path = store.put(store.key(a, (10, 10)), _writer(b'x' * 10))
+    assert store.put(store.key(b, (10, 10)), _writer(b'y' * 10)) == path
+    assert store.put(store.key(b, (20, 20)), _writer(b'y' * 10)) != path
+    assert len([f for f in os.listdir(store.path) if f.endswith('.png')]) == 2
+
+
+def test_lru_eviction(tmp_path):
+    """the least recently used thumbnails should go first when over budget"""
+    store = ThumbnailStore(str(tmp_path / 'thumbs'), budget=30)
+    paths = [store.put('k{}'.format(n), _writer(b'x' * 10)) for n in range(3)]
+    store.touch(paths[0])
+    store.put('k3', _writer(b'x' * 10))
+    assert store.size <= 30
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
+
+
+def test_index_persists(tmp_path):
+    """the index should survive a restart"""
+    store = ThumbnailStore(str(tmp_path / 'thumbs'))
+    store.put('k', _writer(b'x' * 10))
+    store.save()
+    store = ThumbnailStore(str(tmp_path / 'thumbs'))
+    assert store.size == 10
+    assert store.get('k') == store.file_path('k')
+
+
+def test_sweep(tmp_path, monkeypatch):
+    """files no gallery uses should be deleted and legacy files indexed"""
+    store = ThumbnailStore(str(tmp_path / 'thumbs'))
+    used = store.put('used', _writer(b'x' * 10))
+    unused = store.put('unused', _writer(b'x' * 10))
+    legacy = os.path.join(store.path, 'legacy.png')
+    with open(legacy, 'wb') as f:
+        f.write(b'x' * 5)
+    monkeypatch.setattr(ts, 'SWEEP_GRACE', -1)
+    assert store.sweep([used, legacy, None]) == 1
+    assert not os.path.exists(unused)
+    assert store.owns(legacy)
+    assert store.size == 15
+
+
+def test_sweep_keeps_other_sizes(tmp_path, monkeypatch):
+    """the other sizes of a used thumbnail are used as well"""
+    store = ThumbnailStore(str(tmp_path / 'thumbs'))
+    img_hash = store.source_hash(_source(tmp_path, 'a.jpg', b'cover'))
+    big = store.put(store.sized_key(img_hash, (20, 20)), _writer(b'x' * 10))
+    small = store.put(store.sized_key(img_hash, (10, 10)), _writer(b'x' * 5))
+    assert store.sized_path(big, (10, 10)) == small
+    assert store.sized_path(os.path.join(store.path, 'legacy.png'), (10, 10)) is None
+    monkeypatch.setattr(ts, 'SWEEP_GRACE', -1)
+    assert store.sweep([big]) == 0
+    assert os.path.exists(small)
+
+
+def test_released_evicted_first(tmp_path):
+    """a released thumbnail should be evicted before the least recently used one"""
+    store = ThumbnailStore(str(tmp_path / 'thumbs'), budget=30)
+    paths = [store.put('k{}'.format(n), _writer(b'x' * 10)) for n in range(3)]
+    store.release(paths[2])
+    store.get('k0')
+    store.put('k3', _writer(b'x' * 10))
+    store.put('k4', _writer(b'x' * 10))
+    assert [os.path.exists(p) for p in paths] == [True, False, False]
+    store.save()
+    assert list(ThumbnailStore(store.path)._load()) == ['k0.png', 'k3.png', 'k4.png']
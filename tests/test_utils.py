@@ -1,10 +1,13 @@
 """test utils module."""
+import zipfile
 from unittest import mock
 from itertools import product
 
 import pytest
 
-from version.utils import backup_database
+from version import app_constants
+from version import utils
+from version.utils import backup_database, get_gallery_img, GMetafile, ArchiveFile, check_archive
 
 
 @pytest.mark.parametrize(
@@ -62,3 +65,152 @@ def test_run_backup_database(mock_exists_retval, mock_isdir_retval):
         else:
             mock_os.mkdir.assert_called_once_with(mock_os.path.join.return_value)
         mock_os.assert_has_calls(os_calls, any_order=True)
+
+
+def test_archive_cover_and_metafile_in_memory(tmp_path, monkeypatch):
+    """archive covers and metafiles should be read without extracting anything"""
+    temp_dir = tmp_path / 'temp'
+    temp_dir.mkdir()
+    monkeypatch.setattr(app_constants, 'temp_dir', str(temp_dir))
+    path = str(tmp_path / 'gallery.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('02.jpg', b'second')
+        z.writestr('01.jpg', b'first')
+        z.writestr('info.txt', 'TITLE: hello\n')
+
+    img = get_gallery_img(path, in_memory=True)
+    assert img.name == '01.jpg'
+    assert img.read() == b'first'
+    assert GMetafile('', path).metadata['title'] == 'hello'
+    assert not list(temp_dir.iterdir())
+
+
+def test_open_archive_shared(tmp_path):
+    """check_archive and GMetafile should use an open ArchiveFile and leave it open"""
+    path = str(tmp_path / 'gallery.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        for name in ('a/', 'b/'):
+            z.writestr(name, b'')
+        z.writestr('a/01.jpg', b'first')
+        z.writestr('a/info.txt', 'TITLE: hello\n')
+        z.writestr('b/01.jpg', b'first')
+    arch = ArchiveFile(path)
+    assert check_archive(arch) == ['b/']
+    assert GMetafile('a/', arch).metadata['title'] == 'hello'
+    assert arch.dir_contents('b/') == ['b/01.jpg']
+    arch.close()
+    utils.archive_handles.close(path)
+
+
+ZIP_NAMES = ['cover.jpg', '.hidden.jpg', 'a/', 'a/1.jpg', 'a/2.png', 'a/b/', 'a/b/1.jpg', 'a/info.txt',
+             'ab/', 'ab/1.jpg', 'c/1.jpg', 'c/d/', 'c/d/2.jpg']
+
+
+def _legacy_dir_contents(names, dir_name):
+    """ArchiveFile.dir_contents for zips before the names were indexed"""
+    if not dir_name:
+        return [x for x in names if x.count('/') == 0 or (x.count('/') == 1 and x.endswith('/'))]
+    dir_con_start = [x for x in names if x.startswith(dir_name)]
+    return [x for x in dir_con_start if x.count('/') == dir_name.count('/')
+            and (x.count('/') == dir_name.count('/') and not x.endswith('/'))
+            or (x.count('/') == 1 + dir_name.count('/') and x.endswith('/'))]
+
+
+def test_archive_index(tmp_path):
+    """directory queries should answer the same as scanning all names"""
+    path = str(tmp_path / 'gallery.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        for name in ZIP_NAMES:
+            z.writestr(name, b'')
+    arch = ArchiveFile(path)
+    for name in [''] + ZIP_NAMES:
+        assert arch.dir_contents(name) == _legacy_dir_contents(ZIP_NAMES, name), name
+    assert arch.dir_list() == ['a/', 'a/b/', 'ab/', 'c/d/']
+    assert arch.dir_list(True) == ['a/', 'ab/']
+    assert arch.is_dir('a/b/') and not arch.is_dir('a/1.jpg')
+    assert arch.dir_images('') == ['cover.jpg']
+    assert arch.dir_images('a/') == ['a/1.jpg', 'a/2.png']
+    assert sorted(arch._with_prefix('a/')) == ['a/', 'a/1.jpg', 'a/2.png', 'a/b/', 'a/b/1.jpg', 'a/info.txt']
+    with pytest.raises(app_constants.FileNotFoundInArchive):
+        arch.dir_contents('x/')
+    arch.close()
+    assert check_archive(path) == ['a/b/', 'ab/', 'c/d/']
+
+
+def _corrupt_zip(tmp_path):
+    path = str(tmp_path / 'bad.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr('1.jpg', b'x' * 100)
+    with open(path, 'r+b') as f:
+        data = f.read()
+        f.seek(data.index(b'x' * 100))
+        f.write(b'y')
+    return path
+
+
+@pytest.mark.parametrize('policy, opens', [('always', False), ('on import', True), ('never', True)])
+def test_archive_integrity_policy(tmp_path, monkeypatch, policy, opens):
+    """corrupt archives should only be refused when the policy asks for a check"""
+    monkeypatch.setattr(app_constants, 'ARCHIVE_INTEGRITY_CHECK', policy)
+    path = _corrupt_zip(tmp_path)
+    if opens:
+        ArchiveFile(path).close()
+    else:
+        with pytest.raises(app_constants.CreateArchiveFail):
+            ArchiveFile(path)
+    if policy != 'never':
+        with pytest.raises(app_constants.CreateArchiveFail):
+            ArchiveFile(path, importing=True)
+    utils.archive_handles.close(path)
+
+
+def test_archive_integrity_cached(tmp_path, monkeypatch):
+    """an unchanged archive should only be tested once"""
+    monkeypatch.setattr(app_constants, 'ARCHIVE_INTEGRITY_CHECK', 'always')
+    path = str(tmp_path / 'gallery.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('1.jpg', b'x')
+    with mock.patch.object(utils, '_test_archive', wraps=utils._test_archive) as test:
+        ArchiveFile(path).close()
+        ArchiveFile(path).close()
+        assert test.call_count == 1
+    utils.archive_handles.close(path)
+
+
+def test_archive_handles_shared(tmp_path):
+    """opening an archive again should reuse the open handle until the file is deleted"""
+    path = str(tmp_path / 'gallery.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('a/1.jpg', b'x')
+    first = ArchiveFile(path)
+    second = ArchiveFile(path)
+    assert first.archive is second.archive
+    first.close()
+    second.close()
+    archive = ArchiveFile(path).archive
+    assert archive.fp is not None
+    utils.archive_handles.close(str(tmp_path))
+    assert archive.fp is None
+    assert ArchiveFile(path).archive is not archive
+    utils.archive_handles.close(path)
+
+
+def test_archive_handles_idle(tmp_path):
+    """archives nobody uses should be closed after the idle time, the used ones kept"""
+    now = [0.0]
+    handles = utils._ArchiveHandles(8, 5, lambda: now[0])
+    paths = []
+    for name in ('a.zip', 'b.zip'):
+        paths.append(str(tmp_path / name))
+        with zipfile.ZipFile(paths[-1], 'w') as z:
+            z.writestr('1.jpg', b'x')
+    idle, used = handles.acquire(paths[0]), handles.acquire(paths[1])
+    handles.release(idle)
+    now[0] = 4
+    handles.close_idle()
+    assert idle.archive.fp is not None
+    now[0] = 5
+    handles.close_idle()
+    assert idle.archive.fp is None and used.archive.fp is not None
+    assert handles.acquire(paths[0]) is not idle
+    handles.close()
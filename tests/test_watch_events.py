@@ -0,0 +1,99 @@
+"""test watch_events module."""
+import os
+
+from version.watch_events import EventCoalescer, ExpiringSet, tree_signature
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _coalescer(signatures=None):
+    clock = Clock()
+    signatures = {} if signatures is None else signatures
+    return EventCoalescer(2, lambda p: signatures.get(p, (1, 1, 1)), clock), clock, signatures
+
+
+def test_copy_folder_is_one_event():
+    """events under a created folder should only delay it until it stops changing"""
+    events, clock, signatures = _coalescer()
+    root = os.path.join('lib', 'new')
+    events.created(root)
+    for n in range(500):
+        clock.now += 0.01
+        assert events.touched(os.path.join(root, 'g{}'.format(n), '1.jpg'))
+    assert not events.touched(os.path.join('lib', 'other'))
+    clock.now += 1
+    assert events.pop_ready() == ([], [], [])
+    clock.now += 1.5
+    # first check only records the signature
+    assert events.pop_ready() == ([], [], [])
+    signatures[root] = (2, 2, 2)
+    clock.now += 2
+    assert events.pop_ready() == ([], [], [])
+    clock.now += 2
+    assert events.pop_ready() == ([root], [], [])
+    assert len(events) == 0 and events.next_due() is None
+
+
+def test_coalesce():
+    """a path's events should merge into the last state"""
+    events, clock, signatures = _coalescer()
+    events.created('tmp.zip')
+    events.deleted('tmp.zip')
+    events.moved('a.zip', 'b.zip')
+    events.moved('b.zip', 'c.zip')
+    events.moved('x.zip', 'y.zip')
+    events.deleted('y.zip')
+    events.moved('m.zip', 'n.zip')
+    events.moved('n.zip', 'm.zip')
+    events.created('part.zip')
+    events.moved('part.zip', 'done.zip')
+    signatures['gone.zip'] = None
+    events.created('gone.zip')
+    assert len(events) == 4
+    clock.now += 2
+    assert events.pop_ready() == ([], ['x.zip'], [('a.zip', 'c.zip')])
+    clock.now += 2
+    assert events.pop_ready() == (['done.zip'], [], [])
+
+
+def test_folder_events():
+    """deleting or moving a folder should keep the events of the galleries in it"""
+    events, clock, _ = _coalescer()
+    events.deleted(os.path.join('lib', 'a', 'g1'))
+    events.deleted(os.path.join('lib', 'a'))
+    events.moved(os.path.join('lib', 'b', 'g2'), os.path.join('lib', 'b', 'g3'))
+    events.moved(os.path.join('lib', 'b'), os.path.join('lib', 'c'))
+    clock.now += 2
+    _, deleted, moved = events.pop_ready()
+    assert sorted(deleted) == [os.path.join('lib', 'a'), os.path.join('lib', 'a', 'g1')]
+    assert sorted(moved) == [(os.path.join('lib', 'b'), os.path.join('lib', 'c')),
+                             (os.path.join('lib', 'b', 'g2'), os.path.join('lib', 'c', 'g3'))]
+
+
+def test_tree_signature(tmp_path):
+    assert tree_signature(str(tmp_path / 'missing')) is None
+    (tmp_path / 'g').mkdir()
+    (tmp_path / 'g' / '1.jpg').write_bytes(b'x')
+    before = tree_signature(str(tmp_path))
+    (tmp_path / 'g' / '1.jpg').write_bytes(b'xyz')
+    assert tree_signature(str(tmp_path)) != before
+
+
+def test_expiring_set():
+    clock = Clock()
+    ignored = ExpiringSet(60, clock)
+    ignored.add('a')
+    clock.now += 30
+    ignored.add('b')
+    clock.now += 20
+    ignored.add('a')
+    clock.now += 45
+    assert 'a' in ignored and 'b' not in ignored and len(ignored) == 1
+    ignored.discard('a')
+    assert 'a' not in ignored
@@ -15,6 +15,7 @@
 import logging
 import os
 import sys
+import time
 import traceback
 from typing import List
 
@@ -43,7 +44,10 @@ from . import pewnet
 from . import utils
 from . import misc_db
 from . import database
+from . import duplicates
 from .executors import Executors
+from .scan_manifest import scan_manifest
+from .thumbnail_store import thumbnail_store
 
 log = logging.getLogger(__name__)
 log_i = log.info
@@ -135,20 +139,22 @@ class AppWindow(QMainWindow):
                 log_e('Could not find gallery to update from watcher')
             self.default_manga_view.replace_gallery(g, False)
 
-        def created(path):
-            self.gallery_populate([path])
+        def created(paths):
+            self.gallery_populate(paths)
 
         def modified(path, gallery):
             mod_popup = io_misc.ModifiedPopup(path, gallery, self)
 
-        def deleted(path, gallery):
-            d_popup = io_misc.DeletedPopup(path, gallery, self)
-            d_popup.UPDATE_SIGNAL.connect(update_gallery)
-            d_popup.REMOVE_SIGNAL.connect(remove_gallery)
+        def deleted(galleries):
+            for path, g in galleries:
+                d_popup = io_misc.DeletedPopup(path, g, self)
+                d_popup.UPDATE_SIGNAL.connect(update_gallery)
+                d_popup.REMOVE_SIGNAL.connect(remove_gallery)
 
-        def moved(new_path, gallery):
-            mov_popup = io_misc.MovedPopup(new_path, gallery, self)
-            mov_popup.UPDATE_SIGNAL.connect(update_gallery)
+        def moved(galleries):
+            for new_path, g in galleries:
+                mov_popup = io_misc.MovedPopup(new_path, g, self)
+                mov_popup.UPDATE_SIGNAL.connect(update_gallery)
 
         self.watchers = io_misc.Watchers()
         self.watchers.gallery_handler.CREATE_SIGNAL.connect(created)
@@ -573,7 +579,7 @@ class AppWindow(QMainWindow):
         gallery_menu.addSeparator()
         scan_galleries_action = QAction('Scan for new galleries', self)
         scan_galleries_action.setIcon(app_constants.SPINNER_ICON)
-        scan_galleries_action.triggered.connect(self.scan_for_new_galleries)
+        scan_galleries_action.triggered.connect(lambda: self.scan_for_new_galleries(full=True))
         scan_galleries_action.setStatusTip('Scan monitored folders for new galleries')
         scan_galleries_action.setShortcut(scan_galleries_k)
         gallery_menu.addAction(scan_galleries_action)
@@ -582,6 +588,11 @@ class AppWindow(QMainWindow):
         duplicate_check_simple.setIcon(app_constants.DUPLICATE_ICON)
         duplicate_check_simple.triggered.connect(lambda: self.duplicate_check())  # triggered emits False
         gallery_menu.addAction(duplicate_check_simple)
+        duplicate_check_advanced = QAction("Check for duplicate galleries by pages", self)
+        duplicate_check_advanced.setIcon(app_constants.DUPLICATE_ICON)
+        duplicate_check_advanced.setStatusTip('Finds galleries with similar pages, also when resized or re-encoded')
+        duplicate_check_advanced.triggered.connect(lambda: self.duplicate_check(False))
+        gallery_menu.addAction(duplicate_check_advanced)
 
         self.toolbar.addWidget(gallery_action)
 
@@ -881,6 +892,7 @@ class AppWindow(QMainWindow):
             self.g_populate_inst = fetch.Fetch()
             self.g_populate_inst.series_path = path
             self._g_populate_count = 0
+            started = time.monotonic()
 
             fetch_spinner = misc.Spinner(self)
             fetch_spinner.set_size(60)
@@ -928,7 +940,8 @@ class AppWindow(QMainWindow):
                     list_wid.show()
 
             def a_progress(prog):
-                fetch_spinner.set_text("Populating... {}/{}".format(prog, self._g_populate_count))
+                rate = prog / max(time.monotonic() - started, 0.001)
+                fetch_spinner.set_text("Populating... {}/{} ({:.0f}/s)".format(prog, self._g_populate_count, rate))
 
             def add_to_model(gallery):
                 self.addition_tab.view.add_gallery(gallery, app_constants.KEEP_ADDED_GALLERIES)
@@ -949,7 +962,8 @@ class AppWindow(QMainWindow):
             # self.g_populate_inst.local()
             log_i('Populating DB from directory/archive')
 
-    def scan_for_new_galleries(self):
+    def scan_for_new_galleries(self, full=False):
+        """Scans the monitored folders, only what changed since the last scan unless full is set"""
         available_folders = app_constants.ENABLE_MONITOR and \
                             app_constants.MONITOR_PATHS and all(app_constants.MONITOR_PATHS)
         if available_folders and not app_constants.SCANNING_FOR_GALLERIES:
@@ -972,21 +986,49 @@ class AppWindow(QMainWindow):
                             self.addition_tab.click()
                             self._switched = True
 
+                    @staticmethod
+                    def monitored_entry(path, monitored):
+                        """Returns the normcased entry of a monitored folder the path is in, or the path"""
+                        path = os.path.normcase(os.path.normpath(path))
+                        for m in monitored:
+                            m = os.path.normcase(os.path.normpath(m))
+                            if path.startswith(os.path.join(m, '')):
+                                return os.path.join(m, os.path.relpath(path, m).split(os.sep)[0])
+                        return path
+
                     def scan_dirs(self):
+                        # only the entries new or changed since the last scan are scanned again,
+                        # everything is when asked to or the library is empty, e.g. a new database
+                        if full or not app_constants.GALLERY_DATA:
+                            scan_manifest.forget()
                         paths = []
+                        snapshots = {}
                         for p in app_constants.MONITOR_PATHS:
-                            if os.path.exists(p):
-                                dir_content = scandir.scandir(p)
-                                for d in dir_content:
-                                    paths.append(d.path)
-                            else:
+                            try:
+                                snapshots[p] = scan_manifest.snapshot(p)
+                            except OSError:
                                 log_e("Monitored path does not exists: {}".format(p.encode(errors='ignore')))
-
-                        self.fetch_inst.series_path = paths
-                        self.fetch_inst.LOCAL_EMITTER.connect(
-                            lambda g: self.addition_view.add_gallery(g, app_constants.KEEP_ADDED_GALLERIES))
-                        self.fetch_inst.LOCAL_EMITTER.connect(self.switch_tab)
-                        self.fetch_inst.local()
+                                continue
+                            paths.extend(scan_manifest.changed(p, snapshots[p]))
+                        log_i('{} new or changed paths in monitored folders'.format(len(paths)))
+
+                        if paths:
+                            self.fetch_inst.series_path = paths
+                            self.fetch_inst.LOCAL_EMITTER.connect(
+                                lambda g: self.addition_view.add_gallery(g, app_constants.KEEP_ADDED_GALLERIES))
+                            self.fetch_inst.LOCAL_EMITTER.connect(self.switch_tab)
+                            self.fetch_inst.local()
+                        # entries that failed are left out, so they are scanned again next time
+                        skipped = set(self.fetch_inst.failed_entries) if paths else set()
+                        if not app_constants.KEEP_ADDED_GALLERIES:
+                            # galleries only in the addition view are gone on exit, so are offered again next time
+                            skipped.update(g.path for g in self.fetch_inst._data if paths)
+                            skipped.update(g.path for g in self.addition_view.gallery_model._data if g.id is None)
+                        skipped = {self.monitored_entry(s, snapshots) for s in skipped}
+                        for p, snap in snapshots.items():
+                            scan_manifest.record(p, {name: state for name, state in snap.items()
+                                                     if os.path.normcase(os.path.join(p, name)) not in skipped})
+                        scan_manifest.save()
                         # contents = []
                         # for g in self.scanned_data:
                         #	contents.append(g)
@@ -1111,6 +1153,15 @@ class AppWindow(QMainWindow):
         except:
             log.exception('Flush temp on exit: FAIL')
 
+        # thumbnails
+        try:
+            thumbnail_store.save()
+        except:
+            log.exception('Failed to save thumbnail index')
+
+        # entries forgotten since the last scan, e.g. of removed galleries
+        scan_manifest.save()
+
         # DB
         try:
             log_i("Analyzing database...")
@@ -1173,6 +1224,8 @@ class AppWindow(QMainWindow):
 
         class DuplicateCheck(QObject):
             found_duplicates: pyqtBoundSignal = pyqtSignal(tuple)
+            # (galleries of the group, galleries of it not in the tab yet)
+            merged_duplicates: pyqtBoundSignal = pyqtSignal(tuple, tuple)
             finished: pyqtBoundSignal = pyqtSignal()
 
             def __init__(self):
@@ -1180,31 +1233,69 @@ class AppWindow(QMainWindow):
 
             def checkSimple(self, model):
                 galleries: List[gallerydb.Gallery] = model._data
+                fuzzy = app_constants.DUPLICATE_FUZZY_TITLES
+                groups = duplicates.group_duplicates(
+                    (n, duplicates.gallery_buckets(g, fuzzy)) for n, g in enumerate(galleries))
+                for group in groups:
+                    self.found_duplicates.emit(tuple(galleries[n] for n in group))
+                notifbar.add_text('Found {} groups of duplicates'.format(len(groups)))
+                self.finished.emit()
 
-                duplicates = []
-                g: gallerydb.Gallery
-                for n, g in enumerate(galleries, 1):
-                    notifbar.add_text('Checking gallery {}'.format(n))
-                    log_d('Checking gallery {}'.format(g.title.encode(errors="ignore")))
-                    y: gallerydb.Gallery
-                    for y in galleries:
-                        title = g.title.strip().lower() == y.title.strip().lower()
-                        path = os.path.normcase(g.path) == os.path.normcase(y.path)
-                        if g.id != y.id and (title or path):
-                            if g not in duplicates:
-                                duplicates.append(y)
-                                duplicates.append(g)
-                                self.found_duplicates.emit((g, y))
+            def checkAdvanced(self, model):
+                galleries: List[gallerydb.Gallery] = model._data
+                stored = gallerydb.execute(gallerydb.HashDB.get_all_phashes, False)
+                new = {}
+
+                def gallery_hashes():
+                    for n, g in enumerate(galleries):
+                        if not n % 100:
+                            notifbar.add_text('Checking gallery {} of {}'.format(n + 1, len(galleries)))
+                        hashes = stored.get(g.id)
+                        if hashes is None:
+                            page_hashes = gallerydb.HashDB.gen_gallery_phashes(g, app_constants.DUPLICATE_SAMPLE_PAGES)
+                            if page_hashes and g.id is not None:
+                                new[g.id] = page_hashes
+                                if len(new) >= 100:
+                                    gallerydb.execute(gallerydb.HashDB.add_phashes, True, new.copy())
+                                    new.clear()
+                            hashes = list(page_hashes.values())
+                        yield n, hashes
+
+                groups = duplicates.SimilarGroups()
+                for a, b in duplicates.find_similar(gallery_hashes(), app_constants.DUPLICATE_IMAGE_DISTANCE):
+                    found = groups.add(a, b)
+                    if found is None:
+                        continue
+                    group, added = found
+                    if len(added) == len(group):
+                        self.found_duplicates.emit(tuple(galleries[n] for n in group))
+                    else:
+                        self.merged_duplicates.emit(tuple(galleries[n] for n in group),
+                                                    tuple(galleries[n] for n in added))
+                if new:
+                    gallerydb.execute(gallerydb.HashDB.add_phashes, True, new)
+                notifbar.add_text('Found {} groups of duplicates'.format(len(groups)))
                 self.finished.emit()
 
         self._d_checker = DuplicateCheck()
         self._d_checker.moveToThread(app_constants.GENERAL_THREAD)
+        def merge_duplicates(group, added):
+            # the tab is sorted by the time a group was added, the group keeps the time of its first gallery
+            for g in group:
+                g.qtime = group[0].qtime
+            if added:
+                dup_tab.view.add_gallery(added)
+            dup_tab.view.sort_model.invalidate()
+
         self._d_checker.found_duplicates.connect(lambda t: dup_tab.view.add_gallery(t, record_time=True))
+        self._d_checker.merged_duplicates.connect(merge_duplicates)
         self._d_checker.finished.connect(dup_tab.click)
         self._d_checker.finished.connect(self._d_checker.deleteLater)
         self._d_checker.finished.connect(duplicate_spinner.before_hide)
         if simple:
             self.duplicate_check_invoker.connect(self._d_checker.checkSimple)
+        else:
+            self.duplicate_check_invoker.connect(self._d_checker.checkAdvanced)
         self.duplicate_check_invoker.emit(self.default_manga_view.gallery_model)
 
     def excepthook(self, ex_type, ex, tb):
@@ -24,6 +24,7 @@ from PyQt5.QtGui import QIcon
 
 from . import settings
 from .database import db_constants
+from .watch_events import ExpiringSet
 
 if TYPE_CHECKING:
     from . import gallerydb
@@ -97,6 +98,7 @@ THUMB_W_SIZE = 133 + SIZE_FACTOR
 
 THUMB_DEFAULT = (THUMB_W_SIZE, THUMB_H_SIZE)
 THUMB_SMALL = (140, 93)
+THUMB_SIZES = (THUMB_DEFAULT, THUMB_SMALL)  # thumbnails are generated in all these sizes at once
 
 # Columns
 COLUMNS = tuple(range(11))
@@ -235,7 +237,12 @@ MONITOR_PATHS = [p for p in get([], 'Application', 'monitor paths', list) if os.
 IGNORE_PATHS = get([], 'Application', 'ignore paths', list)
 IGNORE_EXTS = get([], 'Application', 'ignore exts', list)
 SCANNING_FOR_GALLERIES = False  # if a scan for new galleries is being done
-TEMP_PATH_IGNORE = []
+# seconds a monitored path has to be quiet, and unchanged if new, before it is handled
+MONITOR_DELAY = get(2.0, 'Advanced', 'monitor delay', float)
+# seconds between polls of monitored paths file system events don't arrive for, e.g. network shares, 0 to not poll
+MONITOR_POLL_INTERVAL = get(60, 'Advanced', 'monitor poll interval', int)
+# normcased paths the watchers ignore for a minute, e.g. paths being moved or deleted by the app
+TEMP_PATH_IGNORE = ExpiringSet(60)
 
 # GENERAL
 # set to true to make a fetch instance ignore moving files (will be set to false)
@@ -264,6 +271,13 @@ EXTERNAL_VIEWER_ARGS = get("{$file}", 'Advanced', 'external viewer args', str)
 EXPORT_FORMAT = get(1, 'Advanced', 'export format', int)
 EXPORT_PATH = ''
 
+# DATABASE
+DB_READERS = get(2, 'Advanced', 'database readers', int)  # amount of concurrent read connections
+# sqlite connection profile, one of db_constants.CONNECTION_PROFILES
+db_constants.CONNECTION_PROFILE = get('default', 'Advanced', 'database profile', str)
+db_constants.QUERY_STATS = get(True, 'Advanced', 'database query stats', bool)
+db_constants.SLOW_QUERY_THRESHOLD = get(0.5, 'Advanced', 'slow query threshold', float)  # in seconds
+
 # HASH
 HASH_GALLERY_PAGES = get('all', 'Advanced', 'hash gallery pages', int, str)
 
@@ -291,6 +305,20 @@ _REFRESH_EXTERNAL_VIEWER = False
 
 # controls
 THUMBNAIL_CACHE_SIZE = (1024, get(200, 'Advanced', 'cache size', int))  # 1024 is 1mib
+THUMBNAIL_STORE_SIZE = get(1024, 'Advanced', 'thumbnail store size', int)  # mib on disk, 0 for no limit
+THUMBNAIL_PROCESS_POOL = get(True, 'Advanced', 'thumbnail process pool', bool)  # render thumbnails in processes
+THUMBNAIL_PROCESSES = get(0, 'Advanced', 'thumbnail processes', int)  # 0 for one per core
+# when to check archives for corrupt files: always, on import, never or background
+ARCHIVE_INTEGRITY_CHECK = get('on import', 'Advanced', 'archive integrity check', str)
+HASH_WORKERS = get(0, 'Advanced', 'hash workers', int)  # threads hashing pages, 0 for one per core up to 8
+# how many bits the perceptual hashes of two pages may differ by for the pages to count as the same
+DUPLICATE_IMAGE_DISTANCE = get(10, 'Advanced', 'duplicate image distance', int)
+# also group galleries by title without brackets, diacritics and punctuation in the simple duplicate check
+DUPLICATE_FUZZY_TITLES = get(False, 'Advanced', 'duplicate fuzzy titles', bool)
+DUPLICATE_SAMPLE_PAGES = get(4, 'Advanced', 'duplicate sample pages', int)  # pages hashed per gallery
+SCAN_WORKERS = get(8, 'Advanced', 'scan workers', int)  # threads scanning folders and archives for galleries
+ARCHIVE_HANDLES = get(8, 'Advanced', 'archive handles', int)  # archives kept open for reuse
+ARCHIVE_HANDLE_IDLE = get(5.0, 'Advanced', 'archive handle idle', float)  # seconds an unused archive is kept open
 PREFETCH_ITEM_AMOUNT = get(50, 'Advanced', 'prefetch item amount', int)  # amount of items to prefetch
 SCROLL_SPEED = get(7, 'Advanced', 'scroll speed', int)  # controls how many steps it takes when scrolling
 
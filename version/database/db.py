@@ -12,11 +12,16 @@
 # along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
 # """
 
+import functools
 import logging
 import os
+import re
 import sqlite3
+import threading
+import time
 from sqlite3 import Connection
-from typing import Tuple, List, Callable, Union, Optional
+from urllib.request import pathname2url
+from typing import Tuple, List, Callable, Union, Optional, Dict
 
 from . import db_constants
 
@@ -45,6 +50,22 @@ def hashes_sql() -> Tuple[str, List[str]]:
     return sql, col_list
 
 
+def phashes_sql() -> Tuple[str, List[str]]:
+    """Perceptual hashes of sampled pages of the first chapter, see duplicates.py"""
+    col_list = [
+        'phash_id INTEGER PRIMARY KEY',
+        'phash BLOB',
+        'series_id INTEGER',
+        'page INTEGER',
+        'FOREIGN KEY(series_id) REFERENCES series(series_id) ON DELETE CASCADE',
+        'UNIQUE(series_id, page)'
+    ]
+
+    sql = "CREATE TABLE IF NOT EXISTS phashes({});".format(",".join(col_list))
+
+    return sql, col_list
+
+
 def series_sql() -> Tuple[str, List[str]]:
     col_list = [
         'series_id INTEGER PRIMARY KEY',
@@ -175,10 +196,48 @@ def series_list_map_sql() -> Tuple[str, List[str]]:
     return sql, col_list
 
 
+def indexes_sql() -> Tuple[str, List[str]]:
+    """
+    Secondary indexes for the lookups done by gallerydb.
+    Lookups already covered by the leftmost column of a UNIQUE constraint
+    (hashes.hash, series_tags_map.series_id, tags_mappings.namespace_id) don't need one.
+    """
+    index_list = [
+        'idx_chapters_series_id ON chapters(series_id, chapter_number)',
+        'idx_hashes_series_id ON hashes(series_id, chapter_id)',
+        'idx_hashes_chapter_id ON hashes(chapter_id, page)',
+        'idx_series_series_path ON series(series_path)',
+        'idx_series_list_map_series_id ON series_list_map(series_id)'
+    ]
+
+    sql = ''.join("CREATE INDEX IF NOT EXISTS {};".format(i) for i in index_list)
+
+    return sql, index_list
+
+
 STRUCTURE_SCRIPT_FUNCS: List[Callable[[], Tuple[str, List[str]]]]
 STRUCTURE_SCRIPT_FUNCS = [series_sql, chapters_sql, namespaces_sql, tags_sql, tags_mappings_sql,
-                          series_tags_mappings_sql, hashes_sql, list_sql, series_list_map_sql]
-STRUCTURE_SCRIPT = ''.join(f()[0] for f in STRUCTURE_SCRIPT_FUNCS)
+                          series_tags_mappings_sql, hashes_sql, phashes_sql, list_sql, series_list_map_sql]
+STRUCTURE_SCRIPT = ''.join(f()[0] for f in STRUCTURE_SCRIPT_FUNCS) + indexes_sql()[0]
+
+
+def _revision_indexes(c: sqlite3.dbapi2.Cursor) -> None:
+    log_i('Creating indexes')
+    c.executescript(indexes_sql()[0])
+    c.execute('ANALYZE')
+
+
+def _revision_phashes(c: sqlite3.dbapi2.Cursor) -> None:
+    log_i('Creating phashes table')
+    c.executescript(phashes_sql()[0])
+
+
+# db version -> list of revisions to apply when upgrading from an older version
+# global_db_convert also adds missing tables and columns, every version bump still gets its revision
+DB_REVISIONS: Dict[float, List[Callable[[sqlite3.dbapi2.Cursor], None]]] = {
+    0.27: [_revision_indexes],
+    0.28: [_revision_phashes],
+}
 
 
 def global_db_convert(conn: sqlite3.dbapi2.Connection) -> sqlite3.dbapi2.Cursor:
@@ -195,6 +254,7 @@ def global_db_convert(conn: sqlite3.dbapi2.Connection) -> sqlite3.dbapi2.Cursor:
     tags_mappings, tags_mappings_cols = tags_mappings_sql()
     series_tags_mappings, series_tags_mappings_cols = series_tags_mappings_sql()
     hashes, hashes_cols = hashes_sql()
+    phashes, phashes_cols = phashes_sql()
     _list, list_cols = list_sql()
     series_list_map, series_list_map_cols = series_list_map_sql()
 
@@ -206,6 +266,7 @@ def global_db_convert(conn: sqlite3.dbapi2.Connection) -> sqlite3.dbapi2.Cursor:
         'tags_mappings': tags_mappings_cols,
         'series_tags_mappings': series_tags_mappings_cols,
         'hashes': hashes_cols,
+        'phashes': phashes_cols,
         'list': list_cols,
         'series_list_map': series_list_map_cols
     }
@@ -236,9 +297,23 @@ def add_db_revisions(old_db: Union[str, 'os.PathLike']) -> None:
     conn = sqlite3.connect(old_db, check_same_thread=False)
     conn.row_factory = sqlite3.Row
 
+    c = conn.cursor()
+    try:
+        c.execute('SELECT version FROM version')
+        old_version = c.fetchone()[0]
+    except (sqlite3.OperationalError, TypeError):
+        old_version = 0
+
     log_i('Converting tables and columns')
     c = global_db_convert(conn)
 
+    for version in sorted(DB_REVISIONS):
+        if old_version < version <= db_constants.CURRENT_DB_VERSION:
+            log_i('Applying DB revision {}'.format(version))
+            for revision in DB_REVISIONS[version]:
+                revision(c)
+            conn.commit()
+
     log_d('Updating DB version')
     c.execute('UPDATE version SET version=? WHERE 1', (db_constants.CURRENT_DB_VERSION,))
     conn.commit()
@@ -273,18 +348,40 @@ def check_db_version(conn: sqlite3.dbapi2.Connection) -> bool:
     return True
 
 
-def init_db(path: Union[str, 'os.PathLike'] = db_constants.DB_PATH) -> Optional[sqlite3.dbapi2.Connection]:
+def connection_profile(name: Optional[str] = None) -> Dict[str, Union[str, int]]:
+    """Returns the connection profile with the given name, or the configured one"""
+    name = name or db_constants.CONNECTION_PROFILE
+    profile = db_constants.CONNECTION_PROFILES.get(name)
+    if not profile:
+        log_w('Unknown database profile: {}'.format(name))
+        profile = db_constants.CONNECTION_PROFILES['default']
+    return profile
+
+
+def apply_connection_profile(conn: sqlite3.dbapi2.Connection, profile: Dict[str, Union[str, int]],
+                             read_only: bool = False) -> None:
+    """Sets the pragmas of the connection profile on the connection"""
+    pragmas = ['mmap_size', 'cache_size', 'temp_store']
+    if not read_only:
+        pragmas = ['journal_mode', 'synchronous'] + pragmas
+    for pragma in pragmas:
+        if pragma in profile:
+            conn.execute('PRAGMA {} = {}'.format(pragma, profile[pragma]))
+
+
+def init_db(path: Union[str, 'os.PathLike'] = db_constants.DB_PATH,
+            profile: Optional[str] = None) -> Optional[sqlite3.dbapi2.Connection]:
     """Initialises the DB. Returns a sqlite3 connection,
     which will be passed to the db thread.
+    The connection is set up with the given connection profile, see db_constants.CONNECTION_PROFILES
     """
+    c_profile = connection_profile(profile)
 
     # TODO: change saving version from float to string
     def db_layout(cursor: sqlite3.dbapi2.Cursor) -> None:
         c = cursor
         # version
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS version(version REAL)
-        """)
+        c.execute('CREATE TABLE IF NOT EXISTS version(version REAL)')
 
         c.execute("""INSERT INTO version(version) VALUES(?)""", (db_constants.CURRENT_DB_VERSION,))
         log_i("Constructing database layout")
@@ -292,7 +389,8 @@ def init_db(path: Union[str, 'os.PathLike'] = db_constants.DB_PATH) -> Optional[
         c.executescript(STRUCTURE_SCRIPT)
 
     def new_db(p: Union[str, 'os.PathLike'], new: bool = False) -> sqlite3.dbapi2.Connection:
-        connection = sqlite3.connect(p, check_same_thread=False)
+        connection = sqlite3.connect(p, check_same_thread=False,
+                                     cached_statements=c_profile.get('cached_statements', 128))
         connection.row_factory = sqlite3.Row
         if new:
             c = connection.cursor()
@@ -310,14 +408,102 @@ def init_db(path: Union[str, 'os.PathLike'] = db_constants.DB_PATH) -> Optional[
 
     conn.isolation_level = None
     conn.execute("PRAGMA foreign_keys = on")
+    apply_connection_profile(conn, c_profile)
     return conn
 
 
+def init_read_db(conn: sqlite3.dbapi2.Connection) -> Optional[sqlite3.dbapi2.Connection]:
+    """Opens a read-only connection to the database of the given connection.
+    Returns None if the database isn't a file in WAL mode,
+    since readers would then block the writer.
+    """
+    path = conn.execute('PRAGMA database_list').fetchone()[2]
+    if not path:
+        return None
+    profile = connection_profile()
+    uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(path)))
+    try:
+        r_conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                 cached_statements=profile.get('cached_statements', 128))
+    except sqlite3.OperationalError:
+        log.exception('Could not open a read connection to: {}'.format(path))
+        return None
+    if r_conn.execute('PRAGMA journal_mode').fetchone()[0].lower() != 'wal':
+        r_conn.close()
+        return None
+    r_conn.row_factory = sqlite3.Row
+    r_conn.isolation_level = None
+    apply_connection_profile(r_conn, profile, read_only=True)
+    return r_conn
+
+
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def statement_key(statement: str) -> str:
+    """Returns the statement the stats of statement are kept under, IN lists of any length are one"""
+    return _IN_LIST.sub('IN (?, ...)', statement)
+
+
+class QueryStat:
+    """Accumulated statistics of a single SQL statement"""
+    __slots__ = ('count', 'total_time', 'max_time', 'rows')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+
+    def add(self, elapsed: float, rows: int) -> None:
+        self.count += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if rows > 0:
+            self.rows += rows
+
+
 class DBBase:
     """The base DB class. _DB_CONN should be set at runtime on startup"""
     _DB_CONN: Optional[Connection] = None
     _AUTO_COMMIT = True
     _STATE = {'active': False}
+    # read-only connections, one per reader thread
+    _LOCAL = threading.local()
+    _READ_CONNS: List[Connection] = []
+    _READ_LOCK = threading.Lock()
+    # statement -> QueryStat
+    _STATS: Dict[str, QueryStat] = {}
+    _STATS_LOCK = threading.Lock()
+
+    @classmethod
+    def _conn(cls) -> Optional[Connection]:
+        return getattr(cls._LOCAL, 'conn', None) or cls._DB_CONN
+
+    @classmethod
+    def use_read_connection(cls) -> bool:
+        """Makes the calling thread use its own read-only connection.
+        Returns False if reads can't be done next to the writer connection
+        """
+        local = cls._LOCAL
+        if getattr(local, 'writer', None) is not cls._DB_CONN:
+            local.conn = None
+            local.writer = cls._DB_CONN
+            if cls._DB_CONN:
+                local.conn = init_read_db(cls._DB_CONN)
+            if local.conn:
+                with cls._READ_LOCK:
+                    cls._READ_CONNS.append(local.conn)
+        return local.conn is not None
+
+    @classmethod
+    def close_read_connections(cls) -> None:
+        with cls._READ_LOCK:
+            for r_conn in cls._READ_CONNS:
+                r_conn.close()
+            cls._READ_CONNS.clear()
 
     @classmethod
     def begin(cls) -> None:
@@ -341,33 +527,63 @@ class DBBase:
         # print("ENDED DB OPTIMIZE")
 
     @classmethod
-    def execute(cls, *args):
-        """Same as cursor.execute"""
-        if not cls._DB_CONN:
+    def _record(cls, statement: str, start: float, rows: int) -> None:
+        elapsed = time.perf_counter() - start
+        if db_constants.QUERY_STATS:
+            key = statement_key(statement)
+            with cls._STATS_LOCK:
+                stat = cls._STATS.get(key)
+                if stat is None:
+                    stat = cls._STATS[key] = QueryStat()
+                stat.add(elapsed, rows)
+        if elapsed >= db_constants.SLOW_QUERY_THRESHOLD > 0:
+            log_w('Slow DB query (%.3fs): %s', elapsed, statement)
+
+    @classmethod
+    def _run(cls, many: bool, statement: str, *args):
+        conn = cls._conn()
+        if not conn:
             raise db_constants.NoDatabaseConnection
-        log_d('DB Query: {}'.format(args).encode(errors='ignore'))
+        if many:
+            log_d('DB Query: %s (executemany)', statement)
+        else:
+            log_d('DB Query: %s %s', statement, args)
+        run = conn.executemany if many else conn.execute
+        start = time.perf_counter()
         if cls._AUTO_COMMIT:
             try:
-                with cls._DB_CONN:
-                    return cls._DB_CONN.execute(*args)
+                with conn:
+                    c = run(statement, *args)
             except sqlite3.InterfaceError:
-                return cls._DB_CONN.execute(*args)
-
+                if many:
+                    raise
+                c = run(statement, *args)
         else:
-            return cls._DB_CONN.execute(*args)
+            c = run(statement, *args)
+        cls._record(statement, start, c.rowcount)
+        return c
 
     @classmethod
-    def executemany(cls, *args):
+    def execute(cls, statement: str, *args):
+        """Same as cursor.execute"""
+        return cls._run(False, statement, *args)
+
+    @classmethod
+    def executemany(cls, statement: str, *args):
         """Same as cursor.executemany"""
-        if not cls._DB_CONN:
-            raise db_constants.NoDatabaseConnection
-        log_d('DB Query: {}'.format(args).encode(errors='ignore'))
-        if cls._AUTO_COMMIT:
-            with cls._DB_CONN:
-                return cls._DB_CONN.executemany(*args)
-        else:
-            c = cls._DB_CONN.executemany(*args)
-            return c
+        return cls._run(True, statement, *args)
+
+    @classmethod
+    def query_stats(cls) -> List[Tuple[str, QueryStat]]:
+        """Returns a list of (statement, QueryStat) sorted by total time spent, most first"""
+        with cls._STATS_LOCK:
+            stats = list(cls._STATS.items())
+        return sorted(stats, key=lambda x: x[1].total_time, reverse=True)
+
+    @classmethod
+    def reset_query_stats(cls) -> None:
+        with cls._STATS_LOCK:
+            cls._STATS.clear()
 
     @classmethod
     def commit(cls) -> None:
@@ -379,6 +595,7 @@ class DBBase:
 
     @classmethod
     def close(cls) -> None:
+        cls.close_read_connections()
         cls._DB_CONN.close()
 
 
@@ -13,7 +13,7 @@
 # """
 
 import os
-from typing import Union, List
+from typing import Union, List, Dict
 
 DB_NAME: Union[str, 'os.PathLike'] = 'happypanda.db'
 THUMB_NAME: str = "thumbnails"
@@ -29,13 +29,45 @@ else:
     THUMBNAIL_PATH = os.path.join("db", THUMB_NAME)
     DB_PATH = os.path.join(DB_ROOT, DB_NAME)
 
-DB_VERSION: List[float] = [0.26]  # a list of accepted db versions. E.g. v3.5 will be backward compatible with v3.1 etc.
+DB_VERSION: List[float] = [0.28]  # a list of accepted db versions. E.g. v3.5 will be backward compatible with v3.1 etc.
 CURRENT_DB_VERSION: float = DB_VERSION[0]
 REAL_DB_VERSION: float = DB_VERSION[-1]
 METHOD_QUEUE = None
-METHOD_RETURN = None
 DATABASE = None
 
+# sqlite connection settings applied by init_db
+# cached_statements is the size of the prepared statement cache of a connection
+CONNECTION_PROFILES: Dict[str, Dict[str, Union[str, int]]] = {
+    'default': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # negative is in kib
+        'temp_store': 'MEMORY',
+        'cached_statements': 512
+    },
+    'low memory': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 0,
+        'cache_size': -8 * 1024,
+        'temp_store': 'DEFAULT',
+        'cached_statements': 128
+    },
+    # rollback journal with a sync after every commit, reads will go through the writer
+    'safe': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cached_statements': 128
+    }
+}
+CONNECTION_PROFILE = 'default'
+
+# collect per statement counters and timings, see DBBase.query_stats
+QUERY_STATS = True
+# statements taking longer than this many seconds are logged, 0 to disable
+SLOW_QUERY_THRESHOLD = 0.5
+
 
 class NoDatabaseConnection(Exception):
     pass
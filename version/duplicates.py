@@ -0,0 +1,247 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Finding duplicate galleries.
+Galleries with the same title or path are grouped by hashing them into buckets,
+galleries with similar pages are found through perceptual hashes.
+A perceptual hash stays the same or close when an image is re-encoded or resized,
+unlike the sha1 page hashes in the hashes table.
+"""
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from typing import Any, BinaryIO, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from PIL import Image
+
+from . import utils
+
+if TYPE_CHECKING:
+    from .gallerydb import Gallery
+
+# hashes are HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+
+_BRACKETS = re.compile(r'\([^)]*\)|\{[^}]*\}|\[[^\]]*\]')
+_WORD = re.compile(r'\w+')
+
+
+def fuzzy_title(title: str) -> str:
+    """
+    Returns the title without the bracketed parts, e.g. artist, event and language,
+    diacritics, punctuation and case
+    """
+    title = _BRACKETS.sub(' ', utils.title_parser(title)['title'])
+    title = ''.join(c for c in unicodedata.normalize('NFKD', title) if not unicodedata.combining(c))
+    return ' '.join(_WORD.findall(title.casefold()))
+
+
+def gallery_buckets(gallery: Gallery, fuzzy: bool = False) -> Iterator[Tuple[str, str]]:
+    """Yields the buckets of the gallery for group_duplicates, empty titles and paths are left out"""
+    title = gallery.title.strip().lower()
+    if title:
+        yield 'title', title
+    if gallery.path:
+        yield 'path', os.path.normcase(gallery.path)
+    if fuzzy:
+        title = fuzzy_title(gallery.title)
+        if title:
+            yield 'fuzzy', title
+
+
+def group_duplicates(items: Iterable[Tuple[Hashable, Iterable[Hashable]]]) -> List[List[Hashable]]:
+    """
+    Returns the groups of keys sharing a bucket, in the order their first key came.
+    items is an iterable of (key, buckets of the key). A key is grouped with every key it shares a bucket with,
+    and with the keys those share a bucket with.
+    """
+    parent: Dict[Hashable, Hashable] = {}
+    first: Dict[Hashable, Hashable] = {}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    order = []
+    for key, buckets in items:
+        parent[key] = key
+        order.append(key)
+        for bucket in buckets:
+            other = first.setdefault(bucket, key)
+            if other != key:
+                a, b = find(other), find(key)
+                if a != b:
+                    parent[b] = a
+    groups: Dict[Hashable, List[Hashable]] = {}
+    for key in order:
+        groups.setdefault(find(key), []).append(key)
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def dhash(img: Union[str, 'os.PathLike', BinaryIO], size: int = HASH_SIZE) -> int:
+    """
+    Returns the difference hash of the image, each bit tells if a pixel is brighter than the one right of it
+    in a greyscale size+1 x size thumbnail of the image
+    """
+    with Image.open(img) as im:
+        im.draft('L', (size * 4, size * 4))
+        pixels = im.convert('L').resize((size + 1, size), Image.BILINEAR).tobytes()
+    h = 0
+    for row in range(size):
+        for col in range(size):
+            n = row * (size + 1) + col
+            h = h << 1 | (pixels[n] > pixels[n + 1])
+    return h
+
+
+def hamming(a: int, b: int) -> int:
+    """Returns how many bits differ"""
+    return bin(a ^ b).count('1')
+
+
+def to_blob(h: int) -> bytes:
+    return h.to_bytes(HASH_SIZE * HASH_SIZE // 8, 'big')
+
+
+def from_blob(b: bytes) -> int:
+    return int.from_bytes(b, 'big')
+
+
+def sample_pages(pages: int, samples: int) -> List[int]:
+    """Returns the indexes of the pages to hash, the cover and pages spread evenly over the rest"""
+    if pages <= samples:
+        return list(range(pages))
+    return sorted({0} | {pages * n // samples for n in range(1, samples)})
+
+
+class BKTree:
+    """
+    BK-tree of hashes by hamming distance. Finding the hashes near a hash only visits
+    the subtrees that can hold them instead of comparing against every hash.
+    """
+
+    def __init__(self) -> None:
+        # node: [hash, items with that hash, distance -> child node]
+        self._root: Optional[list] = None
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, h: int, item: Any) -> None:
+        self._len += 1
+        if self._root is None:
+            self._root = [h, [item], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(h, node[0])
+            if not d:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [item], {}]
+                return
+            node = child
+
+    def search(self, h: int, distance: int) -> List[Tuple[int, Any]]:
+        """Returns (distance, item) for the items with a hash at most distance from h"""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= distance:
+                found.extend((d, item) for item in node[1])
+            # by the triangle inequality only children between d - distance and d + distance can match
+            stack.extend(child for k, child in node[2].items() if d - distance <= k <= d + distance)
+        return found
+
+
+def find_similar(galleries: Iterable[Tuple[Hashable, List[int]]], distance: int) -> Iterator[Tuple[Hashable, Hashable]]:
+    """
+    Yields each pair of keys whose hashes are similar as soon as the second one is seen.
+    galleries is an iterable of (key, hashes of the sampled pages).
+    Two galleries are similar when most of the pages of the one with fewer pages hashed
+    have a page within distance in the other.
+    """
+    tree = BKTree()
+    sizes: Dict[Hashable, int] = {}
+    for key, hashes in galleries:
+        if not hashes:
+            continue
+        matched: Dict[Hashable, int] = {}
+        for h in hashes:
+            for other in {item for _, item in tree.search(h, distance)}:
+                matched[other] = matched.get(other, 0) + 1
+        for other, count in matched.items():
+            if count > min(len(hashes), sizes[other]) // 2:
+                yield other, key
+        sizes[key] = len(hashes)
+        for h in hashes:
+            tree.add(h, key)
+
+
+class SimilarGroups:
+    """
+    Groups of keys merged as the pairs of find_similar come, like group_duplicates does with buckets,
+    so galleries similar to each other are one group instead of a pair for each two of them
+    """
+
+    def __init__(self) -> None:
+        self._parent: Dict[Hashable, Hashable] = {}
+        # root -> keys of the group in the order they came, the oldest groups first
+        self._groups: Dict[Hashable, List[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def _find(self, key: Hashable) -> Optional[Hashable]:
+        if key not in self._parent:
+            return None
+        while self._parent[key] != key:
+            self._parent[key] = self._parent[self._parent[key]]
+            key = self._parent[key]
+        return key
+
+    def add(self, a: Hashable, b: Hashable) -> Optional[Tuple[List[Hashable], List[Hashable]]]:
+        """
+        Adds the pair, returns the keys of the group it is now in and which of them weren't in a group before,
+        None if they already were in the same group. Merged groups keep the place of the oldest one.
+        """
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a is None and root_b is None:
+            self._parent[a] = self._parent[b] = a
+            self._groups[a] = [a, b]
+            return [a, b], [a, b]
+        if root_a == root_b:
+            return None
+        if root_a is None or root_b is None:
+            root, new = (root_b, a) if root_a is None else (root_a, b)
+            self._parent[new] = root
+            self._groups[root].append(new)
+            return list(self._groups[root]), [new]
+        for root in self._groups:
+            if root in (root_a, root_b):
+                break
+        other = root_b if root == root_a else root_a
+        self._parent[other] = root
+        self._groups[root].extend(self._groups.pop(other))
+        return list(self._groups[root]), []
+
+    def groups(self) -> List[List[Hashable]]:
+        return [list(g) for g in self._groups.values()]
@@ -1,13 +1,18 @@
-﻿import logging
+﻿import io
+import logging
+import multiprocessing
 import os
-import uuid
+import threading
 from concurrent import futures
-from typing import Union, Optional, Tuple
+from typing import Any, Callable, Dict, Union, Optional, Tuple
 
 from PyQt5.QtCore import Qt
+from PIL import Image
 from PyQt5.QtGui import QImage, QPainter, QBrush, QPen
 
-from .database import db_constants
+from .thumbnail_render import render_thumbnails
+from . import duplicates
+from .thumbnail_store import thumbnail_store
 from . import utils
 from . import app_constants
 
@@ -34,48 +39,83 @@ def _rounded_qimage(qimg: QImage, radius: float) -> QImage:
     return r_image
 
 
+def _load_qimage(img: Union[str, 'os.PathLike', io.BytesIO]) -> QImage:
+    in_memory = isinstance(img, io.BytesIO)
+    try:
+        im_data = utils.PToQImageHelper(Image.open(img) if in_memory else img)
+        image = QImage(im_data['data'], im_data['im'].size[0], im_data['im'].size[1], im_data['format'])
+        if im_data['colortable']:
+            image.setColorTable(im_data['colortable'])
+    except ValueError:
+        image = QImage()
+        if in_memory:
+            image.loadFromData(img.getvalue())
+        else:
+            image.load(img)
+    return image
+
+
 # TODO: 2020-11-09: might be incomplete
 def _task_thumbnail(gallery_or_path, img=None, width=app_constants.THUMB_W_SIZE,
                     height=app_constants.THUMB_H_SIZE) -> Union[str, 'os.PathLike']:
     """
+    Returns the path to the thumbnail of the gallery cover or of img.
+    The thumbnails in app_constants.THUMB_SIZES are made as well from the same decoded image,
+    thumbnails already made from the same image are reused.
     """
     log_i("Generating thumbnail")
-    # generate a cache dir if required
-    if not os.path.isdir(db_constants.THUMBNAIL_PATH):
-        os.mkdir(db_constants.THUMBNAIL_PATH)
-
     try:
         if not img:
-            img_path = utils.get_gallery_img(gallery_or_path)
+            # covers in archives are read into memory
+            img_path = utils.get_gallery_img(gallery_or_path, in_memory=True)
         else:
             img_path = img
         if not img_path:
             raise IndexError
-        for ext in utils.IMG_FILES:
-            if img_path.lower().endswith(ext):
-                _suff = ext  # the image ext with dot
-
-        # generate unique file name
-        file_name = str(uuid.uuid4()) + ".png"
-        new_img_path = os.path.join(db_constants.THUMBNAIL_PATH, file_name)
-        if not os.path.isfile(img_path):
+        if not isinstance(img_path, io.BytesIO) and not os.path.isfile(img_path):
             raise IndexError
 
-        # Do the scaling
-        try:
-            im_data = utils.PToQImageHelper(img_path)
-            image = QImage(im_data['data'], im_data['im'].size[0], im_data['im'].size[1], im_data['format'])
-            if im_data['colortable']:
-                image.setColorTable(im_data['colortable'])
-        except ValueError:
-            image = QImage()
-            image.load(img_path)
-        if image.isNull():
+        img_hash = thumbnail_store.source_hash(img_path)
+        sizes = [(width, height)] + [s for s in app_constants.THUMB_SIZES if s != (width, height)]
+        paths = {}
+        missing = []
+        for size in sizes:
+            path = thumbnail_store.get(thumbnail_store.sized_key(img_hash, size))
+            if path:
+                paths[size] = path
+            else:
+                missing.append(size)
+
+        rendered = None
+        if missing and app_constants.THUMBNAIL_PROCESS_POOL:
+            try:
+                rendered = Executors.render_thumbnails(
+                    img_path.getvalue() if isinstance(img_path, io.BytesIO) else img_path, missing)
+            except Exception:
+                log.exception('Failed to render thumbnail in a worker process, falling back to Qt')
+        if rendered:
+            for size in missing:
+                def write(new_img_path, data=rendered[size]):
+                    with open(new_img_path, 'wb') as f:
+                        f.write(data)
+                    return True
+
+                paths[size] = thumbnail_store.put(thumbnail_store.sized_key(img_hash, size), write)
+        elif missing:
+            image = _load_qimage(img_path)
+            if image.isNull():
+                raise IndexError
+            radius = 5
+            for size in missing:
+                def write(new_img_path, size=size):
+                    # Do the scaling
+                    scaled = image.scaled(size[0], size[1], Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                    return _rounded_qimage(scaled, radius).save(new_img_path, "PNG", quality=80)
+
+                paths[size] = thumbnail_store.put(thumbnail_store.sized_key(img_hash, size), write)
+        new_img_path = paths[(width, height)]
+        if not new_img_path:
             raise IndexError
-        radius = 5
-        image = image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        r_image = _rounded_qimage(image, radius)
-        r_image.save(new_img_path, "PNG", quality=80)
     except IndexError:
         new_img_path = app_constants.NO_IMAGE_PATH
 
@@ -85,11 +125,15 @@ def _task_thumbnail(gallery_or_path, img=None, width=app_constants.THUMB_W_SIZE,
 def _task_load_thumbnail(ppath: Union[str, 'os.PathLike'], thumb_size: Tuple[int, int],
                          on_method=None, **kwargs) -> Optional[QImage]:
     if ppath:
+        # thumbnails are made in every size up front, fall back to scaling for the ones which weren't
+        sized_path = thumbnail_store.sized_path(ppath, thumb_size)
+        if sized_path and os.path.isfile(sized_path):
+            ppath = sized_path
+        thumbnail_store.touch(ppath)
         img = QImage(ppath)
         if not img.isNull():
             size = img.size()
-            if size.width() != thumb_size[0]:
-                # TODO: use _task_thumbnail
+            if ppath != sized_path and size.width() != thumb_size[0]:
                 img = _rounded_qimage(
                     img.scaled(thumb_size[0], thumb_size[1], Qt.KeepAspectRatio, Qt.SmoothTransformation), 5)
             if on_method:
@@ -97,9 +141,73 @@ def _task_load_thumbnail(ppath: Union[str, 'os.PathLike'], thumb_size: Tuple[int
             return img
 
 
+def thumbnail_workers() -> int:
+    return app_constants.THUMBNAIL_PROCESSES or os.cpu_count() or 1
+
+
+def _task_hash(src: Union[str, 'os.PathLike', Callable]) -> str:
+    """Returns the hash of the file at the path or of the file object returned by calling src"""
+    if callable(src):
+        with src() as f:
+            return utils.generate_img_hash(f)
+    with open(src, 'rb', buffering=0) as f:
+        return utils.generate_img_hash(f)
+
+
+def _task_phash(src: Union[str, 'os.PathLike', Callable]) -> Optional[int]:
+    """Returns the perceptual hash of the image at the path or returned by calling src, None if it can't be read"""
+    try:
+        if callable(src):
+            with src() as f:
+                return duplicates.dhash(io.BytesIO(f.read()))
+        return duplicates.dhash(src)
+    except (OSError, ValueError):
+        log.exception('Could not hash image')
+        return None
+
+
+def hash_workers() -> int:
+    return app_constants.HASH_WORKERS or min(os.cpu_count() or 1, 8)
+
+
 class Executors:
-    _thumbnail_exec = futures.ThreadPoolExecutor(3)
+    # with the process pool these threads mostly wait for a worker process
+    _thumbnail_exec = futures.ThreadPoolExecutor(
+        max(3, thumbnail_workers()) if app_constants.THUMBNAIL_PROCESS_POOL else 3)
     _profile_exec = futures.ThreadPoolExecutor(2)
+    # hashlib releases the GIL while hashing large buffers, threads are enough
+    _hash_exec = futures.ThreadPoolExecutor(hash_workers())
+    _render_exec: Optional[futures.ProcessPoolExecutor] = None
+    _render_lock = threading.Lock()
+
+    @classmethod
+    def render_thumbnails(cls, img_path, sizes):
+        """Renders the thumbnails in a worker process, returns a dict of size -> PNG bytes"""
+        with cls._render_lock:
+            if cls._render_exec is None:
+                # spawn, forking a process running Qt threads is not safe
+                cls._render_exec = futures.ProcessPoolExecutor(thumbnail_workers(),
+                                                               multiprocessing.get_context('spawn'))
+            render_exec = cls._render_exec
+        try:
+            return render_exec.submit(render_thumbnails, img_path, sizes).result()
+        except futures.BrokenExecutor:
+            with cls._render_lock:
+                if cls._render_exec is render_exec:
+                    cls._render_exec = None
+            raise
+
+    @classmethod
+    def hash_pages(cls, pages: Dict[Any, Union[str, 'os.PathLike', Callable]]) -> Dict[Any, str]:
+        """Hashes the pages in parallel, pages is a dict of key -> path or a function opening the page"""
+        fs = {key: cls._hash_exec.submit(_task_hash, src) for key, src in pages.items()}
+        return {key: f.result() for key, f in fs.items()}
+
+    @classmethod
+    def phash_pages(cls, pages: Dict[Any, Union[str, 'os.PathLike', Callable]]) -> Dict[Any, int]:
+        """Returns the perceptual hashes of the pages like hash_pages, pages that can't be read are left out"""
+        fs = {key: cls._hash_exec.submit(_task_phash, src) for key, src in pages.items()}
+        return {key: h for key, h in ((key, f.result()) for key, f in fs.items()) if h is not None}
 
     @classmethod
     def generate_thumbnail(cls, gallery_or_path, img=None, width=app_constants.THUMB_W_SIZE,
@@ -18,7 +18,8 @@ import os
 import queue
 import random
 import time
-from typing import Optional, Union, TYPE_CHECKING
+from concurrent import futures
+from typing import List, Optional, Tuple, Union, TYPE_CHECKING
 
 import scandir
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtBoundSignal  # need this for interaction with main thread
@@ -70,6 +71,8 @@ class Fetch(QObject):
         self._data = []
         self._curr_gallery = ''  # for debugging purposes
         self.skipped_paths = []
+        # series_path entries the last local search failed on, or skipped for a reason that may go away
+        self.failed_entries = []
 
         # web
         self._default_ehen_url = app_constants.DEFAULT_EHEN_URL
@@ -78,141 +81,190 @@ class Fetch(QObject):
         self.error_galleries = []
         self._hen_list = []
 
-        # filter
-        self.galleries_from_db = []
-        self._refresh_filter_list()
-
         # download
         self._to_queue_container = False
         self._galleries_queue = queue.Queue()
 
-    def _refresh_filter_list(self):
-        gallery_data = app_constants.GALLERY_DATA + app_constants.GALLERY_ADDITION_DATA
-        filter_list = []
-        for g in gallery_data:
-            filter_list.append(os.path.normcase(g.path))
-        self.galleries_from_db = sorted(filter_list)
-
     def create_gallery(self, path, folder_name, do_chapters=True, archive=None):
+        """Creates the gallery at path and emits it, returns True if it was created"""
+        return self._add_scanned(*self._scan_gallery(path, folder_name, do_chapters, archive))
+
+    def _scan_gallery(self, path, folder_name, do_chapters=True, archive=None, entries=None) \
+            -> Tuple[Optional[Gallery], Optional[Tuple[str, str]]]:
+        """
+        Reads the gallery at path from disk, returns (gallery, None) or (None, (path, reason it was skipped)).
+        entries is the content of the gallery folder if it has been scanned already.
+        Only reads, so it can run on the scan threads.
+        """
         is_archive = True if archive else False
         temp_p = archive if is_archive else path
         folder_name = folder_name or path if folder_name or path else os.path.split(archive)[1]
-        if utils.check_ignore_list(temp_p) and not GalleryDB.check_exists(temp_p, self.galleries_from_db, False):
-            log_i('Creating gallery: {}'.format(folder_name.encode('utf-8', 'ignore')))
-            new_gallery = Gallery()
-            images_paths = []
-            metafile = utils.GMetafile()
-            try:
-                con = scandir.scandir(temp_p)  # all of content in the gallery folder
-                log_i('Gallery source is a directory')
-                chapters = sorted([sub.path for sub in con if sub.is_dir() or sub.name.endswith(utils.ARCHIVE_FILES)]) \
-                    if do_chapters else []  # subfolders
-                # if gallery has chapters divided into sub folders
-                numb_of_chapters = len(chapters)
-                if numb_of_chapters != 0:
-                    log_i('Gallery has {} chapters'.format(numb_of_chapters))
-                    for ch in chapters:
-                        chap = new_gallery.chapters.create_chapter()
-                        chap.title = utils.title_parser(ch)['title']
-                        chap.path = os.path.join(path, ch)
-                        chap.pages = len([x for x in scandir.scandir(chap.path) if x.name.endswith(utils.IMG_FILES)])
-                        metafile.update(utils.GMetafile(chap.path))
-
-                else:  # else assume that all images are in gallery folder
+        if not utils.check_ignore_list(temp_p) or \
+                GalleryDB.check_exists(temp_p, path_in_archive=path if is_archive else None):
+            log_i('Gallery already exists or ignored: {}'.format(folder_name.encode('utf-8', 'ignore')))
+            return None, (temp_p, 'Already exists or ignored')
+
+        log_i('Creating gallery: {}'.format(folder_name.encode('utf-8', 'ignore')))
+        new_gallery = Gallery()
+        metafile = utils.GMetafile()
+        try:
+            # all of content in the gallery folder
+            con = entries if entries is not None else list(scandir.scandir(temp_p))
+            log_i('Gallery source is a directory')
+            chapters = sorted([sub.path for sub in con if sub.is_dir() or sub.name.endswith(utils.ARCHIVE_FILES)]) \
+                if do_chapters else []  # subfolders
+            # if gallery has chapters divided into sub folders
+            numb_of_chapters = len(chapters)
+            if numb_of_chapters != 0:
+                log_i('Gallery has {} chapters'.format(numb_of_chapters))
+                for ch in chapters:
                     chap = new_gallery.chapters.create_chapter()
-                    chap.title = utils.title_parser(os.path.split(path)[1])['title']
-                    chap.path = path
-                    metafile.update(utils.GMetafile(chap.path))
-                    chap.pages = len(list(scandir.scandir(path)))
+                    chap.title = utils.title_parser(ch)['title']
+                    chap.path = os.path.join(path, ch)
+                    chap_con = list(scandir.scandir(chap.path))
+                    chap.pages = len([x for x in chap_con if x.name.endswith(utils.IMG_FILES)])
+                    metafile.update(utils.GMetafile(chap.path, entries=chap_con))
+
+            else:  # else assume that all images are in gallery folder
+                chap = new_gallery.chapters.create_chapter()
+                chap.title = utils.title_parser(os.path.split(path)[1])['title']
+                chap.path = path
+                metafile.update(utils.GMetafile(chap.path, entries=con))
+                chap.pages = len(con)
+
+            parsed = utils.title_parser(folder_name)
+        except NotADirectoryError:
+            try:
+                if is_archive or temp_p.endswith(utils.ARCHIVE_FILES):
+                    log_i('Gallery source is an archive')
+                    # opened once for everything read from it
+                    arch = utils.ArchiveFile(temp_p, importing=True)
+                    try:
+                        contents = utils.check_archive(arch)
+                        if not contents:
+                            raise ValueError
+                        new_gallery.is_archive = 1
+                        new_gallery.path_in_archive = '' if not is_archive else path
+                        if folder_name.endswith('/'):
+                            folder_name = folder_name[:-1]
+                            fn = os.path.split(folder_name)
+                            folder_name = fn[1] or fn[2]
+                        folder_name = folder_name.replace('/', '')
+                        if folder_name.endswith(utils.ARCHIVE_FILES):
+                            n = folder_name
+                            for ext in utils.ARCHIVE_FILES:
+                                n = n.replace(ext, '')
+                            parsed = utils.title_parser(n)
+                        else:
+                            parsed = utils.title_parser(folder_name)
 
-                parsed = utils.title_parser(folder_name)
-            except NotADirectoryError:
-                try:
-                    if is_archive or temp_p.endswith(utils.ARCHIVE_FILES):
-                        log_i('Gallery source is an archive')
-                        contents = utils.check_archive(temp_p)
-                        if contents:
-                            new_gallery.is_archive = 1
-                            new_gallery.path_in_archive = '' if not is_archive else path
-                            if folder_name.endswith('/'):
-                                folder_name = folder_name[:-1]
-                                fn = os.path.split(folder_name)
-                                folder_name = fn[1] or fn[2]
-                            folder_name = folder_name.replace('/', '')
-                            if folder_name.endswith(utils.ARCHIVE_FILES):
-                                n = folder_name
-                                for ext in utils.ARCHIVE_FILES:
-                                    n = n.replace(ext, '')
-                                parsed = utils.title_parser(n)
-                            else:
-                                parsed = utils.title_parser(folder_name)
-
-                            if do_chapters:
-                                archive_g = sorted(contents)
-                                if not archive_g:
-                                    log_w('No chapters found for {}'.format(temp_p.encode(errors='ignore')))
-                                    raise ValueError
-                                for g in archive_g:
-                                    chap = new_gallery.chapters.create_chapter()
-                                    chap.in_archive = 1
-                                    chap.title = parsed['title'] if not g else utils.title_parser(g.replace('/', ''))[
-                                        'title']
-                                    chap.path = g
-                                    metafile.update(utils.GMetafile(g, temp_p))
-                                    arch = utils.ArchiveFile(temp_p)
-                                    chap.pages = len([x for x in arch.dir_contents(g) if x.endswith(utils.IMG_FILES)])
-                                    arch.close()
-                            else:
+                        if do_chapters:
+                            archive_g = sorted(contents)
+                            if not archive_g:
+                                log_w('No chapters found for {}'.format(temp_p.encode(errors='ignore')))
+                                raise ValueError
+                            for g in archive_g:
                                 chap = new_gallery.chapters.create_chapter()
-                                chap.title = utils.title_parser(os.path.split(path)[1])['title']
                                 chap.in_archive = 1
-                                chap.path = path
-                                metafile.update(utils.GMetafile(path, temp_p))
-                                arch = utils.ArchiveFile(temp_p)
-                                chap.pages = len(arch.dir_contents(''))
-                                arch.close()
+                                chap.title = parsed['title'] if not g else utils.title_parser(g.replace('/', ''))[
+                                    'title']
+                                chap.path = g
+                                metafile.update(utils.GMetafile(g, arch))
+                                chap.pages = len([x for x in arch.dir_contents(g) if x.endswith(utils.IMG_FILES)])
                         else:
-                            raise ValueError
-                    else:
-                        raise ValueError
-                except ValueError:
-                    log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
-                    self.skipped_paths.append((temp_p, 'Empty archive',))
-                    return
-                except app_constants.CreateArchiveFail:
-                    log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
-                    self.skipped_paths.append((temp_p, 'Error creating archive',))
-                    return
-                except app_constants.TitleParsingError:
-                    log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
-                    self.skipped_paths.append((temp_p, 'Error while parsing folder/archive name',))
-                    return
-
-            new_gallery.title = parsed['title']
-            new_gallery.path = temp_p
-            new_gallery.artist = parsed['artist']
-            new_gallery.language = parsed['language']
-            new_gallery.info = ""
-            new_gallery.view = app_constants.ViewType.Addition
-            metafile.apply_gallery(new_gallery)
-
-            if app_constants.MOVE_IMPORTED_GALLERIES and not app_constants.OVERRIDE_MOVE_IMPORTED_IN_FETCH:
-                new_gallery.move_gallery()
-
-            self.LOCAL_EMITTER.emit(new_gallery)
-            self._data.append(new_gallery)
-            log_i('Gallery successful created: {}'.format(folder_name.encode('utf-8', 'ignore')))
-            return True
-        else:
-            log_i('Gallery already exists or ignored: {}'.format(folder_name.encode('utf-8', 'ignore')))
-            self.skipped_paths.append((temp_p, 'Already exists or ignored'))
+                            chap = new_gallery.chapters.create_chapter()
+                            chap.title = utils.title_parser(os.path.split(path)[1])['title']
+                            chap.in_archive = 1
+                            chap.path = path
+                            metafile.update(utils.GMetafile(path, arch))
+                            chap.pages = len(arch.dir_contents(''))
+                    finally:
+                        arch.close()
+                else:
+                    raise ValueError
+            except ValueError:
+                log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
+                return None, (temp_p, 'Empty archive')
+            except app_constants.CreateArchiveFail:
+                log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
+                return None, (temp_p, 'Error creating archive')
+            except app_constants.TitleParsingError:
+                log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
+                return None, (temp_p, 'Error while parsing folder/archive name')
+
+        new_gallery.title = parsed['title']
+        new_gallery.path = temp_p
+        new_gallery.artist = parsed['artist']
+        new_gallery.language = parsed['language']
+        new_gallery.info = ""
+        new_gallery.view = app_constants.ViewType.Addition
+        metafile.apply_gallery(new_gallery)
+        return new_gallery, None
+
+    # skipped for a reason that may go away, e.g. an archive still being copied
+    RETRY_SKIPS = ('Error creating archive',)
+
+    def _add_scanned(self, gallery: Optional[Gallery], skipped: Optional[Tuple[str, str]]) -> bool:
+        """Emits a gallery returned by _scan_gallery, on the thread of this object"""
+        if skipped:
+            self.skipped_paths.append(skipped)
             return False
+        if app_constants.MOVE_IMPORTED_GALLERIES and not app_constants.OVERRIDE_MOVE_IMPORTED_IN_FETCH:
+            gallery.move_gallery()
+
+        self.LOCAL_EMITTER.emit(gallery)
+        self._data.append(gallery)
+        log_i('Gallery successful created: {}'.format(gallery.title.encode('utf-8', 'ignore')))
+        return True
+
+    def _scan_entry(self, folder_name: str, mixed: bool, subfolders: bool) \
+            -> List[Tuple[Optional[Gallery], Optional[Tuple[str, str]]]]:
+        """Scans one entry of the series path for galleries, runs on the scan threads"""
+        if mixed:
+            path = folder_name
+            folder_name = os.path.split(path)[1]
+        else:
+            path = os.path.join(self.series_path, folder_name)
+        if subfolders:
+            results = []
+            if os.path.isdir(path):
+                gallery_folders, gallery_archives = utils.recursive_gallery_check(path)
+                for gs in gallery_folders:
+                    results.append(self._scan_gallery(gs, os.path.split(gs)[1], False))
+                for gs in gallery_archives:
+                    results.append(self._scan_gallery(gs[0], os.path.split(gs[0])[1], False, archive=gs[1]))
+            elif path.endswith(utils.ARCHIVE_FILES):
+                for g in utils.check_archive(path):
+                    results.append(self._scan_gallery(g, os.path.split(g)[1], False, archive=path))
+            return results
+
+        try:
+            entries = None
+            if os.path.isdir(path):
+                entries = list(scandir.scandir(path))
+                if not entries:
+                    raise ValueError
+            elif not path.endswith(utils.ARCHIVE_FILES):
+                raise NotADirectoryError
+
+            log_i("Treating each subfolder as chapter")
+            return [self._scan_gallery(path, folder_name, do_chapters=True, entries=entries)]
+
+        except ValueError:
+            log_w('Directory is empty: {}'.format(path.encode(errors='ignore')))
+            return [(None, (path, 'Empty directory'))]
+        except NotADirectoryError:
+            log_w('Unsupported file: {}'.format(path.encode(errors='ignore')))
+            return [(None, (path, 'Unsupported file'))]
 
     def local(self, s_path=None):
         """
         Do a local search in the given series_path.
+        The entries are scanned on a pool of app_constants.SCAN_WORKERS threads, since scanning mostly waits on disk,
+        and the galleries are emitted as soon as they are ready.
         """
         self._data.clear()
+        self.failed_entries = []
         if s_path:
             self.series_path = s_path
         try:
@@ -224,53 +276,31 @@ class Fetch(QObject):
             mixed = True
         if len(gallery_l) != 0:  # if gallery path list is not empty
             log_i('Gallery folder is not empty')
-            if len(self.galleries_from_db) != len(app_constants.GALLERY_DATA):
-                self._refresh_filter_list()
             self.DATA_COUNT.emit(len(gallery_l))  # tell model how many items are going to be added
             log_i('Received {} paths'.format(len(gallery_l)))
-            progress = 0
-
-            for folder_name in gallery_l:  # folder_name = gallery folder title
-                self._curr_gallery = folder_name
-                if mixed:
-                    path = folder_name
-                    folder_name = os.path.split(path)[1]
-                else:
-                    path = os.path.join(self.series_path, folder_name)
-                if app_constants.SUBFOLDER_AS_GALLERY or app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY:
-                    if app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY:
-                        app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY = False
-                    log_i("Treating each subfolder as gallery")
-                    if os.path.isdir(path):
-                        gallery_folders, gallery_archives = utils.recursive_gallery_check(path)
-                        for gs in gallery_folders:
-                            self.create_gallery(gs, os.path.split(gs)[1], False)
-                        p_saving = {}
-                        for gs in gallery_archives:
-                            self.create_gallery(gs[0], os.path.split(gs[0])[1], False, archive=gs[1])
-                    elif path.endswith(utils.ARCHIVE_FILES):
-                        for g in utils.check_archive(path):
-                            self.create_gallery(g, os.path.split(g)[1], False, archive=path)
-                else:
+            subfolders = app_constants.SUBFOLDER_AS_GALLERY or app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY
+            if subfolders:
+                app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY = False
+                log_i("Treating each subfolder as gallery")
+
+            start = time.monotonic()
+            with futures.ThreadPoolExecutor(max(1, app_constants.SCAN_WORKERS)) as scan_exec:
+                fs = {scan_exec.submit(self._scan_entry, folder_name, mixed, subfolders): folder_name
+                      for folder_name in gallery_l}
+                for progress, f in enumerate(futures.as_completed(fs), 1):
+                    entry = fs[f] if mixed else os.path.join(self.series_path, fs[f])
                     try:
-                        if os.path.isdir(path):
-                            if not list(scandir.scandir(path)):
-                                raise ValueError
-                        elif not path.endswith(utils.ARCHIVE_FILES):
-                            raise NotADirectoryError
-
-                        log_i("Treating each subfolder as chapter")
-                        self.create_gallery(path, folder_name, do_chapters=True)
-
-                    except ValueError:
-                        self.skipped_paths.append((path, 'Empty directory'))
-                        log_w('Directory is empty: {}'.format(path.encode(errors='ignore')))
-                    except NotADirectoryError:
-                        self.skipped_paths.append((path, 'Unsupported file'))
-                        log_w('Unsupported file: {}'.format(path.encode(errors='ignore')))
-
-                progress += 1  # update the progress bar
-                self.PROGRESS.emit(progress)
+                        for result in f.result():
+                            self._add_scanned(*result)
+                            if result[1] and result[1][1] in self.RETRY_SKIPS:
+                                self.failed_entries.append(entry)
+                    except Exception:
+                        log.exception('Local search: FAIL')
+                        self.failed_entries.append(entry)
+                    self.PROGRESS.emit(progress)  # update the progress bar
+            elapsed = time.monotonic() - start
+            log_i('Scanned {} paths in {:.1f}s, {:.1f} paths/s'.format(
+                len(gallery_l), elapsed, len(gallery_l) / elapsed if elapsed else 0))
         else:  # if gallery folder is empty
             log_e('Local search error: Invalid directory')
             log_e('Gallery folder is empty')
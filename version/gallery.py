@@ -17,6 +17,7 @@ import logging
 import math
 import pickle
 import random
+import time
 from typing import ClassVar, Any, Union, Tuple, List, Iterable
 
 from PyQt5.QtCore import (Qt, QModelIndex, QVariant,
@@ -31,6 +32,8 @@ from PyQt5.QtWidgets import (QListView, QStyledItemDelegate, QStyle,
 
 
 from .executors import Executors
+from .search_index import gallery_index, compile_terms, narrows
+from .path_index import gallery_paths
 from . import gallerydb
 from . import app_constants
 from . import misc
@@ -90,62 +93,94 @@ log_c = log.critical
 #		node = parent.internalPointer()
 #		return len(node.subnodes)
 class GallerySearch(QObject):
+    """
+    Searches the galleries in chunks on a worker thread.
+    A search is dropped as soon as a newer one is requested, and results found so far
+    are published while the rest is searched.
+    """
     FINISHED: pyqtBoundSignal = pyqtSignal()
+    PARTIAL: pyqtBoundSignal = pyqtSignal()
+
+    CHUNK_SIZE: ClassVar[int] = 500
+    # seconds between publishing partial results
+    PUBLISH_INTERVAL: ClassVar[float] = 0.2
 
     def __init__(self, data):
         super().__init__()
         self._data = data
         self.result = {}
+        self._generation = 0
+        # state, terms and found galleries of the last completed search
+        self._last = None
 
         # filtering
         self.fav = False
         self._gallery_list = None
 
+    def new_search(self) -> int:
+        """Cancels the running search and returns the id to pass to search, safe to call from any thread"""
+        self._generation += 1
+        return self._generation
+
     def set_gallery_list(self, g_list):
         self._gallery_list = g_list
+        self._last = None
 
     def set_data(self, new_data):
         self._data = new_data
         self.result = {g.id: True for g in self._data}
+        self._last = None
 
     def set_fav(self, new_fav):
         self.fav = new_fav
 
-    def search(self, term, args):
+    def search(self, term, args, generation=None):
+        if generation is not None and generation != self._generation:
+            return
         term = ' '.join(term.split())
         search_pieces = utils.get_terms(term)
 
-        self._filter(search_pieces, args)
-        self.FINISHED.emit()
+        if self._filter(compile_terms(search_pieces, args), generation):
+            self.FINISHED.emit()
+
+    def _cancelled(self, generation) -> bool:
+        return generation is not None and generation != self._generation
 
-    def _filter(self, terms, args):
-        self.result.clear()
-        for gallery in self._data:
+    def _filter(self, terms, generation=None) -> bool:
+        """Returns False if the search was cancelled"""
+        state = (self.fav, self._gallery_list, gallery_index.revision, len(self._data))
+        if self._last and self._last[0] == state and narrows(terms, self._last[1]):
+            # the user kept typing, only the previous results can match
+            galleries = self._last[2]
+        else:
+            galleries = list(self._data)
             if self.fav:
-                if not gallery.fav:
-                    continue
+                galleries = [g for g in galleries if g.fav]
             if self._gallery_list:
-                if not gallery in self._gallery_list:
-                    continue
-            all_terms = {t: False for t in terms}
-            allow = False
-            if utils.all_opposite(terms):
-                self.result[gallery.id] = True
-                continue
-
-            for t in terms:
-                if gallery.contains(t, args):
-                    all_terms[t] = True
-
-            if all(all_terms.values()):
-                allow = True
-
-            self.result[gallery.id] = allow
+                galleries = [g for g in galleries if g in self._gallery_list]
+
+        matched = gallery_index.match(terms)
+        result = {}
+        found = []
+        published = time.time()
+        for n in range(0, len(galleries), self.CHUNK_SIZE):
+            if self._cancelled(generation):
+                return False
+            for gallery in gallery_index.search(galleries[n:n + self.CHUNK_SIZE], terms, matched=matched):
+                result[gallery.id] = True
+                found.append(gallery)
+            if time.time() - published > self.PUBLISH_INTERVAL:
+                published = time.time()
+                self.result = result
+                self.PARTIAL.emit()
+        self.result = result
+        self._last = (state, terms, found)
+        return True
 
 
 class SortFilterModel(QSortFilterProxyModel):
     ROWCOUNT_CHANGE: pyqtBoundSignal = pyqtSignal()
-    _DO_SEARCH: pyqtBoundSignal = pyqtSignal(str, object)
+    _DO_SEARCH: pyqtBoundSignal = pyqtSignal(str, object, int)
     _CHANGE_SEARCH_DATA: pyqtBoundSignal = pyqtSignal(list)
     _CHANGE_FAV: pyqtBoundSignal = pyqtSignal(bool)
     _SET_GALLERY_LIST: pyqtBoundSignal = pyqtSignal(object)
@@ -211,6 +246,7 @@ class SortFilterModel(QSortFilterProxyModel):
             self.gallery_search = GallerySearch(self.sourceModel()._data)
             self.gallery_search.FINISHED.connect(self.invalidateFilter)
             self.gallery_search.FINISHED.connect(lambda: self.ROWCOUNT_CHANGE.emit())
+            self.gallery_search.PARTIAL.connect(self.invalidateFilter)
             self.gallery_search.moveToThread(app_constants.GENERAL_THREAD)
             self._DO_SEARCH.connect(self.gallery_search.search)
             self._SET_GALLERY_LIST.connect(self.gallery_search.set_gallery_list)
@@ -220,7 +256,11 @@ class SortFilterModel(QSortFilterProxyModel):
             self._search_ready = True
 
     def refresh(self):
-        self._DO_SEARCH.emit(self.current_term, self.current_args)
+        self._search(self.current_term, self.current_args)
+
+    def _search(self, term, args):
+        if self._search_ready:
+            self._DO_SEARCH.emit(term, args, self.gallery_search.new_search())
 
     def init_search(self, term, args=None, **kwargs):
         """
@@ -250,7 +290,7 @@ class SortFilterModel(QSortFilterProxyModel):
         if not history:
             self.HISTORY_SEARCH_TERM.emit(term)
         self.current_args = args
-        self._DO_SEARCH.emit(term, args)
+        self._search(term, args)
 
     def filterAcceptsRow(self, source_row, parent_index):
         if self.sourceModel():
@@ -655,6 +695,9 @@ class GalleryModel(QAbstractTableModel):
         self.beginInsertRows(QModelIndex(), position, position + rows - 1)
         for r in range(rows):
             self._data.insert(position, self._gallery_to_add.pop())
+        if self._data is app_constants.GALLERY_ADDITION_DATA:
+            # galleries not in the DB count as existing while they are in the addition list
+            gallery_paths.add(self._data[position:position + rows])
         self.endInsertRows()
         return True
 
@@ -669,10 +712,13 @@ class GalleryModel(QAbstractTableModel):
         self._data_count -= rows
         self.beginRemoveRows(QModelIndex(), position, position + rows - 1)
         for r in range(rows):
+            gallery = self._gallery_to_remove.pop()
             try:
-                self._data.remove(self._gallery_to_remove.pop())
+                self._data.remove(gallery)
             except ValueError:
                 return False
+            if self._data is app_constants.GALLERY_ADDITION_DATA and gallery.id is None:
+                gallery_paths.remove([gallery])
         self.endRemoveRows()
         return True
 
@@ -1637,15 +1683,16 @@ class MangaViews:
                 g.view = self.view_type
                 if self.view_type != app_constants.ViewType.Duplicate:
                     g.state = app_constants.GalleryState.New
-                if db:
-                    gallerydb.execute(gallerydb.GalleryDB.add_gallery, True, g)
-                else:
-                    if not g.profile:
-                        Executors.generate_thumbnail(g, on_method=g.set_profile)
+                if not db and not g.profile:
+                    Executors.generate_thumbnail(g, on_method=g.set_profile)
+            if db:
+                gallerydb.execute(gallerydb.GalleryDB.add_galleries, True, list(gallery))
             rows = len(gallery)
             self.list_view.gallery_model._gallery_to_add.extend(gallery)
             if record_time:
-                g.qtime = QTime.currentTime()
+                qtime = QTime.currentTime()
+                for g in gallery:
+                    g.qtime = qtime
         else:
             gallery.view = self.view_type
             if self.view_type != app_constants.ViewType.Duplicate:
@@ -1653,7 +1700,7 @@ class MangaViews:
             rows = 1
             self.list_view.gallery_model._gallery_to_add.append(gallery)
             if record_time:
-                g.qtime = QTime.currentTime()
+                gallery.qtime = QTime.currentTime()
             if db:
                 gallerydb.execute(gallerydb.GalleryDB.add_gallery, True, gallery)
             else:
@@ -16,25 +16,33 @@ from __future__ import annotations
 import datetime
 import functools
 import io
+import itertools
 import logging
 import os
 import queue
 import threading
+import traceback
 import uuid
+from concurrent import futures
 from typing import Any, Callable, List, Union, Optional, Dict, Literal, ClassVar, Tuple, Set, Iterable
 
 import scandir
 from PyQt5.QtCore import QObject, pyqtSignal, QTime, pyqtBoundSignal
 from dateutil import parser as dateparser
 
-from .utils import (today, ArchiveFile, generate_img_hash, delete_path,
+from .utils import (today, ArchiveFile, delete_path,
                     ARCHIVE_FILES, get_gallery_img, IMG_FILES, b_search)
 from .database import db_constants
 from .database import db
 from .database.db import DBBase
 from .executors import Executors
+from .search_index import gallery_index
+from .path_index import gallery_paths
+from .thumbnail_store import thumbnail_store
+from .scan_manifest import scan_manifest
 
 from . import app_constants
+from . import duplicates
 from . import utils
 
 log = logging.getLogger(__name__)
@@ -45,84 +53,145 @@ log_e = log.error
 log_c = log.critical
 
 method_queue = queue.PriorityQueue()
-method_return = queue.Queue()
 db_constants.METHOD_QUEUE = method_queue
-db_constants.METHOD_RETURN = method_return
+
+# parameters per IN (...) query, older sqlite versions allow at most 999 in a statement
+MAX_SQL_VARIABLES = 500
+
+
+def _sql_chunks(items: Iterable) -> Iterable[List]:
+    """Yields the distinct items in chunks small enough to be the parameters of one query"""
+    items = list(dict.fromkeys(items))
+    for n in range(0, len(items), MAX_SQL_VARIABLES):
+        yield items[n:n + MAX_SQL_VARIABLES]
 
 
 class PriorityObject:
     p: int
     data: Any
+    # methods with the same priority run in the order they were queued
+    _order = itertools.count()
 
     def __init__(self, priority: int, data: Any):
         self.p = priority
         self.data = data
+        self.n = next(self._order)
 
     def __lt__(self, other):
-        return self.p < other.p
+        return (self.p, self.n) < (other.p, other.n)
+
+
+def read_only(fn):
+    """Marks a DB method as read-only, letting execute run it on a reader connection"""
+    fn.read_only = True
+    return fn
+
+
+def _run_method(method: Callable, args: tuple, kwargs: dict, future: futures.Future) -> None:
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(method(*args, **kwargs))
+    except BaseException as e:
+        future.set_exception(e)
 
 
 def process_methods():
     """
-    Methods are objects.
-    Put a list in the method queue where first index is the
-    method. Named arguments are put in a dict.
+    Methods put in the method queue are run one at a time on the writer connection.
+    Each item is a tuple of method, args, kwargs and the future to set the result on.
     """
     while True:
-        l = method_queue.get().data
+        method, args, kwargs, future = method_queue.get().data
         log_d('Processing a method from queue...')
-        method = l.pop(0)
         log_d(method)
-        args = []
-        kwargs = {}
-        get_args = 1
-        no_return = False
-        while get_args:
-            try:
-                a = l.pop(0)
-                if a == 'no return':
-                    no_return = True
-                    continue
-                if isinstance(a, dict):
-                    kwargs = a
-                else:
-                    args.append(a)
-            except IndexError:
-                get_args = 0
-        args = tuple(args)
-        if args and kwargs:
-            r = method(*args, **kwargs)
-        elif args:
-            r = method(*args)
-        elif kwargs:
-            r = method(**kwargs)
-        else:
-            r = method()
-        if not no_return:
-            method_return.put(r)
+        _run_method(method, args, kwargs, future)
         method_queue.task_done()
 
 
+def _read_method(method: Callable, args: tuple, kwargs: dict) -> Any:
+    if not DBBase.use_read_connection():
+        # reads can't be done next to the writer, queue it with the writes instead
+        return submit(method, *args, read=False, **kwargs).result()
+    return method(*args, **kwargs)
+
+
+def _track_write(future: futures.Future, priority: int) -> None:
+    """Counts the queued write as pending for the calling thread until it is done"""
+    ident = threading.get_ident()
+    with _pending_lock:
+        pending = _pending_writes.setdefault(ident, [0, priority])
+        pending[0] += 1
+        pending[1] = max(pending[1], priority)
+
+    def done(_):
+        with _pending_lock:
+            pending[0] -= 1
+            if not pending[0] and _pending_writes.get(ident) is pending:
+                del _pending_writes[ident]
+
+    future.add_done_callback(done)
+
+
+def _log_exception(future: futures.Future) -> None:
+    if not future.cancelled() and future.exception():
+        e = future.exception()
+        log_e('DB method failed: {}'.format(repr(e)))
+        log_d(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+
 method_queue_thread = threading.Thread(name='Method Queue Thread', target=process_methods,
                                        daemon=True)
 method_queue_thread.start()
+reader_pool = futures.ThreadPoolExecutor(max(1, app_constants.DB_READERS), thread_name_prefix='DB Reader')
+# thread ident -> [writes it queued that aren't done, highest priority number among them]
+_pending_writes: Dict[int, List[int]] = {}
+_pending_lock = threading.Lock()
 
 
-def execute(method: Callable, no_return: bool, *args, **kwargs) -> Any:
+def submit(method: Callable, *args, **kwargs) -> futures.Future:
+    """
+    Runs method on a DB connection and returns a future with its result.
+    Methods marked with read_only run on the reader pool, everything else is queued
+    by priority (lower comes first) and run one at a time on the writer connection.
+    Pass read=True/False to override where the method runs.
+    A thread reads what it wrote: while writes it queued are pending, its reads are queued after them
+    instead of going to the reader pool. Reads see the writes of other threads only once those are done.
+    """
+    return _submit(method, args, kwargs)
+
+
+def _submit(method: Callable, args: tuple, kwargs: dict, defer: bool = False) -> futures.Future:
+    priority: int = kwargs.pop("priority", 999)
+    read: bool = kwargs.pop("read", getattr(method, 'read_only', False))
     log_d('Added method to queue')
     log_d('Method name: {}'.format(method.__name__))
-    arg_list = [method]
-    priority: int = kwargs.pop("priority", 999)
+    on_writer = threading.current_thread() is method_queue_thread
+    if read and not on_writer:
+        with _pending_lock:
+            pending = _pending_writes.get(threading.get_ident())
+        if pending is None:
+            return reader_pool.submit(_read_method, method, args, kwargs)
+        # the read has to see the writes this thread queued
+        priority = max(priority, pending[1])
+    future = futures.Future()
+    if on_writer and not defer:
+        # waiting on a queued method from the queue itself would never return
+        _run_method(method, args, kwargs, future)
+    else:
+        if not read and not on_writer:
+            _track_write(future, priority)
+        method_queue.put(PriorityObject(priority, (method, args, kwargs, future)))
+    return future
+
+
+def execute(method: Callable, no_return: bool, *args, **kwargs) -> Any:
+    """Same as submit, but waits for and returns the result unless no_return is set"""
+    future = _submit(method, args, kwargs, defer=no_return)
     if no_return:
-        arg_list.append('no return')
-    if args:
-        for x in args:
-            arg_list.append(x)
-    if kwargs:
-        arg_list.append(kwargs)
-    method_queue.put(PriorityObject(priority, arg_list))
-    if not no_return:
-        return method_return.get()
+        future.add_done_callback(_log_exception)
+        return None
+    return future.result()
 
 
 def chapter_map(row, chapter: Chapter) -> Chapter:
@@ -430,13 +499,39 @@ class GalleryModifier:
             else:
                 raise ValueError('Unknown Case {}, args: {}.'.format(case, args))
 
-        if buffer:
-            values.append(self.id)
-            stmt = 'UPDATE series SET {} WHERE series_id=? ;'.format(', '.join(buffer))
-            GalleryDB.execute(stmt, tuple(values))
+        if not buffer and not procs:
+            return
 
-        for proc in procs:
-            proc()
+        # one transaction for the series update and the procs
+        in_transaction = GalleryDB._STATE['active']
+        if not in_transaction:
+            GalleryDB.begin()
+        try:
+            if buffer:
+                values.append(self.id)
+                stmt = 'UPDATE series SET {} WHERE series_id=? ;'.format(', '.join(buffer))
+                GalleryDB.execute(stmt, tuple(values))
+
+            for proc in procs:
+                proc()
+        finally:
+            if not in_transaction:
+                GalleryDB.end()
+        gallery_index.update(self.id)
+        gallery_paths.update(self.id)
+
+    @staticmethod
+    def execute_all(modifiers: Iterable[GalleryModifier]) -> None:
+        """Executes the given modifiers in a single transaction"""
+        in_transaction = GalleryDB._STATE['active']
+        if not in_transaction:
+            GalleryDB.begin()
+        try:
+            for modifier in modifiers:
+                modifier.execute()
+        finally:
+            if not in_transaction:
+                GalleryDB.end()
 
     @classmethod
     def from_gallery(cls, gallery: Gallery, only_include: Optional[Iterable[str]] = None) -> GalleryModifier:
@@ -592,12 +687,15 @@ class GalleryDB(DBBase):
         get_gallery_by_path -> Returns gallery with given path
         get_gallery_by_id -> Returns gallery with given id
         add_gallery -> adds gallery into db
+        add_galleries -> adds a list of galleries into db in a single transaction
         set_gallery_title -> changes gallery title
         gallery_count -> returns amount of gallery (can be used for indexing)
         del_gallery -> deletes the gallery with the given id recursively
         check_exists -> Checks if provided string exists
         clear_thumb -> Deletes a thumbnail
         clear_thumb_dir -> Dletes everything in the thumbnail directory
+        get_profiles -> Returns the thumbnail paths of all galleries and lists
+        sweep_thumbs -> Deletes the thumbnails no gallery or list uses
     """
 
     def __init__(self):
@@ -626,6 +724,11 @@ class GalleryDB(DBBase):
         except FileNotFoundError:
             pass
 
+        if thumbnail_store.owns(path):
+            # might be shared with other galleries
+            thumbnail_store.release(path)
+            return
+
         try:
             if os.path.isfile(path):
                 os.unlink(path)
@@ -635,9 +738,23 @@ class GalleryDB(DBBase):
     @staticmethod
     def clear_thumb_dir() -> None:
         """Deletes everything in the thumbnail directory"""
-        if os.path.exists(db_constants.THUMBNAIL_PATH):
-            for thumbfile in scandir.scandir(db_constants.THUMBNAIL_PATH):
-                GalleryDB.clear_thumb(thumbfile.path)
+        thumbnail_store.clear()
+
+    @classmethod
+    @read_only
+    def get_profiles(cls) -> Set[str]:
+        """Returns the thumbnail paths of all galleries and lists"""
+        cursor = cls.execute('SELECT profile FROM series UNION SELECT profile FROM list')
+        profiles = set()
+        for row in cursor.fetchall():
+            if row['profile']:
+                profiles.add(row['profile'] if isinstance(row['profile'], str) else bytes.decode(row['profile']))
+        return profiles
+
+    @staticmethod
+    def sweep_thumbs() -> int:
+        """Deletes the thumbnails no gallery or list uses, returns how many were deleted"""
+        return thumbnail_store.sweep(execute(GalleryDB.get_profiles, False))
 
     @staticmethod
     def rebuild_gallery(gallery: Gallery, thumb=False) -> bool:
@@ -760,8 +877,11 @@ class GalleryDB(DBBase):
 
         for query in executing:
             cls.execute(*query)
+        gallery_index.update(series_id)
+        gallery_paths.update(series_id)
 
     @classmethod
+    @read_only
     def get_all_gallery(cls, chapters: bool = True, tags: bool = True, hashes: bool = True):
         """
         Careful, might crash with very large libraries i think...
@@ -772,15 +892,21 @@ class GalleryDB(DBBase):
         return GalleryDB.gen_galleries(all_gallery, chapters, tags, hashes)
 
     @staticmethod
+    @read_only
     def gen_galleries(gallery_dict, chapters=True, tags=True, hashes=True):
         """
         Map galleries fetched from DB
         """
         gallery_list = []
+        gallery_dict = list(gallery_dict)
+        # the tags of all the galleries in a query per batch instead of one per gallery
+        galleries_tags = TagDB.get_galleries_tags([r['series_id'] for r in gallery_dict]) if tags else {}
         for gallery_row in gallery_dict:
             gallery = Gallery()
             gallery.id = gallery_row['series_id']
-            gallery = gallery_map(gallery_row, gallery, chapters, tags, hashes)
+            gallery = gallery_map(gallery_row, gallery, chapters, False, hashes)
+            if tags:
+                gallery.tags = galleries_tags.get(gallery.id, {})
             if not os.path.exists(gallery.path):
                 gallery.dead_link = True
             ListDB.query_gallery(gallery)
@@ -788,11 +914,14 @@ class GalleryDB(DBBase):
 
         return gallery_list
 
+    _BY_PATH_SQL = 'SELECT * FROM series WHERE series_path=?'
+
     @classmethod
+    @read_only
     def get_gallery_by_path(cls, path):
         """Returns gallery with given path"""
         assert isinstance(path, str), "Provided path is invalid"
-        cursor = cls.execute('SELECT * FROM series WHERE series_path=?', (str.encode(path),))
+        cursor = cls.execute(cls._BY_PATH_SQL, (str.encode(path),))
         row = cursor.fetchone()
         try:
             gallery = Gallery()
@@ -803,6 +932,7 @@ class GalleryDB(DBBase):
             return None
 
     @classmethod
+    @read_only
     def get_gallery_by_id(cls, id):
         """Returns gallery with given id"""
         assert isinstance(id, int), "Provided ID is invalid"
@@ -822,9 +952,6 @@ class GalleryDB(DBBase):
         assert isinstance(gallery, Gallery), "add_gallery method only accepts gallery items"
         log_i('Recevied gallery: {}'.format(gallery.path.encode(errors='ignore')))
 
-        # TODO: implement mass gallery adding!  User execute_many method for
-        # effeciency!
-
         cursor = cls.execute(*default_exec(gallery))
         series_id = cursor.lastrowid
         gallery.id = series_id
@@ -833,8 +960,54 @@ class GalleryDB(DBBase):
         if gallery.tags:
             TagDB.add_tags(gallery)
         ChapterDB.add_chapters(gallery)
+        gallery_index.add([gallery])
+        gallery_paths.add([gallery])
 
     @classmethod
+    def add_galleries(cls, galleries: List[Gallery], gallery_list: Optional[GalleryList] = None) -> None:
+        """
+        Appends a list of gallery objects to DB in a single transaction
+        Galleries are also mapped to gallery_list if provided
+        """
+        assert isinstance(galleries, list), "add_galleries method only accepts a list of gallery items"
+        if not galleries:
+            return
+        log_i('Recevied {} galleries'.format(len(galleries)))
+
+        in_transaction = cls._STATE['active']
+        if not in_transaction:
+            cls.begin()
+        try:
+            tag_lookup = TagDB.tag_lookup()
+            chapters_exec = []
+            tags_exec = []
+            for gallery in galleries:
+                assert isinstance(gallery, Gallery), "add_galleries method only accepts gallery items"
+                cursor = cls.execute(*default_exec(gallery))
+                gallery.id = cursor.lastrowid
+                for chap in gallery.chapters:
+                    chapters_exec.append(default_chap_exec(gallery, chap, True))
+                if gallery.tags:
+                    tags_exec.extend((gallery.id, t_map_id) for t_map_id in
+                                     TagDB.get_tags_mappings_ids(gallery.tags, tag_lookup))
+
+            cls.executemany('INSERT INTO chapters VALUES(NULL, ?, ?, ?, ?, ?, ?)', chapters_exec)
+            cls.executemany('INSERT OR IGNORE INTO series_tags_map(series_id, tags_mappings_id) VALUES(?, ?)',
+                            tags_exec)
+            if gallery_list:
+                ListDB.add_gallery_to_list(galleries, gallery_list)
+        finally:
+            if not in_transaction:
+                cls.end()
+        gallery_index.add(galleries)
+        gallery_paths.add(galleries)
+
+        for gallery in galleries:
+            if not gallery.profile:
+                Executors.generate_thumbnail(gallery, on_method=gallery.set_profile)
+
+    @classmethod
+    @read_only
     def gallery_count(cls) -> int:
         """
         Returns the amount of galleries in db.
@@ -848,12 +1021,13 @@ class GalleryDB(DBBase):
         assert isinstance(list_of_gallery, list), "Please provide a valid list of galleries to delete"
         for gallery in list_of_gallery:
             if local:
-                app_constants.TEMP_PATH_IGNORE.append(os.path.normcase(gallery.path))
+                app_constants.TEMP_PATH_IGNORE.add(os.path.normcase(gallery.path))
                 if gallery.is_archive:
                     s = delete_path(gallery.path)
                 else:
                     paths = [x.path for x in gallery.chapters]
-                    [app_constants.TEMP_PATH_IGNORE.append(os.path.normcase(x)) for x in paths]  # to avoid data race?
+                    for x in paths:
+                        app_constants.TEMP_PATH_IGNORE.add(os.path.normcase(x))
                     for chap, path in enumerate(paths):
                         s = delete_path(path)
                         if not s:
@@ -870,21 +1044,25 @@ class GalleryDB(DBBase):
 
             GalleryDB.clear_thumb(gallery.profile)
             cls.execute('DELETE FROM series WHERE series_id=?', (gallery.id,))
+            gallery_index.remove([gallery.id])
+            gallery_paths.remove([gallery])
+            # found again by the next scan if still there
+            scan_manifest.forget_entry(gallery.path)
             gallery.id = None
             log_i('Successfully deleted: {}'.format(gallery.title.encode('utf-8', 'ignore')))
             app_constants.NOTIF_BAR.add_text('Successfully deleted: {}'.format(gallery.title))
 
     @staticmethod
-    def check_exists(name, galleries=None, filter=True):
+    @read_only
+    def check_exists(name, galleries=None, filter=True, path_in_archive=None):
         """
-        Checks if provided string exists in provided sorted
-        list based on path name.
+        Checks if a gallery has the path name, or is at path_in_archive in the archive name if given.
+        The galleries in the library and in the addition list are looked up in gallery_paths,
+        pass galleries to check a sorted list of paths instead.
         Note: key will be normcased
         """
-        # pdb.set_trace()
         if galleries is None:
-            galleries = app_constants.GALLERY_DATA + app_constants.GALLERY_ADDITION_DATA
-            filter = True
+            return gallery_paths.contains(name, path_in_archive)
 
         if filter:
             filter_list = []
@@ -969,13 +1147,16 @@ class ChapterDB(DBBase):
 
         cls.executemany('INSERT INTO chapters VALUES(NULL, ?, ?, ?, ?, ?, ?)', executing)
 
+    _GALLERY_CHAPTERS_SQL = 'SELECT * FROM chapters WHERE series_id=?'
+
     @classmethod
+    @read_only
     def get_chapters_for_gallery(cls, series_id):
         """
         Returns a ChaptersContainer of chapters matching the received series_id
         """
         assert isinstance(series_id, int), "Please provide a valid gallery ID"
-        cursor = cls.execute('SELECT * FROM chapters WHERE series_id=?', (series_id,))
+        cursor = cls.execute(cls._GALLERY_CHAPTERS_SQL, (series_id,))
         rows = cursor.fetchall()
         chapters = ChaptersContainer()
 
@@ -985,6 +1166,25 @@ class ChapterDB(DBBase):
         return chapters
 
     @classmethod
+    @read_only
+    def get_chapters_for_galleries(cls) -> Dict[int, ChaptersContainer]:
+        """
+        Returns a dict of series_id -> ChaptersContainer for all galleries
+        The chapters table is streamed in a single query ordered by series_id
+        """
+        cursor = cls.execute('SELECT * FROM chapters ORDER BY series_id')
+        galleries_chapters = {}
+        for row in cursor:
+            series_id = row['series_id']
+            chapters = galleries_chapters.get(series_id)
+            if chapters is None:
+                chapters = galleries_chapters[series_id] = ChaptersContainer()
+            chap = chapters.create_chapter(row['chapter_number'])
+            chapter_map(row, chap)
+        return galleries_chapters
+
+    @classmethod
+    @read_only
     def get_chapter(cls, series_id, chap_numb):
         """Returns a ChaptersContainer of chapters matching the recieved chapter_number
         return None for no match
@@ -1002,13 +1202,15 @@ class ChapterDB(DBBase):
             return None
         return chapters
 
+    _CHAPTER_ID_SQL = 'SELECT chapter_id FROM chapters WHERE series_id=? AND chapter_number=?'
+
     @classmethod
+    @read_only
     def get_chapter_id(cls, series_id: int, chapter_number: int) -> Optional[int]:
         """Returns id of the chapter number"""
         assert isinstance(series_id, int) and isinstance(chapter_number, int), \
             "Passed args must be of int not {} and {}".format(type(series_id), type(chapter_number))
-        cursor = cls.execute('SELECT chapter_id FROM chapters WHERE series_id=? AND chapter_number=?',
-                             (series_id, chapter_number,))
+        cursor = cls.execute(cls._CHAPTER_ID_SQL, (series_id, chapter_number,))
         try:
             row = cursor.fetchone()
             chp_id = row['chapter_id']
@@ -1049,11 +1251,15 @@ class TagDB(DBBase):
     del_tags <- Deletes the tags with corresponding tag_ids from DB
     del_gallery_tags_mapping <- Deletes the tags and gallery mappings with corresponding series_ids from DB
     get_gallery_tags -> Returns all tags and namespaces found for the given series_id;
+    get_galleries_tags -> Returns a dict of series_id -> tags for the given series_ids
+    get_all_gallery_tags -> Returns a dict of series_id -> tags for all galleries
     get_tag_gallery -> Returns all galleries with the given tag
     get_ns_tags -> "Returns a dict with namespace as key and list of tags as value"
     get_ns_tags_to_gallery -> Returns all galleries linked to the namespace tags. Receives a dict like this: {"namespace":["tag1","tag2"]}
     get_tags_from_namespace -> Returns all galleries linked to the namespace
     add_tags <- Adds the given dict_of_tags to the given series_id
+    tag_lookup -> Returns an in-memory lookup of namespace, tag and tags_mappings ids
+    get_tags_mappings_ids -> Returns the tags_mappings ids for the given dict_of_tags
     modify_tags <- Modifies the given tags
     get_all_tags -> Returns all tags in database
     get_all_ns -> Returns all namespaces in database
@@ -1075,47 +1281,95 @@ class TagDB(DBBase):
         # delete all mappings related to the given series_id
         cls.execute('DELETE FROM series_tags_map WHERE series_id=?', [series_id])
 
+    _GALLERY_TAGS_SQL = """SELECT series_tags_map.series_id, namespaces.namespace, tags.tag
+                        FROM series_tags_map
+                        INNER JOIN tags_mappings
+                        ON series_tags_map.tags_mappings_id=tags_mappings.tags_mappings_id
+                        INNER JOIN namespaces ON tags_mappings.namespace_id=namespaces.namespace_id
+                        INNER JOIN tags ON tags_mappings.tag_id=tags.tag_id"""
+
+    @staticmethod
+    def _group_gallery_tags(rows) -> Dict[int, Dict[str, List[str]]]:
+        galleries_tags = {}
+        for row in rows:
+            tags = galleries_tags.setdefault(row['series_id'], {})
+            tags.setdefault(row['namespace'], []).append(row['tag'])
+        return galleries_tags
+
     @classmethod
+    @read_only
     def get_gallery_tags(cls, series_id):
         """Returns all tags and namespaces found for the given series_id"""
         if not isinstance(series_id, int):
             return {}
-        cursor = cls.execute('SELECT tags_mappings_id FROM series_tags_map WHERE series_id=?',
-                             (series_id,))
-        tags = {}
-        result = cursor.fetchall()
-        for tag_map_row in result:  # iterate all tag_mappings_ids
-            try:
-                if not tag_map_row:
-                    continue
-                # get tag and namespace
-                c = cls.execute('SELECT namespace_id, tag_id FROM tags_mappings WHERE tags_mappings_id=?',
-                                (tag_map_row['tags_mappings_id'],))
-                for row in c.fetchall():  # iterate all rows
-                    # get namespace
-                    c = cls.execute('SELECT namespace FROM namespaces WHERE namespace_id=?',
-                                    (row['namespace_id'],))
-                    try:
-                        namespace = c.fetchone()['namespace']
-                    except TypeError:
-                        continue
+        cursor = cls.execute(cls._GALLERY_TAGS_SQL + ' WHERE series_tags_map.series_id=?', (series_id,))
+        return cls._group_gallery_tags(cursor).get(series_id, {})
 
-                    # get tag
-                    c = cls.execute('SELECT tag FROM tags WHERE tag_id=?', (row['tag_id'],))
-                    try:
-                        tag = c.fetchone()['tag']
-                    except TypeError:
-                        continue
+    @classmethod
+    @read_only
+    def get_galleries_tags(cls, series_ids: Iterable[int]) -> Dict[int, Dict[str, List[str]]]:
+        """
+        Returns a dict of series_id -> {"namespace":["tag1","tag2"]} for the given series_ids
+        Galleries without tags are mapped to an empty dict
+        """
+        series_ids = [s_id for s_id in series_ids if isinstance(s_id, int)]
+        galleries_tags = {s_id: {} for s_id in series_ids}
+        for chunk in _sql_chunks(series_ids):
+            cursor = cls.execute(cls._GALLERY_TAGS_SQL + ' WHERE series_tags_map.series_id IN ({})'.format(
+                ','.join('?' * len(chunk))), chunk)
+            galleries_tags.update(cls._group_gallery_tags(cursor))
+        return galleries_tags
 
-                    # add them to dict
-                    if not namespace in tags:
-                        tags[namespace] = [tag]
-                    else:
-                        # namespace already exists in dict
-                        tags[namespace].append(tag)
-            except IndexError:
-                continue
-        return tags
+    @classmethod
+    @read_only
+    def get_all_gallery_tags(cls) -> Dict[int, Dict[str, List[str]]]:
+        """
+        Returns a dict of series_id -> {"namespace":["tag1","tag2"]} for all galleries
+        The tags are streamed in a single joined query ordered by series_id
+        """
+        cursor = cls.execute(cls._GALLERY_TAGS_SQL + ' ORDER BY series_tags_map.series_id')
+        return cls._group_gallery_tags(cursor)
+
+    @classmethod
+    def tag_lookup(cls) -> Dict[str, Dict]:
+        """
+        Returns an in-memory lookup of all namespace, tag and tags_mappings ids in DB
+        Pass it to get_tags_mappings_ids to avoid querying ids for every gallery
+        """
+        return {
+            'namespace': {r['namespace']: r['namespace_id'] for r in
+                          cls.execute('SELECT namespace_id, namespace FROM namespaces')},
+            'tag': {r['tag']: r['tag_id'] for r in cls.execute('SELECT tag_id, tag FROM tags')},
+            'tags_mappings': {(r['namespace_id'], r['tag_id']): r['tags_mappings_id'] for r in
+                              cls.execute('SELECT tags_mappings_id, namespace_id, tag_id FROM tags_mappings')}
+        }
+
+    @classmethod
+    def get_tags_mappings_ids(cls, dict_of_tags: Dict[str, List[str]], lookup: Dict[str, Dict]) -> List[int]:
+        """
+        Returns the tags_mappings ids for the given dict_of_tags
+        Missing namespaces, tags and mappings are added to DB and to the lookup
+        """
+        ns_ids = lookup['namespace']
+        tag_ids = lookup['tag']
+        map_ids = lookup['tags_mappings']
+        tags_mappings_id_list = []
+        for namespace in dict_of_tags:
+            namespace_id = ns_ids.get(namespace)
+            if not namespace_id:
+                namespace_id = ns_ids[namespace] = cls.execute('INSERT INTO namespaces(namespace) VALUES(?)',
+                                                               (namespace,)).lastrowid
+            for tag in dict_of_tags[namespace]:
+                tag_id = tag_ids.get(tag)
+                if not tag_id:
+                    tag_id = tag_ids[tag] = cls.execute('INSERT INTO tags(tag) VALUES(?)', (tag,)).lastrowid
+                t_map_id = map_ids.get((namespace_id, tag_id))
+                if not t_map_id:
+                    t_map_id = map_ids[(namespace_id, tag_id)] = cls.execute(
+                        'INSERT INTO tags_mappings(namespace_id, tag_id) VALUES(?, ?)',
+                        (namespace_id, tag_id,)).lastrowid
+                tags_mappings_id_list.append(t_map_id)
+        return tags_mappings_id_list
 
     @classmethod
     def add_tags(cls, obj):
@@ -1217,30 +1471,15 @@ class TagDB(DBBase):
         pass
 
     @classmethod
+    @read_only
     def get_ns_tags(cls):
         """Returns a dict of all tags with namespace as key and list of tags as value"""
-        cursor = cls.execute('SELECT namespace_id, tag_id FROM tags_mappings')
+        cursor = cls.execute("""SELECT namespaces.namespace, tags.tag FROM tags_mappings
+                             INNER JOIN namespaces ON tags_mappings.namespace_id=namespaces.namespace_id
+                             INNER JOIN tags ON tags_mappings.tag_id=tags.tag_id""")
         ns_tags = {}
-        ns_id_history = {}  # to avoid unesseccary DB fetching
-        for t in cursor.fetchall():
-            try:
-                # get namespace
-                if not t['namespace_id'] in ns_id_history:
-                    c = cls.execute('SELECT namespace FROM namespaces WHERE namespace_id=?', (t['namespace_id'],))
-                    ns = c.fetchone()['namespace']
-                    ns_id_history[t['namespace_id']] = ns
-                else:
-                    ns = ns_id_history[t['namespace_id']]
-                # get tag
-                c = cls.execute('SELECT tag FROM tags WHERE tag_id=?', (t['tag_id'],))
-                tag = c.fetchone()['tag']
-                # put in dict
-                if ns in ns_tags:
-                    ns_tags[ns].append(tag)
-                else:
-                    ns_tags[ns] = [tag]
-            except:
-                continue
+        for row in cursor:
+            ns_tags.setdefault(row['namespace'], []).append(row['tag'])
         return ns_tags
 
     @staticmethod
@@ -1257,6 +1496,7 @@ class TagDB(DBBase):
         pass
 
     @classmethod
+    @read_only
     def get_all_tags(cls):
         """
         Returns all tags in database in a list
@@ -1266,6 +1506,7 @@ class TagDB(DBBase):
         return tags
 
     @classmethod
+    @read_only
     def get_all_ns(cls):
         """
         Returns all namespaces in database in a list
@@ -1303,11 +1544,14 @@ class ListDB(DBBase):
 
         return lists
 
+    _GALLERY_LISTS_SQL = 'SELECT list_id FROM series_list_map WHERE series_id=?'
+
     @classmethod
+    @read_only
     def query_gallery(cls, gallery):
         """Maps gallery to the correct lists"""
 
-        c = cls.execute('SELECT list_id FROM series_list_map WHERE series_id=?', (gallery.id,))
+        c = cls.execute(cls._GALLERY_LISTS_SQL, (gallery.id,))
         list_rows = [x['list_id'] for x in c.fetchall()]
         for l in app_constants.GALLERY_LISTS:
             if l._id in list_rows:
@@ -1385,58 +1629,56 @@ class HashDB(DBBase):
     """
     Contains the following methods:
 
+    count_matches -> returns how many of the given hashes each gallery has
     find_gallery -> returns galleries which matches the given list of hashes
     get_gallery_hashes -> returns all hashes with the given gallery id in a list
     get_gallery_hash -> returns hash of chapter specified. If page is specified, returns hash of chapter page
+    get_all_phashes -> returns the perceptual hashes of all galleries
+    gen_gallery_phashes -> returns perceptual hashes of sampled pages of the gallery, add_phashes stores them
     gen_gallery_hashes <- generates hashes for gallery's chapters and inserts them to db
     rebuild_gallery_hashes <- inserts hashes into DB only if it doesnt already exist
     """
 
+    _COUNT_MATCHES_SQL = ('SELECT series_id, COUNT(DISTINCT hash) FROM hashes WHERE hash IN ({}) '
+                          'GROUP BY series_id')
+
+    @classmethod
+    @read_only
+    def count_matches(cls, hashes: Iterable) -> Dict[int, int]:
+        """
+        Returns series_id -> how many of the distinct hashes the gallery has, for every gallery having any of them
+        """
+        counts = {}
+        for chunk in _sql_chunks(hashes):
+            c = cls.execute(cls._COUNT_MATCHES_SQL.format(', '.join('?' * len(chunk))), chunk)
+            for g_id, count in c.fetchall():
+                counts[g_id] = counts.get(g_id, 0) + count
+        return counts
+
     @classmethod
+    @read_only
     def find_gallery(cls, hashes: List):
+        """
+        Returns the gallery having every one of the hashes, as a Gallery with only the id set.
+        Returns None if no gallery has them all.
+        """
         assert isinstance(hashes, list)
-        gallery_ids = {}
-        hash_status = []
-        for hash in hashes:
-            r = cls.execute('SELECT series_id FROM hashes WHERE hash=?', (hash,))
-            try:
-                g_ids = r.fetchall()
-                for r in g_ids:
-                    g_id = r['series_id']
-                    if g_id not in gallery_ids:
-                        gallery_ids[g_id] = 1
-                    else:
-                        gallery_ids[g_id] = gallery_ids[g_id] + 1
-                if g_ids:
-                    hash_status.append(True)
-                else:
-                    hash_status.append(False)
-            except KeyError:
-                hash_status.append(False)
-            except TypeError:
-                hash_status.append(False)
-
-        if all(hash_status):
-            # the one with most matching hashes
-            g_id = None
-            h_match_count = 0
-            for g in gallery_ids:
-                gallery_id = gallery_ids[g]
-                if gallery_id > h_match_count:
-                    h_match_count = gallery_id
-                    g_id = g
-            if g_id:
-                weak_gallery = Gallery()
-                weak_gallery.id = g_id
-                return weak_gallery
-
+        wanted = len(set(hashes))
+        # the chunks hold distinct hashes, so a count is only complete if the gallery has every hash
+        matches = [g_id for g_id, count in cls.count_matches(hashes).items() if count == wanted]
+        if matches:
+            weak_gallery = Gallery()
+            weak_gallery.id = min(matches)
+            return weak_gallery
         return None
 
+    _GALLERY_HASHES_SQL = 'SELECT hash FROM hashes WHERE series_id=?'
+
     @classmethod
+    @read_only
     def get_gallery_hashes(cls, gallery_id: int) -> List[bytes]:
         """Returns all hashes with the given gallery id in a list"""
-        cursor = cls.execute('SELECT hash FROM hashes WHERE series_id=?',
-                             (gallery_id,))
+        cursor = cls.execute(cls._GALLERY_HASHES_SQL, (gallery_id,))
         hashes = []
         try:
             for row in cursor.fetchall():
@@ -1445,6 +1687,68 @@ class HashDB(DBBase):
             return []
         return hashes
 
+    @classmethod
+    @read_only
+    def get_all_gallery_hashes(cls) -> Dict[int, List[bytes]]:
+        """Returns a dict of series_id -> list of hashes for all galleries"""
+        cursor = cls.execute('SELECT series_id, hash FROM hashes ORDER BY series_id')
+        galleries_hashes = {}
+        for row in cursor:
+            galleries_hashes.setdefault(row['series_id'], []).append(row['hash'])
+        return galleries_hashes
+
+    @classmethod
+    @read_only
+    def get_all_phashes(cls) -> Dict[int, List[int]]:
+        """Returns a dict of series_id -> perceptual hashes of the sampled pages, for the galleries having them"""
+        cursor = cls.execute('SELECT series_id, phash FROM phashes ORDER BY series_id, page')
+        galleries_phashes = {}
+        for row in cursor:
+            galleries_phashes.setdefault(row['series_id'], []).append(duplicates.from_blob(row['phash']))
+        return galleries_phashes
+
+    @classmethod
+    def add_phashes(cls, galleries_phashes: Dict[int, Dict[int, int]]) -> None:
+        """Stores the perceptual hashes, a dict of series_id -> page -> hash"""
+        cls.executemany('INSERT OR REPLACE INTO phashes(phash, series_id, page) VALUES(?, ?, ?)',
+                        [(duplicates.to_blob(h), g_id, p) for g_id, phashes in galleries_phashes.items()
+                         for p, h in phashes.items()])
+
+    @staticmethod
+    def gen_gallery_phashes(gallery: Gallery, samples: int) -> Dict[int, int]:
+        """
+        Returns page -> perceptual hash for samples pages of the gallery's first chapter.
+        Nothing is stored, see add_phashes.
+        """
+        if gallery.dead_link:
+            return {}
+        try:
+            chap = gallery.chapters[0]
+        except KeyError:
+            return {}
+        f_zip = None
+        try:
+            if gallery.is_archive:
+                f_zip = ArchiveFile(gallery.path)
+                imgs = sorted(f_zip.dir_images(chap.path))
+            elif os.path.isdir(chap.path):
+                imgs = sorted(x.path for x in scandir.scandir(chap.path) if x.path.lower().endswith(IMG_FILES))
+            else:
+                f_zip = ArchiveFile(chap.path)
+                imgs = sorted(f_zip.dir_images(''))
+            pages = {p: imgs[p] if f_zip is None else functools.partial(f_zip.open, imgs[p], True)
+                     for p in duplicates.sample_pages(len(imgs), samples)}
+            return Executors.phash_pages(pages)
+        except (app_constants.CreateArchiveFail, app_constants.FileNotFoundInArchive, OSError):
+            log_e('Could not generate perceptual hashes of gallery: {}'.format(gallery.title.encode(errors='ignore')))
+            return {}
+        finally:
+            if f_zip:
+                f_zip.close()
+
+    _CHAPTER_HASHES_SQL = 'SELECT hash, page FROM hashes WHERE series_id=? AND chapter_id=?'
+    _PAGE_HASH_SQL = 'SELECT hash FROM hashes WHERE series_id=? AND chapter_id=? AND page=?'
+
     @classmethod
     def get_gallery_hash(cls, gallery_id: int, chapter: int, page: Optional[int] = None) -> Optional[List[bytes]]:
         """
@@ -1458,10 +1762,10 @@ class HashDB(DBBase):
         if not chap_id:
             return None
         if page:
-            exceuting = ["SELECT hash FROM hashes WHERE series_id=? AND chapter_id=? AND page=?",
+            exceuting = [cls._PAGE_HASH_SQL,
                          (gallery_id, chap_id, page)]
         else:
-            exceuting = ["SELECT hash FROM hashes WHERE series_id=? AND chapter_id=?",
+            exceuting = [cls._CHAPTER_HASHES_SQL,
                          (gallery_id, chap_id)]
         hashes = []
         c = cls.execute(*exceuting)
@@ -1489,11 +1793,12 @@ class HashDB(DBBase):
         skip_gen = False
         chap_id = None
         hashes = {}
+        # page -> hash already in the db
+        stored = {}
         if gallery.id is not None:
             chap_id = ChapterDB.get_chapter_id(gallery.id, chapter)
 
-            c = cls.execute('SELECT hash, page FROM hashes WHERE series_id=? AND chapter_id=?',
-                            (gallery.id, chap_id,))
+            c = cls.execute(cls._CHAPTER_HASHES_SQL, (gallery.id, chap_id,))
             hashes = {}
             for r in c.fetchall():
                 try:
@@ -1501,6 +1806,7 @@ class HashDB(DBBase):
                         hashes[r['page']] = r['hash']
                 except TypeError:
                     pass
+            stored = dict(hashes)
             if isinstance(page, (int, list)):
                 if isinstance(page, int):
                     _page = [page]
@@ -1526,19 +1832,6 @@ class HashDB(DBBase):
                         skip_gen = False
 
         if not skip_gen or color_img:
-
-            def look_exists(page):
-                """check if hash already exists in database
-                returns hash, else returns None"""
-                c = cls.execute('SELECT hash FROM hashes WHERE page=? AND chapter_id=?',
-                                (page, chap_id,))
-                try:  # exists
-                    return c.fetchone()['hash']
-                except TypeError:  # doesnt exist
-                    return None
-                except IndexError:
-                    return None
-
             if gallery.dead_link:
                 log_e("Could not generate hash of dead gallery: {}".format(gallery.title.encode(errors='ignore')))
                 return {}
@@ -1552,7 +1845,6 @@ class HashDB(DBBase):
                 except KeyError:
                     return {}
 
-            executing = []
             try:
                 if gallery.is_archive:
                     raise NotADirectoryError
@@ -1580,19 +1872,7 @@ class HashDB(DBBase):
                         imgs = imgs[page]
                         pages = {page: imgs}
 
-                hashes = {}
-                if gallery.id is not None:
-                    for p in pages:
-                        h = look_exists(p)
-                        if not h:
-                            with open(pages[p], 'rb') as f:
-                                h = generate_img_hash(f)
-                            executing.append((h, gallery.id, chap_id, p,))
-                        hashes[p] = h
-                else:
-                    for i in pages:
-                        with open(pages[i], 'rb') as f:
-                            hashes[i] = generate_img_hash(f)
+                hashes = cls._hash_pages(pages, stored, gallery.id, chap_id)
 
             except NotADirectoryError:
                 _temp_dir = os.path.join(app_constants.temp_dir, str(uuid.uuid4()))
@@ -1615,39 +1895,28 @@ class HashDB(DBBase):
                         if not utils.image_greyscale(f_bytes):
                             return {'color': f_zip.extract(con[0])}
                         f_bytes.close()
+                    # the pages are opened by the hashing threads
                     if page == 'mid':
                         p = len(con) // 2
                         img = con[p]
-                        pages = {p: f_zip.open(img, True)}
+                        pages = {p: functools.partial(f_zip.open, img, True)}
                     elif isinstance(page, list):
                         for x in page:
-                            pages[x] = f_zip.open(con[x], True)
+                            pages[x] = functools.partial(f_zip.open, con[x], True)
                     else:
                         p = page
                         img = con[p]
-                        pages = {p: f_zip.open(img, True)}
+                        pages = {p: functools.partial(f_zip.open, img, True)}
 
                 else:
                     imgs = sorted(f_zip.dir_contents(chap.path))
                     for n, img in enumerate(imgs):
-                        pages[n] = f_zip.open(img, True)
-                f_zip.close()
-
-                hashes = {}
-                if gallery.id is not None:
-                    for p in pages:
-                        h = look_exists(p)
-                        if not h:
-                            h = generate_img_hash(pages[p])
-                            executing.append((h, gallery.id, chap_id, p,))
-                        hashes[p] = h
-                else:
-                    for i in pages:
-                        hashes[i] = generate_img_hash(pages[i])
+                        pages[n] = functools.partial(f_zip.open, img, True)
 
-            if executing:
-                cls.executemany('INSERT INTO hashes(hash, series_id, chapter_id, page) VALUES(?, ?, ?, ?)',
-                                executing)
+                try:
+                    hashes = cls._hash_pages(pages, stored, gallery.id, chap_id)
+                finally:
+                    f_zip.close()
 
         if page == 'mid':
             r_hash = {'mid': list(hashes.values())[0]}
@@ -1661,6 +1930,19 @@ class HashDB(DBBase):
                 pass
         return r_hash
 
+    @classmethod
+    def _hash_pages(cls, pages: Dict[int, Union[str, 'os.PathLike', Callable]], stored: Dict[int, str],
+                    gallery_id: Optional[int], chap_id: Optional[int]) -> Dict[int, str]:
+        """
+        Returns page -> hash for pages, a dict of page -> path or a function opening the page.
+        The pages not in stored are hashed in parallel and, if gallery_id is set, inserted in one go.
+        """
+        new = Executors.hash_pages({p: src for p, src in pages.items() if p not in stored})
+        if gallery_id is not None and new:
+            cls.executemany('INSERT INTO hashes(hash, series_id, chapter_id, page) VALUES(?, ?, ?, ?)',
+                            [(h, gallery_id, chap_id, p) for p, h in new.items()])
+        return {p: stored[p] if p in stored else new[p] for p in pages}
+
     @classmethod
     def gen_gallery_hashes(cls, gallery: Gallery) -> List[bytes]:
         """Generates hashes for gallery's first chapter and inserts them to DB"""
@@ -1682,6 +1964,7 @@ class HashDB(DBBase):
     def del_gallery_hashes(cls, gallery_id):
         """Deletes all hashes linked to the given gallery id"""
         cls.execute('DELETE FROM hashes WHERE series_id=?', (gallery_id,))
+        cls.execute('DELETE FROM phashes WHERE series_id=?', (gallery_id,))
 
 
 class GalleryList:
@@ -1785,7 +2068,6 @@ class GalleryList:
                 galleries = [galleries]
             if not galleries:
                 galleries = app_constants.GALLERY_DATA
-            new_galleries = []
             filter_term = ' '.join(self.filter.split())
             args = []
             if self.regex:
@@ -1796,26 +2078,12 @@ class GalleryList:
                 args.append(app_constants.Search.Strict)
             search_pieces = utils.get_terms(filter_term)
 
-            def _search_g(gallery):
-                all_terms = {t: False for t in search_pieces}
-
-                for t in search_pieces:
-                    if gallery.contains(t, args):
-                        all_terms[t] = True
-
-                if all(all_terms.values()):
-                    return True
-                return False
-
-            for gallery in galleries:
-                if _search_g(gallery):
-                    new_galleries.append(gallery)
+            new_galleries = gallery_index.search(galleries, search_pieces, args)
 
             if self.enforce:
-                g_to_remove = []
-                for g in self.galleries():
-                    if not _search_g(g):
-                        g_to_remove.append(g.id)
+                list_galleries = self.galleries()
+                found = set(gallery_index.search(list_galleries, search_pieces, args))
+                g_to_remove = [g.id for g in list_galleries if g not in found]
                 if g_to_remove:
                     self.remove_gallery(g_to_remove)
             self.add_gallery(new_galleries, _check_filter=False)
@@ -1918,6 +2186,7 @@ class Gallery:
         self._list_view_selected = False
         self._profile_qimage = {}
         self._profile_load_status = {}
+        self._profile_regen = None
         self.dead_link = False
         self.state = app_constants.GalleryState.Default
         self.qtime = QTime()  # used by views to record addition
@@ -1961,6 +2230,11 @@ class Gallery:
                 return
             if f.result():
                 return f.result()
+            if self.profile and not os.path.isfile(self.profile):
+                # evicted from the thumbnail store
+                if not self._profile_regen:
+                    self._profile_regen = Executors.generate_thumbnail(self, on_method=self._profile_regenerated)
+                return
         img = self._profile_load_status.get(ptype)
         if not img:
             self._profile_qimage[ptype] = Executors.load_thumbnail(self.profile, psize,
@@ -1969,6 +2243,11 @@ class Gallery:
 
         return img
 
+    def _profile_regenerated(self, future):
+        self.set_profile(future)
+        self.reset_profile()
+        self._profile_regen = None
+
     def set_profile(self, future):
         """set with profile with future object"""
         self.profile = future.result()
@@ -2215,6 +2494,7 @@ class Gallery:
             log.exception("Failed to move gallery")
             app_constants.NOTIF_BAR.add_text("Permission Error: Failed to move gallery ({})".format(self.title))
             return
+        gallery_paths.update(self)
         new_head, new_tail = os.path.split(self.path)
         for chap in self.chapters:
             if not chap.in_archive:
@@ -2475,8 +2755,9 @@ class AdminDB(QObject):
 
     def from_v021_to_v022(self, old_db_path=db_constants.DB_PATH):
         log_i("Started rebuilding database")
+        scan_manifest.forget()
         if DBBase._DB_CONN:
-            DBBase._DB_CONN.close()
+            DBBase.close()
         DBBase._DB_CONN = db.init_db(old_db_path)
         db_galleries = execute(GalleryDB.get_all_gallery, False, False, True, True)
         galleries = []
@@ -2530,7 +2811,7 @@ class AdminDB(QObject):
                     os.rmdir(os.path.join(root, name))
 
         head = os.path.split(old_db_path)[0]
-        DBBase._DB_CONN.close()
+        DBBase.close()
         t_db_path = os.path.join(head, 'temp.db')
         conn = db.init_db(t_db_path)
         DBBase._DB_CONN = conn
@@ -2558,11 +2839,12 @@ class AdminDB(QObject):
     def rebuild_database(self):
         """Rebuilds database"""
         log_i("Initiating database rebuild")
+        scan_manifest.forget()
         utils.backup_database()
         log_i("Getting galleries...")
         galleries = GalleryDB.get_all_gallery()
         self.DATA_COUNT.emit(len(galleries))
-        db.DBBase._DB_CONN.close()
+        DBBase.close()
         log_i("Removing old database...")
         log_i("Creating new database...")
         temp_db = os.path.join(db_constants.DB_ROOT, "happypanda_temp.db")
@@ -2572,14 +2854,16 @@ class AdminDB(QObject):
         DBBase.begin()
         log_i("Adding galleries...")
         GalleryDB.clear_thumb_dir()
+        existing_galleries = []
         for n, g in enumerate(galleries):
             if not os.path.exists(g.path):
                 log_i("Gallery doesn't exist anymore: {}".format(g.title.encode(errors="ignore")))
             else:
-                GalleryDB.add_gallery(g)
+                existing_galleries.append(g)
             self.PROGRESS.emit(n)
+        GalleryDB.add_galleries(existing_galleries)
         DBBase.end()
-        DBBase._DB_CONN.close()
+        DBBase.close()
         os.remove(db_constants.DB_PATH)
         os.rename(temp_db, db_constants.DB_PATH)
         db.DBBase._DB_CONN = db.init_db(db_constants.DB_PATH)
@@ -2655,11 +2939,16 @@ class DatabaseStartup(QObject):
         [v.list_view.manga_delegate._increment_paint_level() for v in manga_views]
         self.PROGRESS.emit("Loading hashes...")
         self.fetch_hashes()
+        self.PROGRESS.emit("Indexing galleries...")
+        gallery_index.add(self._loaded_galleries)
+        gallery_paths.add(self._loaded_galleries)
+        self.PROGRESS.emit("Cleaning up thumbnails...")
+        GalleryDB.sweep_thumbs()
         self._fetching = False
         self.DONE.emit()
 
     def fetch_galleries(self, f, t, manga_views):
-        c = execute(self._DB.execute, False, 'SELECT * FROM series LIMIT {}, {}'.format(f, t))
+        c = execute(self._DB.execute, False, 'SELECT * FROM series LIMIT ?, ?', (f, t))
         if c:
             new_data = c.fetchall()
             gallery_list = execute(GalleryDB.gen_galleries, False, new_data,
@@ -2673,16 +2962,20 @@ class DatabaseStartup(QObject):
                     view.gallery_model.insertRows(view.gallery_model.rowCount(), len(view_galleries))
 
     def fetch_chapters(self):
+        galleries_chapters = execute(ChapterDB.get_chapters_for_galleries, False)
         for g in self._loaded_galleries:
-            g.chapters = execute(ChapterDB.get_chapters_for_gallery, False, g.id)
+            chapters = galleries_chapters.get(g.id)
+            g.chapters = chapters if chapters is not None else ChaptersContainer()
 
     def fetch_tags(self):
+        galleries_tags = execute(TagDB.get_all_gallery_tags, False)
         for g in self._loaded_galleries:
-            g.tags = execute(TagDB.get_gallery_tags, False, g.id)
+            g.tags = galleries_tags.get(g.id, {})
 
     def fetch_hashes(self):
+        galleries_hashes = execute(HashDB.get_all_gallery_hashes, False)
         for g in self._loaded_galleries:
-            g.hashes = execute(HashDB.get_gallery_hashes, False, g.id)
+            g.hashes = galleries_hashes.get(g.id, [])
 
 
 if __name__ == '__main__':
@@ -2,6 +2,8 @@
 
 from watchdog.events import FileSystemEventHandler, DirDeletedEvent
 from watchdog.observers import Observer
+import threading
+import time
 from threading import Timer
 
 from PyQt5.QtCore import (Qt, QObject, pyqtSignal, QTimer, QSize, QThread)
@@ -20,6 +22,9 @@ from . import utils
 from . import pewnet
 from . import settings
 from . import fetch
+from . import watch_events
+from . import monitor
+from .path_index import gallery_paths
 from .asm_manager import AsmManager
 
 log = logging.getLogger(__name__)
@@ -220,7 +225,7 @@ class GalleryDownloaderList(QTableWidget):
         # NOTE: try to use ehen's apply_metadata first
         # manager have to edit item.metadata to match this method
         file = download_item.item.file
-        app_constants.TEMP_PATH_IGNORE.append(os.path.normcase(file))
+        app_constants.TEMP_PATH_IGNORE.add(os.path.normcase(file))
         self._download_items[file] = download_item
         self._download_items[utils.move_files(file, only_path=True)] = download_item  # better safe than sorry
         if download_item.item.download_type == app_constants.DOWNLOAD_TYPE_OTHER:
@@ -585,21 +590,32 @@ class DeletedPopup(misc.BasePopup):
         self.show()
 
 class GalleryHandler(FileSystemEventHandler, QObject):
-    CREATE_SIGNAL = pyqtSignal(str)
+    """
+    Turns the events of the watchers into grouped signals.
+    Events are coalesced per path and handled on a thread of its own once the paths are quiet,
+    the observer thread only records them. Galleries are looked up in gallery_paths, not the DB.
+    """
+    CREATE_SIGNAL = pyqtSignal(list)  # paths with new galleries
     MODIFIED_SIGNAL = pyqtSignal(str, int)
-    DELETED_SIGNAL = pyqtSignal(str, object)
-    MOVED_SIGNAL = pyqtSignal(str, object)
+    DELETED_SIGNAL = pyqtSignal(list)  # (path, gallery)
+    MOVED_SIGNAL = pyqtSignal(list)  # (new path, gallery)
 
     def __init__(self):
         super().__init__()
-        #self.g_queue = []
-
-    def file_filter(self, event):
-        if os.path.normcase(event.src_path) in app_constants.TEMP_PATH_IGNORE:
-            app_constants.TEMP_PATH_IGNORE.remove(os.path.normcase(event.src_path))
-            return False
+        self.events = watch_events.EventCoalescer(app_constants.MONITOR_DELAY)
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+    def file_filter(self, event, path=None):
+        path = path or event.src_path
+        # the events under an ignored path are ignored as well, until it expires
+        key, parent = None, os.path.normcase(path)
+        while parent != key:
+            if parent in app_constants.TEMP_PATH_IGNORE:
+                return False
+            key, parent = parent, os.path.dirname(parent)
         # TODO: use utils.check_ignore_list?
-        _, ext = os.path.splitext(event.src_path)
+        _, ext = os.path.splitext(path)
         if event.is_directory or ext in utils.ARCHIVE_FILES:
             if event.is_directory and "Folder" in app_constants.IGNORE_EXTS:
                 return False
@@ -608,68 +624,136 @@ class GalleryHandler(FileSystemEventHandler, QObject):
             return True
         return False
 
-    #def process_queue(self, type):
-    #	if self.g_queue:
-    #		if type == 'create':
-    #			self.CREATE_SIGNAL.emit(self.g_queue)
+    def _override(self):
+        if app_constants.OVERRIDE_MONITOR:
+            app_constants.OVERRIDE_MONITOR = False
+            return True
+        return False
 
-    #	self.g_queue = []
+    def _schedule(self):
+        with self._flusher_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='Gallery watcher', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            with self._flusher_lock:
+                wait = self.events.next_due()
+                if wait is None:
+                    self._flusher = None
+                    return
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Failed to handle monitored paths')
+
+    def flush(self):
+        """Emits the signals for the paths that are due"""
+        created, deleted, moved = self.events.pop_ready()
+        new_paths = []
+        for path in created:
+            if gallerydb.GalleryDB.check_exists(path):
+                continue
+            try:
+                if path.endswith(utils.ARCHIVE_FILES):
+                    gs = len(utils.check_archive(path))
+                else:
+                    g_dirs, g_archs = utils.recursive_gallery_check(path)
+                    gs = len(g_dirs) + len(g_archs)
+            except Exception:
+                log.exception('Failed to check new path: {}'.format(path.encode(errors='ignore')))
+                continue
+            if gs:
+                new_paths.append(path)
+        found = gallery_paths.lookup(deleted + [src for src, _ in moved])
+        gone = [(path, g) for path in deleted for g in found.get(path, [])]
+        renamed = [(dest, g) for src, dest in moved for g in found.get(src, [])]
+        if new_paths:
+            self.CREATE_SIGNAL.emit(new_paths)
+        if gone:
+            self.DELETED_SIGNAL.emit(gone)
+        if renamed:
+            self.MOVED_SIGNAL.emit(renamed)
 
     def on_created(self, event):
-        if not app_constants.OVERRIDE_MONITOR:
-            if self.file_filter(event):
-                gs = 0
-                if event.src_path.endswith(utils.ARCHIVE_FILES):
-                    gs = len(utils.check_archive(event.src_path))
-                elif event.is_directory:
-                    g_dirs, g_archs = utils.recursive_gallery_check(event.src_path)
-                    gs = len(g_dirs) + len(g_archs)
-                if gs:
-                    self.CREATE_SIGNAL.emit(event.src_path)
-        else:
-            app_constants.OVERRIDE_MONITOR = False
+        if self._override() or self.events.touched(event.src_path):
+            return
+        if self.file_filter(event):
+            self.events.created(event.src_path)
+            self._schedule()
 
     def on_deleted(self, event):
-        if not app_constants.OVERRIDE_MONITOR:
-            if self.file_filter(event):
-                path = event.src_path
-                gallery = gallerydb.GalleryDB.get_gallery_by_path(path)
-                if gallery:
-                    self.DELETED_SIGNAL.emit(path, gallery)
-        else:
-            app_constants.OVERRIDE_MONITOR = False
+        if self._override() or self.events.touched(event.src_path):
+            return
+        if self.file_filter(event):
+            self.events.deleted(event.src_path)
+            self._schedule()
 
     def on_modified(self, event):
-        pass
+        self.events.touched(event.src_path)
 
     def on_moved(self, event):
-        if not app_constants.OVERRIDE_MONITOR:
-            if self.file_filter(event):
-                old_path = event.src_path
-                gallery = gallerydb.GalleryDB.get_gallery_by_path(old_path)
-                if gallery:
-                    self.MOVED_SIGNAL.emit(event.dest_path, gallery)
-        else:
-            app_constants.OVERRIDE_MONITOR = False
+        if self._override():
+            return
+        if self.events.touched(event.src_path):
+            if not self.events.touched(event.dest_path) and self.file_filter(event, event.dest_path):
+                self.events.created(event.dest_path)
+                self._schedule()
+            return
+        if self.file_filter(event):
+            self.events.moved(event.src_path, event.dest_path)
+            self._schedule()
 
 class Watchers:
-    def __init__(self):
+    """
+    Watches the monitored paths with one observer scheduling a watch for each.
+    Paths on network shares, or where a probe file raises no event, are polled instead.
+    """
 
+    def __init__(self):
         self.gallery_handler = GalleryHandler()
-        self.watchers = []
+        self.observer = Observer()
+        self.observer.start()
+        self.poller = monitor.ManifestPoller(self.gallery_handler.dispatch, app_constants.MONITOR_POLL_INTERVAL)
+        self.watches = {}
         for path in app_constants.MONITOR_PATHS:
-            gallery_observer = Observer()
+            self.watch(path)
+
+    def watch(self, path):
+        if monitor.is_network_path(path):
+            log_i('Monitored path is a network share: {}'.format(path.encode(errors='ignore')))
+            self._poll(path)
+            return
+        try:
+            watch = self.observer.schedule(self.gallery_handler, path, recursive=True)
+        except Exception:
+            log.exception('Could not monitor: {}'.format(path.encode(errors='ignore')))
+            self._poll(path)
+            return
+        self.watches[path] = watch
+        threading.Thread(target=self._probe, args=(path, watch), name='Monitor probe', daemon=True).start()
+
+    def _probe(self, path, watch):
+        if monitor.probe(self.observer, watch, path) is False:
+            log_w('No file system events for: {}'.format(path.encode(errors='ignore')))
+            self.observer.unschedule(watch)
+            self.watches.pop(path, None)
+            self._poll(path)
+
+    def _poll(self, path):
+        if app_constants.MONITOR_POLL_INTERVAL <= 0:
+            log_w('Not monitoring: {}'.format(path.encode(errors='ignore')))
+            return
+        log_i('Polling every {} seconds: {}'.format(app_constants.MONITOR_POLL_INTERVAL, path.encode(errors='ignore')))
+        self.poller.add(path)
 
-            try:
-                gallery_observer.schedule(self.gallery_handler, path, True)
-                gallery_observer.start()
-                self.watchers.append(gallery_observer)
-            except:
-                log.exception('Could not monitor: {}'.format(path.encode(errors='ignore')))
-    
     def stop_all(self):
-        for watcher in self.watchers:
-            watcher.stop()
+        self.poller.stop()
+        self.observer.stop()
 
 class GalleryImpExpData:
 
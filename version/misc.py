@@ -1208,11 +1208,12 @@ class GalleryMenu(QMenu):
 
     def set_rating(self, x):
         if self.selected:
+            modifiers = []
             for idx in self.selected:
                 g = idx.data(Qt.UserRole + 1)
                 g.rating = x
-                modifier = gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_rating()
-                gallerydb.execute(modifier.execute, True)
+                modifiers.append(gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_rating())
+            gallerydb.execute(gallerydb.GalleryModifier.execute_all, True, modifiers)
         else:
             self.gallery.rating = x
             modifier = gallerydb.GalleryDB.new_gallery_modifier_based_on(self.gallery).inherit_rating()
@@ -1247,20 +1248,20 @@ class GalleryMenu(QMenu):
         self.view.gallery_model._gallery_to_remove.extend(galleries)
         self.view.gallery_model.removeRows(self.view.gallery_model.rowCount() - rows, rows)
         self.parent_widget.default_manga_view.add_gallery(galleries)
-        for g in galleries:
-            modifier = gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_view()
-            gallerydb.execute(modifier.execute, True)
+        modifiers = [gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_view() for g in galleries]
+        gallerydb.execute(gallerydb.GalleryModifier.execute_all, True, modifiers)
         self.view.sort_model.refresh()
         self.view.clearSelection()
 
     def allow_metadata_fetch(self):
         exed = 0 if self.allow_metadata_exed else 1
         if self.selected:
+            modifiers = []
             for idx in self.selected:
                 g = idx.data(Qt.UserRole + 1)
                 g.exed = exed
-                modifier = gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_exed()
-                gallerydb.execute(modifier.execute, True)
+                modifiers.append(gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_exed())
+            gallerydb.execute(gallerydb.GalleryModifier.execute_all, True, modifiers)
         else:
             self.gallery.exed = exed
             modifier = gallerydb.GalleryDB.new_gallery_modifier_based_on(self.gallery).inherit_exed()
@@ -1268,11 +1269,12 @@ class GalleryMenu(QMenu):
 
     def reset_read_count(self):
         if self.selected:
+            modifiers = []
             for idx in self.selected:
                 g = idx.data(Qt.UserRole + 1)
                 g.times_read = 0
-                modifier = gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_times_read()
-                gallerydb.execute(modifier.execute, True)
+                modifiers.append(gallerydb.GalleryDB.new_gallery_modifier_based_on(g).inherit_times_read())
+            gallerydb.execute(gallerydb.GalleryModifier.execute_all, True, modifiers)
         else:
             self.gallery.times_read = 0
             modifier = gallerydb.GalleryDB.new_gallery_modifier_based_on(self.gallery).inherit_times_read()
@@ -2368,7 +2370,7 @@ class ChapterAddWidget(QWidget):
                     chap.pages = len(list(scandir.scandir(p)))
                 elif p.endswith(utils.ARCHIVE_FILES):
                     chap.in_archive = 1
-                    arch = utils.ArchiveFile(p)
+                    arch = utils.ArchiveFile(p, importing=True)
                     chap.pages = len(arch.dir_contents(''))
                     arch.close()
 
@@ -22,7 +22,8 @@ from PyQt5.QtWidgets import (QTreeWidget, QTreeWidgetItem, QWidget,
                              QVBoxLayout, QTabWidget, QMenu, QApplication,
                              QListWidget, QHBoxLayout, QPushButton, QStackedLayout,
                              QFrame, QSizePolicy, QListView, QFormLayout, QLineEdit,
-                             QStyledItemDelegate, QCheckBox, QButtonGroup, QPlainTextEdit)
+                             QStyledItemDelegate, QCheckBox, QButtonGroup, QPlainTextEdit,
+                             QTableWidget, QTableWidgetItem)
 
 from . import gallerydb
 from . import app_constants
@@ -642,6 +643,7 @@ class DBOverview(QWidget):
     
     """
     about_to_close: pyqtBoundSignal = pyqtSignal()
+    QUERY_COLUMNS = ['Statement', 'Count', 'Total ms', 'Avg ms', 'Max ms', 'Rows']
 
     def __init__(self, parent, window=False):
         if window:
@@ -664,6 +666,28 @@ class DBOverview(QWidget):
         tabbar.addTab(self.about_db, 'DB Info')
         tabbar.setTabEnabled(2, False)
 
+        # Query stats
+        queries_widget = QWidget(self)
+        queries_layout = QVBoxLayout(queries_widget)
+        self.queries_table = QTableWidget(queries_widget)
+        self.queries_table.setColumnCount(len(self.QUERY_COLUMNS))
+        self.queries_table.setHorizontalHeaderLabels(self.QUERY_COLUMNS)
+        self.queries_table.verticalHeader().hide()
+        self.queries_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.queries_table.setSortingEnabled(True)
+        queries_layout.addWidget(self.queries_table)
+        queries_buttons = QHBoxLayout()
+        queries_layout.addLayout(queries_buttons)
+        refresh_btn = QPushButton('Refresh', queries_widget)
+        refresh_btn.clicked.connect(self.setup_query_stats)
+        reset_btn = QPushButton('Reset', queries_widget)
+        reset_btn.clicked.connect(self._reset_query_stats)
+        queries_buttons.addWidget(refresh_btn)
+        queries_buttons.addWidget(reset_btn)
+        queries_buttons.addStretch()
+        tabbar.addTab(queries_widget, 'Queries')
+        self.setup_query_stats()
+
         self.resize(300, 600)
         self.setWindowTitle('DB Overview')
         self.setWindowIcon(QIcon(app_constants.APP_ICO_PATH))
@@ -674,6 +698,26 @@ class DBOverview(QWidget):
     def setup_about_db(self):
         pass
 
+    def setup_query_stats(self):
+        """Fills the queries tab with the statements run so far, most time spent first"""
+        stats = gallerydb.DBBase.query_stats()
+        self.queries_table.setSortingEnabled(False)
+        self.queries_table.setRowCount(len(stats))
+        for row, (statement, stat) in enumerate(stats):
+            values = [stat.count, stat.total_time * 1000, stat.total_time * 1000 / stat.count,
+                      stat.max_time * 1000, stat.rows]
+            self.queries_table.setItem(row, 0, QTableWidgetItem(' '.join(statement.split())))
+            for col, value in enumerate(values, 1):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, round(value, 2) if isinstance(value, float) else value)
+                self.queries_table.setItem(row, col, item)
+        self.queries_table.setSortingEnabled(True)
+        self.queries_table.resizeColumnsToContents()
+
+    def _reset_query_stats(self):
+        gallerydb.DBBase.reset_query_stats()
+        self.setup_query_stats()
+
     def closeEvent(self, event):
         self.about_to_close.emit()
         return super().closeEvent(event)
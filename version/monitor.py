@@ -0,0 +1,175 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Finding out if the watchdog observer gets the events of a monitored folder, and polling the folders where it doesn't.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import uuid
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from watchdog.events import (DirCreatedEvent, DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent,
+                             FileMovedEvent, FileSystemEvent, FileSystemEventHandler)
+
+from .scan_manifest import ScanManifest, Snapshot
+from . import utils
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+# file systems where changes made by other machines never raise events
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', '9p', 'ceph', 'glusterfs',
+                       'fuse.sshfs', 'fuse.rclone', 'fuse.davfs2', 'davfs'}
+# seconds to wait for the event of the probe file
+PROBE_TIMEOUT = 5
+
+
+def _mounts() -> List[Tuple[str, str]]:
+    """Returns (mount point, file system type) of the mounts, empty where /proc/mounts doesn't exist"""
+    mounts = []
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2:
+                    mounts.append((fields[1].replace('\\040', ' '), fields[2]))
+    except OSError:
+        pass
+    return mounts
+
+
+def is_network_path(path: Union[str, 'os.PathLike'], mounts: Optional[List[Tuple[str, str]]] = None) -> bool:
+    """Returns True if path is known to be on a network share, only known where /proc/mounts exists"""
+    if not sys.platform.startswith('linux') and mounts is None:
+        return False
+    path = os.path.realpath(path)
+    best, fs_type = '', ''
+    for mount, mount_type in _mounts() if mounts is None else mounts:
+        if (path == mount or path.startswith(os.path.join(mount, ''))) and len(mount) >= len(best):
+            best, fs_type = mount, mount_type
+    return fs_type in NETWORK_FILESYSTEMS
+
+
+class _ProbeHandler(FileSystemEventHandler):
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = os.path.normcase(path)
+        self.seen = threading.Event()
+
+    def on_any_event(self, event):
+        if os.path.normcase(event.src_path) == self.path:
+            self.seen.set()
+
+
+def probe(observer, watch, path: Union[str, 'os.PathLike'], timeout: float = PROBE_TIMEOUT) -> Optional[bool]:
+    """
+    Returns if the watch of the observer gets the events of a file created in path,
+    None if no file can be created there to find out
+    """
+    probe_path = os.path.join(str(path), '.happypanda-probe-{}'.format(uuid.uuid4().hex))
+    handler = _ProbeHandler(probe_path)
+    observer.add_handler_for_watch(handler, watch)
+    try:
+        try:
+            with open(probe_path, 'wb'):
+                pass
+            os.remove(probe_path)
+        except OSError:
+            return None
+        return handler.seen.wait(timeout)
+    finally:
+        observer.remove_handler_for_watch(handler, watch)
+
+
+def snapshot_events(root: str, old: Snapshot, new: Snapshot) -> Iterator[FileSystemEvent]:
+    """
+    Yields the events turning the old snapshot of root into the new one.
+    An entry gone with its inode showing up under another name was moved, new and changed entries are created.
+    Entries that are gone are folders unless they have an archive extension.
+    """
+    gone = {name: state for name, state in old.items() if name not in new}
+    inodes = {state[2]: name for name, state in gone.items() if state[2]}
+    for name, state in new.items():
+        if old.get(name) == state:
+            continue
+        path = os.path.join(root, name)
+        is_dir = os.path.isdir(path)
+        src = inodes.pop(state[2], None) if name not in old and state[2] else None
+        if src is not None:
+            del gone[src]
+            yield (DirMovedEvent if is_dir else FileMovedEvent)(os.path.join(root, src), path)
+        else:
+            yield (DirCreatedEvent if is_dir else FileCreatedEvent)(path)
+    for name in gone:
+        yield (FileDeletedEvent if name.lower().endswith(utils.ARCHIVE_FILES) else DirDeletedEvent)(os.path.join(root, name))
+
+
+class ManifestPoller:
+    """
+    Polls folders where file system events don't arrive. Every interval seconds the top level of each folder
+    is compared with what was there the last time, the changes are passed to dispatch as watchdog events.
+    Changes deeper in a folder are seen when they change the mtime of a top level entry.
+    """
+
+    def __init__(self, dispatch: Callable[[FileSystemEvent], None], interval: float):
+        self.interval = interval
+        self._dispatch = dispatch
+        self._manifest = ScanManifest(None)
+        self._roots: List[str] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def roots(self) -> List[str]:
+        return list(self._roots)
+
+    def add(self, root: Union[str, 'os.PathLike']) -> None:
+        """Polls root from now on, it is compared from the next poll on"""
+        if str(root) not in self._roots:
+            self._roots.append(str(root))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='Monitor poller', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        self.poll()
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def poll(self) -> None:
+        for root in self.roots:
+            try:
+                snap = ScanManifest.snapshot(root)
+            except OSError:
+                log_w('Could not poll {}'.format(root.encode(errors='ignore')))
+                continue
+            old = self._manifest.get(root)
+            self._manifest.record(root, snap)
+            if old is None:
+                continue
+            for event in snapshot_events(root, old, snap):
+                try:
+                    self._dispatch(event)
+                except Exception:
+                    log.exception('Failed to handle polled change')
+
+    def stop(self) -> None:
+        self._stop.set()
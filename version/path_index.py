@@ -0,0 +1,136 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .gallerydb import Gallery
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+# (normalized path, path in archive or None for the path itself)
+PathKey = Tuple[str, Optional[str]]
+
+
+def path_key(path: Union[str, 'os.PathLike'], path_in_archive: Optional[str] = None) -> PathKey:
+    return (os.path.normcase(os.path.normpath(path)),
+            None if path_in_archive is None else path_in_archive.replace('\\', '/').strip('/'))
+
+
+class PathIndex:
+    """
+    The paths of the galleries, kept up to date as galleries are added, moved and deleted,
+    so checking if a path already is a gallery is a lookup.
+    Galleries in archives are indexed by the archive path and by their path in the archive,
+    an archive holding several galleries is only fully imported when each of them is.
+    Galleries are tracked by object, galleries not in the DB yet can be indexed as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        # key -> id() of the galleries having it
+        self._paths: Dict[PathKey, Set[int]] = {}
+        # id() -> gallery and the keys it was indexed under
+        self._galleries: Dict[int, Tuple[Gallery, List[PathKey]]] = {}
+        # series_id -> id()
+        self._ids: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._galleries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    @staticmethod
+    def _keys(gallery: Gallery) -> List[PathKey]:
+        if not gallery.path:
+            return []
+        keys = [path_key(gallery.path)]
+        if gallery.is_archive:
+            keys.append(path_key(gallery.path, gallery.path_in_archive or ''))
+        return keys
+
+    def _unindex(self, obj_id: int) -> None:
+        gallery, keys = self._galleries.pop(obj_id)
+        for key in keys:
+            ids = self._paths.get(key)
+            if ids:
+                ids.discard(obj_id)
+                if not ids:
+                    del self._paths[key]
+        if gallery.id is not None and self._ids.get(gallery.id) == obj_id:
+            del self._ids[gallery.id]
+
+    def add(self, galleries: Iterable[Gallery]) -> None:
+        """Indexes the galleries, reindexing the ones already indexed"""
+        with self._lock:
+            for gallery in galleries:
+                obj_id = id(gallery)
+                if obj_id in self._galleries:
+                    self._unindex(obj_id)
+                keys = self._keys(gallery)
+                for key in keys:
+                    self._paths.setdefault(key, set()).add(obj_id)
+                self._galleries[obj_id] = (gallery, keys)
+                if gallery.id is not None:
+                    self._ids[gallery.id] = obj_id
+
+    def update(self, gallery_or_id: Union[Gallery, int]) -> None:
+        """Reindexes the gallery after its path changed, galleries not indexed are left out"""
+        with self._lock:
+            if isinstance(gallery_or_id, int):
+                obj_id = self._ids.get(gallery_or_id)
+            else:
+                obj_id = id(gallery_or_id)
+            if obj_id in self._galleries:
+                self.add([self._galleries[obj_id][0]])
+
+    def remove(self, galleries: Iterable[Gallery]) -> None:
+        with self._lock:
+            for gallery in galleries:
+                if id(gallery) in self._galleries:
+                    self._unindex(id(gallery))
+
+    def contains(self, path: Union[str, 'os.PathLike'], path_in_archive: Optional[str] = None) -> bool:
+        """
+        Returns True if a gallery has the path, or if path_in_archive is given,
+        if a gallery is at path_in_archive in the archive at path
+        """
+        with self._lock:
+            return bool(self._paths.get(path_key(path, path_in_archive)))
+
+    def lookup(self, paths: Iterable[Union[str, 'os.PathLike']]) -> Dict[str, List[Gallery]]:
+        """Returns the galleries in the DB at each of the paths, paths without galleries are left out"""
+        found = {}
+        with self._lock:
+            for path in paths:
+                galleries = [self._galleries[obj_id][0] for obj_id in self._paths.get(path_key(path), ())]
+                galleries = [g for g in galleries if g.id is not None]
+                if galleries:
+                    found[path] = sorted(galleries, key=lambda g: g.id)
+        return found
+
+
+gallery_paths = PathIndex()
@@ -0,0 +1,127 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Union
+
+import scandir
+
+from .database import db_constants
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+MANIFEST_NAME = 'scan_manifest.json'
+MANIFEST_VERSION = 1
+
+# entry name -> [mtime in ns, size, inode]
+Snapshot = Dict[str, List[int]]
+
+
+class ScanManifest:
+    """
+    What the last scan saw in each monitored folder, so a rescan only has to look at
+    the entries that are new or changed since. Only the top level of a folder is recorded,
+    a gallery folder gets a new mtime when files are added to or removed from it.
+    Folders that can't be read keep their last snapshot. A manifest without a path is only kept in memory.
+    """
+
+    def __init__(self, path: Optional[Union[str, 'os.PathLike']]):
+        self.path = path
+        self._lock = threading.Lock()
+        # normcased folder -> snapshot
+        self._roots: Optional[Dict[str, Snapshot]] = None
+
+    def _load(self) -> Dict[str, Snapshot]:
+        if self._roots is None:
+            self._roots = {}
+            if self.path is None:
+                return self._roots
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self._roots = data['roots']
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError, AttributeError):
+                log_w('Scan manifest is corrupt, everything will be scanned')
+        return self._roots
+
+    @staticmethod
+    def snapshot(root: Union[str, 'os.PathLike']) -> Snapshot:
+        """Returns the current state of the entries in root, raises OSError if it can't be read"""
+        snap = {}
+        for entry in scandir.scandir(root):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            snap[entry.name] = [stat.st_mtime_ns, stat.st_size, entry.inode()]
+        return snap
+
+    def changed(self, root: Union[str, 'os.PathLike'], snap: Snapshot) -> List[str]:
+        """Returns the paths of the entries in snap that are new or changed since root was recorded"""
+        with self._lock:
+            old = self._load().get(os.path.normcase(os.path.abspath(root)), {})
+        return [os.path.join(root, name) for name, state in snap.items() if old.get(name) != state]
+
+    def get(self, root: Union[str, 'os.PathLike']) -> Optional[Snapshot]:
+        """Returns the snapshot recorded for root, None if it wasn't recorded"""
+        with self._lock:
+            return self._load().get(os.path.normcase(os.path.abspath(root)))
+
+    def record(self, root: Union[str, 'os.PathLike'], snap: Snapshot) -> None:
+        with self._lock:
+            self._load()[os.path.normcase(os.path.abspath(root))] = snap
+
+    def forget(self, root: Optional[Union[str, 'os.PathLike']] = None) -> None:
+        """Forgets what was seen in root, or in every folder, so it is scanned fully next time"""
+        with self._lock:
+            if root is None:
+                self._roots = {}
+            else:
+                self._load().pop(os.path.normcase(os.path.abspath(root)), None)
+
+    def forget_entry(self, path: Union[str, 'os.PathLike']) -> None:
+        """Forgets the entry holding path in the folder it is in, so it is scanned again next time"""
+        path = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            for root, snap in self._load().items():
+                if path.startswith(os.path.join(root, '')):
+                    name = os.path.relpath(path, root).split(os.sep)[0]
+                    for entry in [e for e in snap if os.path.normcase(e) == name]:
+                        del snap[entry]
+
+    def save(self) -> None:
+        with self._lock:
+            if self._roots is None or self.path is None:
+                return
+            tmp_path = self.path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': MANIFEST_VERSION, 'roots': self._roots}, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                log.exception('Failed to save scan manifest')
+
+
+scan_manifest = ScanManifest(os.path.join(db_constants.DB_ROOT, MANIFEST_NAME))
@@ -0,0 +1,494 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import bisect
+import logging
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
+
+from dateutil import parser as dateparser
+
+from . import app_constants
+
+if TYPE_CHECKING:
+    from .gallerydb import Gallery
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+# namespace -> gallery attribute, the same as Gallery._keyword_search
+TEXT_KEYWORDS = {
+    'Title': 'title',
+    'Language': 'language',
+    'Lang': 'language',
+    'Type': 'type',
+    'Status': 'status',
+    'Artist': 'artist',
+    'Url': 'link',
+    'Descr': 'info',
+    'Description': 'info',
+}
+NUMBER_KEYWORDS = {
+    'Chapter': 'chapters',
+    'Chapters': 'chapters',
+    'Read_count': 'times_read',
+    'Read count': 'times_read',
+    'Times_read': 'times_read',
+    'Times read': 'times_read',
+    'Rating': 'rating',
+    'Stars': 'rating',
+}
+DATE_KEYWORDS = {
+    'Date_added': 'date_added',
+    'Date added': 'date_added',
+    'Pub_date': 'pub_date',
+    'Publication': 'pub_date',
+    'Pub date': 'pub_date',
+    'Last_read': 'last_read',
+    'Last read': 'last_read',
+}
+# these have special meaning with none/null in Gallery.contains
+SPECIAL_KEYWORDS = ('none', 'null')
+
+# attributes searched when no namespace is given
+_FREE_TEXT = ('title', 'artist', 'language')
+
+
+# namespace -> gallery condition, for the very special none/null keywords of Gallery.contains
+_EMPTY_CHECKS: Dict[str, Callable[[Gallery], bool]] = {
+    'Tag': lambda g: not g.tags or len(g.tags) == 1 and 'default' in g.tags and not g.tags['default'],
+    'Artist': lambda g: not g.artist,
+    'Status': lambda g: not g.status or g.status == 'Unknown',
+    'Language': lambda g: not g.language,
+    'Url': lambda g: not g.link,
+    'Descr': lambda g: not g.info or g.info == 'No description..',
+    'Description': lambda g: not g.info or g.info == 'No description..',
+    'Type': lambda g: not g.type,
+    'Publication': lambda g: not g.pub_date,
+    'Pub_date': lambda g: not g.pub_date,
+    'Pub date': lambda g: not g.pub_date,
+    'Path': lambda g: g.dead_link,
+}
+
+
+def _number_value(gallery: Gallery, attr: str) -> Optional[int]:
+    if attr == 'chapters':
+        return gallery.chapters.count()
+    return getattr(gallery, attr)
+
+
+def _date_value(gallery: Gallery, attr: str):
+    value = getattr(gallery, attr)
+    if value and hasattr(value, 'date'):
+        return value.date()
+    return None
+
+
+def _never(value) -> bool:
+    return False
+
+
+def _text_matcher(needle: str, ignore_case: bool, strict: bool, use_regex: bool) -> Callable[[str], bool]:
+    """Returns a function matching a value the same way as utils.search_term/utils.regex_search would"""
+    if not needle:
+        return _never
+    if use_regex:
+        try:
+            pattern = re.compile(needle, re.IGNORECASE if ignore_case else 0)
+        except re.error:
+            return _never
+        return lambda value: bool(value) and pattern.search(value) is not None
+    if ignore_case:
+        needle = needle.lower()
+        if strict:
+            return lambda value: bool(value) and value.lower() == needle
+        return lambda value: bool(value) and needle in value.lower()
+    if strict:
+        return lambda value: bool(value) and value == needle
+    return lambda value: bool(value) and needle in value
+
+
+class SearchTerm:
+    """
+    A search term as returned by utils.get_terms, compiled once per search.
+
+    Matches a gallery exactly like Gallery.contains does, but the namespace, operators, dates and numbers
+    are parsed and the needles lowered or compiled up front instead of once per gallery.
+    """
+
+    def __init__(self, term: str, args: Optional[List] = None):
+        if args is None:
+            args = []
+        self.term = term
+        self.exclude = term.startswith('-')
+        self.key = term[1:] if self.exclude else term
+        self.args = args
+        self.use_regex = app_constants.Search.Regex in args
+        case = app_constants.Search.Case in args
+        strict = app_constants.Search.Strict in args
+
+        self.free_text = ':' not in self.key
+        pieces = self.key.split(':')
+        if len(pieces) > 1:
+            self.ns, self.tag = pieces[0].lower().capitalize(), pieces[1]
+        else:
+            self.ns, self.tag = '', pieces[0]
+
+        self.match_free = _text_matcher(self.key, not case, strict, self.use_regex) if self.free_text else _never
+        # tags are always matched case insensitive
+        self.match_tag = _text_matcher(self.tag, True, strict, self.use_regex)
+        self.match_namespace = _text_matcher(self.ns, True, False, True) if self.use_regex else _never
+        self.is_empty: Optional[Callable[[Gallery], bool]] = None
+        if self.ns and self.tag in SPECIAL_KEYWORDS:
+            self.is_empty = _EMPTY_CHECKS.get(self.ns)
+
+        # keyword, e.g. title:foo, rating:>3
+        self.attr: Optional[str] = None
+        self.op: Optional[str] = None
+        self.value = None
+        self.match_value = _never
+        self.match_keyword: Callable[[Gallery], bool] = _never
+        if self.ns in TEXT_KEYWORDS:
+            self.attr = TEXT_KEYWORDS[self.ns]
+            # Gallery._keyword_search always matches case insensitive and never strict
+            self.match_value = _text_matcher(self.tag, True, False, self.use_regex)
+            self.match_keyword = lambda g: self.match_value(getattr(g, self.attr))
+        elif self.ns in NUMBER_KEYWORDS or self.ns in DATE_KEYWORDS:
+            self._compile_operator()
+
+    def _compile_operator(self) -> None:
+        tag = self.tag
+        if tag and tag[0] in '<>':
+            self.op, tag = tag[0], tag[1:]
+        try:
+            if self.ns in DATE_KEYWORDS:
+                self.attr = DATE_KEYWORDS[self.ns]
+                self.value = dateparser.parse(tag, dayfirst=True).date()
+                value_of = _date_value
+            else:
+                self.attr = NUMBER_KEYWORDS[self.ns]
+                self.value = int(tag)
+                value_of = _number_value
+        except (ValueError, OverflowError):
+            self.value = None
+            return
+
+        value, attr, op = self.value, self.attr, self.op
+
+        def match_keyword(gallery: Gallery) -> bool:
+            g_value = value_of(gallery, attr)
+            if g_value is None:
+                return False
+            if op == '>':
+                return value < g_value
+            elif op == '<':
+                return value > g_value
+            return value == g_value
+
+        self.match_keyword = match_keyword
+
+    def __repr__(self):
+        return 'SearchTerm({!r})'.format(self.term)
+
+    def narrows(self, other: SearchTerm) -> bool:
+        """Returns True if every gallery matching this term is known to match other as well"""
+        if self.term == other.term and self.args == other.args:
+            return True
+        if self.args != other.args or app_constants.Search.Regex in self.args \
+                or app_constants.Search.Strict in self.args:
+            return False
+        if self.exclude or other.exclude or self.is_empty or not other.key:
+            return False
+        if self.free_text or other.free_text:
+            return self.free_text and other.free_text and other.key in self.key
+        # a longer needle matches a subset, but operators and numbers don't work that way
+        if self.ns != other.ns or self.ns in NUMBER_KEYWORDS or self.ns in DATE_KEYWORDS:
+            return False
+        return bool(other.tag) and other.tag in self.tag
+
+    def _found(self, gallery: Gallery) -> bool:
+        if not self.key:
+            return False
+        if self.free_text:
+            if self.match_free(gallery.title) or self.match_free(gallery.artist) or self.match_free(gallery.language):
+                return True
+        if self.is_empty and self.is_empty(gallery):
+            return True
+        if self.ns:
+            if self.match_keyword(gallery):
+                return True
+            if self.use_regex:
+                for ns, tags in gallery.tags.items():
+                    if self.match_namespace(ns) and any(self.match_tag(t) for t in tags):
+                        return True
+                return False
+            return any(self.match_tag(t) for t in gallery.tags.get(self.ns, ()))
+        return any(self.match_tag(t) for tags in gallery.tags.values() for t in tags)
+
+    def matches(self, gallery: Gallery) -> bool:
+        """Same as gallery.contains(term, args)"""
+        return self._found(gallery) != self.exclude
+
+
+def compile_terms(terms: Iterable, args: Optional[List] = None) -> List[SearchTerm]:
+    """Compiles the pieces returned by utils.get_terms, already compiled terms are kept as they are"""
+    return [t if isinstance(t, SearchTerm) else SearchTerm(t, args) for t in terms]
+
+
+def narrows(terms: List[SearchTerm], previous: List[SearchTerm]) -> bool:
+    """
+    Returns True if the galleries found by terms are a subset of the ones found by the previous terms,
+    e.g. when the user keeps typing, so the previous results can be searched instead of all galleries
+    """
+    return all(any(t.narrows(p) for t in terms) for p in previous)
+
+
+class _SortedColumn:
+    """Sorted values with their gallery ids for range lookups"""
+
+    def __init__(self):
+        self._values: List[Any] = []
+        self._ids: List[int] = []
+
+    def add(self, value, g_id: int) -> None:
+        try:
+            i = bisect.bisect_right(self._values, value)
+        except TypeError:
+            log_w('Could not index value: {}'.format(value))
+            return
+        self._values.insert(i, value)
+        self._ids.insert(i, g_id)
+
+    def remove(self, value, g_id: int) -> None:
+        try:
+            start, end = bisect.bisect_left(self._values, value), bisect.bisect_right(self._values, value)
+        except TypeError:
+            return
+        for i in range(start, end):
+            if self._ids[i] == g_id:
+                del self._values[i]
+                del self._ids[i]
+                return
+
+    def lookup(self, op: Optional[str], value) -> Set[int]:
+        """Returns ids with a value greater than (op '>'), less than (op '<') or equal to value"""
+        if op == '>':
+            start, end = bisect.bisect_right(self._values, value), len(self._values)
+        elif op == '<':
+            start, end = 0, bisect.bisect_left(self._values, value)
+        else:
+            start, end = bisect.bisect_left(self._values, value), bisect.bisect_right(self._values, value)
+        return set(self._ids[start:end])
+
+
+class SearchIndex:
+    """
+    An inverted index of gallery attributes and tags, kept up to date as galleries are added, modified and deleted.
+
+    Searches are answered with the same rules as Gallery.contains: a term matches on a substring of a value,
+    so instead of splitting values into tokens the index maps each distinct value to the galleries having it.
+    A term is then checked once per distinct value instead of once per gallery,
+    and the terms are combined with set operations.
+    Only the special none/null keywords are left to be checked gallery by gallery.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        # bumped on every change, search results computed before a change can't be reused
+        self.revision = getattr(self, 'revision', 0) + 1
+        self._galleries: Dict[int, Gallery] = {}
+        # what was indexed for each gallery, needed to unindex it
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        # attribute -> value -> ids
+        self._text: Dict[str, Dict[str, Set[int]]] = {a: {} for a in set(TEXT_KEYWORDS.values())}
+        # namespace -> tag -> ids
+        self._ns_tags: Dict[str, Dict[str, Set[int]]] = {}
+        # tag -> ids, regardless of namespace
+        self._tags: Dict[str, Set[int]] = {}
+        self._columns: Dict[str, _SortedColumn] = {
+            a: _SortedColumn() for a in list(NUMBER_KEYWORDS.values()) + list(DATE_KEYWORDS.values())}
+
+    def __contains__(self, gallery: Gallery) -> bool:
+        return self._galleries.get(gallery.id) is gallery
+
+    def __len__(self):
+        return len(self._galleries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def add(self, galleries: Iterable[Gallery]) -> None:
+        """Indexes the galleries, reindexing the ones already indexed"""
+        with self._lock:
+            for gallery in galleries:
+                if gallery.id is None:
+                    continue
+                if gallery.id in self._entries:
+                    self._unindex(gallery.id)
+                self._index(gallery)
+            self.revision += 1
+
+    def update(self, gallery_or_id) -> None:
+        """Reindexes the gallery, only galleries already indexed are reindexed when passing an id"""
+        with self._lock:
+            if isinstance(gallery_or_id, int):
+                gallery = self._galleries.get(gallery_or_id)
+                if not gallery:
+                    return
+            else:
+                gallery = gallery_or_id
+            self.add([gallery])
+
+    def remove(self, ids: Iterable[int]) -> None:
+        with self._lock:
+            for g_id in ids:
+                if g_id in self._entries:
+                    self._unindex(g_id)
+            self.revision += 1
+
+    def _index(self, gallery: Gallery) -> None:
+        g_id = gallery.id
+        entry = {'text': {}, 'tags': [], 'columns': {}}
+        for attr, values in self._text.items():
+            value = getattr(gallery, attr)
+            if value:
+                values.setdefault(value, set()).add(g_id)
+                entry['text'][attr] = value
+        for ns, tags in (gallery.tags or {}).items():
+            for tag in tags:
+                if tag:
+                    self._ns_tags.setdefault(ns, {}).setdefault(tag, set()).add(g_id)
+                    self._tags.setdefault(tag, set()).add(g_id)
+                    entry['tags'].append((ns, tag))
+        for attr in set(NUMBER_KEYWORDS.values()):
+            value = _number_value(gallery, attr)
+            if value is not None:
+                self._columns[attr].add(value, g_id)
+                entry['columns'][attr] = value
+        for attr in set(DATE_KEYWORDS.values()):
+            value = _date_value(gallery, attr)
+            if value is not None:
+                self._columns[attr].add(value, g_id)
+                entry['columns'][attr] = value
+        self._galleries[g_id] = gallery
+        self._entries[g_id] = entry
+
+    def _unindex(self, g_id: int) -> None:
+        entry = self._entries.pop(g_id)
+        self._galleries.pop(g_id, None)
+
+        def discard(mapping, key):
+            ids = mapping.get(key)
+            if ids is not None:
+                ids.discard(g_id)
+                if not ids:
+                    del mapping[key]
+
+        for attr, value in entry['text'].items():
+            discard(self._text[attr], value)
+        for ns, tag in entry['tags']:
+            if ns in self._ns_tags:
+                discard(self._ns_tags[ns], tag)
+                if not self._ns_tags[ns]:
+                    del self._ns_tags[ns]
+            discard(self._tags, tag)
+        for attr, value in entry['columns'].items():
+            self._columns[attr].remove(value, g_id)
+
+    @staticmethod
+    def _union(mapping: Dict[str, Set[int]], match) -> Set[int]:
+        ids = set()
+        for value, v_ids in mapping.items():
+            if match(value):
+                ids |= v_ids
+        return ids
+
+    def _column_match(self, term: SearchTerm) -> Set[int]:
+        if term.value is None:
+            return set()
+        return self._columns[term.attr].lookup(term.op, term.value)
+
+    def _match(self, term: SearchTerm) -> Optional[Set[int]]:
+        """Returns ids of galleries found by term or None if the index can't answer it"""
+        if not term.key or term.is_empty:
+            return None
+        ids = set()
+        if term.free_text:
+            for attr in _FREE_TEXT:
+                ids |= self._union(self._text[attr], term.match_free)
+
+        if term.ns:
+            if term.ns in TEXT_KEYWORDS:
+                ids |= self._union(self._text[term.attr], term.match_value)
+            elif term.attr:
+                ids |= self._column_match(term)
+            if term.use_regex:
+                for ns, tags in self._ns_tags.items():
+                    if term.match_namespace(ns):
+                        ids |= self._union(tags, term.match_tag)
+            elif term.ns in self._ns_tags:
+                ids |= self._union(self._ns_tags[term.ns], term.match_tag)
+        else:
+            ids |= self._union(self._tags, term.match_tag)
+        return ids
+
+    def match(self, terms: Iterable, args: Optional[List] = None) -> Tuple[Optional[Set[int]], List[SearchTerm]]:
+        """
+        Returns the ids of the indexed galleries matching all the terms the index can answer
+        (None if it can't answer any) and the terms which still need to be checked gallery by gallery
+        """
+        terms = compile_terms(terms, args)
+        with self._lock:
+            ids = None
+            rest = []
+            for term in terms:
+                t_ids = self._match(term)
+                if t_ids is None:
+                    rest.append(term)
+                    continue
+                if term.exclude:
+                    t_ids = set(self._galleries) - t_ids
+                ids = t_ids if ids is None else ids & t_ids
+            return ids, rest
+
+    def search(self, galleries: Iterable[Gallery], terms: Iterable, args: Optional[List] = None,
+               matched: Optional[Tuple[Optional[Set[int]], List[SearchTerm]]] = None) -> List[Gallery]:
+        """
+        Returns the galleries matching all terms, galleries not in the index are checked one by one.
+        Pass the result of match as matched when searching the galleries in parts.
+        """
+        terms = compile_terms(terms, args)
+        ids, rest = matched if matched is not None else self.match(terms)
+        found = []
+        for gallery in galleries:
+            if gallery in self:
+                if ids is not None and gallery.id not in ids:
+                    continue
+                g_terms = rest
+            else:
+                g_terms = terms
+            if all(t.matches(gallery) for t in g_terms):
+                found.append(gallery)
+        return found
+
+
+gallery_index = SearchIndex()
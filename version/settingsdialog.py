@@ -1265,11 +1265,10 @@ class SettingsDialog(QWidget):
         open_hp_folder.setFixedWidth(open_hp_folder.width())
         about_layout.addWidget(open_hp_folder)
 
-        ## About / DB Overview
-        #about_db_overview, about_db_overview_m_l = new_tab('DB Overview', about)
-        #about_stats_tab_widget = misc_db.DBOverview(self.parent_widget)
-        #about_db_overview_m_l.addRow(about_stats_tab_widget)
-        #about_db_overview.setEnabled(False)
+        # About / DB Overview
+        about_db_overview, about_db_overview_m_l = new_tab('DB Overview', about)
+        about_stats_tab_widget = misc_db.DBOverview(self.parent_widget)
+        about_db_overview_m_l.addRow(about_stats_tab_widget)
 
         # About / Troubleshooting
         about_troubleshoot_page = QWidget()
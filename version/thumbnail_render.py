@@ -0,0 +1,63 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Thumbnail rendering with PIL only, meant to run in worker processes.
+Keep the imports light, every worker process imports this module.
+"""
+from __future__ import annotations
+
+import io
+import os
+from typing import Dict, Iterable, Tuple, Union
+
+from PIL import Image, ImageChops, ImageDraw
+
+# corners are drawn this many times larger and scaled down to antialias them
+_MASK_SCALE = 4
+
+
+def _fit(src: Tuple[int, int], box: Tuple[int, int]) -> Tuple[int, int]:
+    """Returns src scaled to fit in box keeping the aspect ratio, like Qt.KeepAspectRatio"""
+    if src[0] * box[1] <= src[1] * box[0]:
+        return max(1, src[0] * box[1] // src[1]), box[1]
+    return box[0], max(1, src[1] * box[0] // src[0])
+
+
+def _rounded(im: Image.Image, radius: int) -> Image.Image:
+    w, h = im.size
+    mask = Image.new('L', (w * _MASK_SCALE, h * _MASK_SCALE), 0)
+    ImageDraw.Draw(mask).rounded_rectangle((0, 0, mask.size[0] - 1, mask.size[1] - 1),
+                                           radius * _MASK_SCALE, fill=255)
+    mask = mask.resize((w, h), Image.LANCZOS)
+    im.putalpha(ImageChops.multiply(im.getchannel('A'), mask))
+    return im
+
+
+def render_thumbnails(img: Union[str, 'os.PathLike', bytes], sizes: Iterable[Tuple[int, int]],
+                      radius: int = 5) -> Dict[Tuple[int, int], bytes]:
+    """
+    Decodes the image, a path or the file content, once and returns a PNG with rounded corners for each size.
+    JPEGs are decoded straight at the smallest scale still larger than the biggest thumbnail with draft,
+    and downscaling goes through reduce first.
+    """
+    sizes = list(sizes)
+    with Image.open(io.BytesIO(img) if isinstance(img, bytes) else img) as im:
+        biggest = max((_fit(im.size, s) for s in sizes), key=lambda s: s[0] * s[1])
+        im.draft('RGB', biggest)
+        im = im.convert('RGBA')
+        thumbs = {}
+        for size in sizes:
+            thumb = _rounded(im.resize(_fit(im.size, size), Image.LANCZOS, reducing_gap=3.0), radius)
+            buffer = io.BytesIO()
+            thumb.save(buffer, 'PNG')
+            thumbs[size] = buffer.getvalue()
+    return thumbs
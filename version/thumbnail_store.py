@@ -0,0 +1,343 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import collections
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import scandir
+
+from .database import db_constants
+from . import app_constants
+from . import utils
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+# seconds between writing the index to disk, it is always written on exit
+SAVE_INTERVAL = 30
+# files younger than this are never swept, their gallery might not be saved yet
+SWEEP_GRACE = 3600
+# <sha1 of the source image>_<width>x<height>.png
+_NAME_RE = re.compile(r'^([0-9a-f]{40})_\d+x\d+\.png$')
+
+
+def _source_of(name: str) -> str:
+    """Returns what thumbnails made from the same image have in common, the file name for foreign files"""
+    m = _NAME_RE.match(name)
+    return m.group(1) if m else name
+
+
+class ThumbnailStore:
+    """
+    Thumbnails on disk, named after the sha1 of the source image and the thumbnail size.
+
+    Galleries with the same cover share one thumbnail, and the thumbnails of other sizes made from
+    the same image are found next to it. An index of the file sizes and when each
+    thumbnail was last used is kept next to the thumbnails, the least recently used ones are evicted
+    when the store grows over its budget. Files no gallery refers to are removed by sweep.
+    Thumbnails not created by the store, e.g. by older versions, are tracked the same way.
+    """
+
+    def __init__(self, path: Union[str, 'os.PathLike'], budget: int = 0):
+        """budget is the maximum size in bytes, 0 for no limit"""
+        self.path = path
+        self.budget = budget
+        self._lock = threading.RLock()
+        # file name -> [size, last used], the least recently used first
+        self._entries: Optional[collections.OrderedDict] = None
+        self._size = 0
+        self._dirty = False
+        self._saved = 0.0
+
+    @staticmethod
+    def _by_last_used(entries: Dict[str, List]) -> collections.OrderedDict:
+        return collections.OrderedDict(sorted(entries.items(), key=lambda e: e[1][1]))
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.path, INDEX_NAME)
+
+    def _load(self) -> collections.OrderedDict:
+        if self._entries is None:
+            self._entries = collections.OrderedDict()
+            try:
+                with open(self._index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self._entries = self._by_last_used(data['entries'])
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError, AttributeError):
+                log_w('Thumbnail index is corrupt, it will be rebuilt by the next sweep')
+            self._size = sum(e[0] for e in self._entries.values())
+        return self._entries
+
+    def save(self, force: bool = True) -> None:
+        """Writes the index to disk, unless force is False and it was written recently"""
+        with self._lock:
+            if self._entries is None or not self._dirty:
+                return
+            if not force and time.time() - self._saved < SAVE_INTERVAL:
+                return
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            tmp_path = self._index_path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': INDEX_VERSION, 'entries': self._entries}, f)
+                os.replace(tmp_path, self._index_path)
+            except OSError:
+                log.exception('Failed to save thumbnail index')
+                return
+            self._dirty = False
+            self._saved = time.time()
+
+    @staticmethod
+    def source_hash(img: Union[str, 'os.PathLike', BinaryIO]) -> str:
+        """Returns the sha1 of the image at the path or in the file object"""
+        if hasattr(img, 'read'):
+            img.seek(0)
+            img_hash = utils.generate_img_hash(img)
+            img.seek(0)
+            return img_hash
+        with open(img, 'rb') as f:
+            return utils.generate_img_hash(f)
+
+    @staticmethod
+    def sized_key(img_hash: str, size: Tuple[int, int]) -> str:
+        return '{}_{}x{}'.format(img_hash, size[0], size[1])
+
+    @classmethod
+    def key(cls, img_path: Union[str, 'os.PathLike'], size: Tuple[int, int]) -> str:
+        """Returns the key of the thumbnail of given size for the image"""
+        return cls.sized_key(cls.source_hash(img_path), size)
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.path, key + '.png')
+
+    @classmethod
+    def sized_path(cls, path: Union[str, 'os.PathLike'], size: Tuple[int, int]) -> Optional[str]:
+        """
+        Returns the path of the thumbnail of given size made from the same image as the thumbnail at path,
+        None if path wasn't made by the store
+        """
+        head, name = os.path.split(path)
+        m = _NAME_RE.match(name)
+        if not m:
+            return None
+        return os.path.join(head, cls.sized_key(m.group(1), size) + '.png')
+
+    def _name(self, path: Union[str, 'os.PathLike']) -> Optional[str]:
+        """Returns the file name if path is in the store directory"""
+        head, name = os.path.split(os.path.abspath(path))
+        if os.path.normcase(head) == os.path.normcase(os.path.abspath(self.path)):
+            return name
+        return None
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the path of the thumbnail, None if it isn't stored"""
+        path = self.file_path(key)
+        with self._lock:
+            if key + '.png' not in self._load():
+                return None
+            if not os.path.isfile(path):
+                self._forget(key + '.png')
+                return None
+            self._used(key + '.png')
+        return path
+
+    def put(self, key: str, write: Callable[[str], bool]) -> Optional[str]:
+        """
+        Stores a thumbnail, write is called with the path to write it to and should return True on success.
+        Returns the path of the thumbnail or None if writing failed.
+        """
+        path = self.get(key)
+        if path:
+            return path
+        path = self.file_path(key)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        try:
+            if not write(tmp_path):
+                return None
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            log.exception('Failed to store thumbnail')
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock:
+            self._add(key + '.png', size, time.time())
+            self.evict(keep=key + '.png')
+            self.save(False)
+        return path
+
+    def touch(self, path: Union[str, 'os.PathLike']) -> None:
+        """Marks the thumbnail as used"""
+        name = self._name(path)
+        if name:
+            with self._lock:
+                if name in self._load():
+                    self._used(name)
+
+    def release(self, path: Union[str, 'os.PathLike']) -> None:
+        """
+        Called when a gallery stops using the thumbnail. It might still be used by other galleries with the same
+        cover, so it is only made the first to be evicted and left for sweep to delete.
+        """
+        names = [self._name(path)]
+        names.extend(self._name(p) for p in (self.sized_path(path, s) for s in app_constants.THUMB_SIZES) if p)
+        with self._lock:
+            entries = self._load()
+            for name in names:
+                if name in entries:
+                    entries[name][1] = 0
+                    entries.move_to_end(name, last=False)
+                    self._dirty = True
+
+    def owns(self, path: Union[str, 'os.PathLike']) -> bool:
+        name = self._name(path)
+        if not name:
+            return False
+        with self._lock:
+            return name in self._load()
+
+    def _used(self, name: str) -> None:
+        self._entries[name][1] = time.time()
+        self._entries.move_to_end(name)
+        self._dirty = True
+
+    def _add(self, name: str, size: int, used: float) -> None:
+        """Adds the file as the most recently used one"""
+        entries = self._load()
+        if name in entries:
+            self._size -= entries.pop(name)[0]
+        entries[name] = [size, used]
+        self._size += size
+        self._dirty = True
+
+    def _forget(self, name: str) -> None:
+        entry = self._load().pop(name, None)
+        if entry:
+            self._size -= entry[0]
+            self._dirty = True
+
+    def _delete(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            log.exception('Failed to delete thumbnail {}'.format(name))
+            return
+        self._forget(name)
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            self._load()
+            return self._size
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Deletes the least recently used thumbnails until the store fits its budget, returns how many"""
+        if not self.budget:
+            return 0
+        with self._lock:
+            entries = self._load()
+            if self._size <= self.budget:
+                return 0
+            over = self._size - self.budget
+            victims = []
+            for name, entry in entries.items():
+                if over <= 0:
+                    break
+                if name != keep:
+                    victims.append(name)
+                    over -= entry[0]
+            for name in victims:
+                self._delete(name)
+            evicted = sum(name not in entries for name in victims)
+            log_i('Evicted {} thumbnails'.format(evicted))
+            return evicted
+
+    def sweep(self, used_paths: Iterable[Union[str, 'os.PathLike']]) -> int:
+        """
+        Deletes the files in the store directory not in used_paths, along with the other sizes of them,
+        indexes the used files the store doesn't know about yet and forgets missing files.
+        Returns how many files were deleted.
+        """
+        used = set()
+        for p in used_paths:
+            if p:
+                name = self._name(p)
+                if name:
+                    used.add(_source_of(name))
+        if not os.path.isdir(self.path):
+            return 0
+        deleted = 0
+        now = time.time()
+        with self._lock:
+            entries = self._load()
+            found = set()
+            for f in scandir.scandir(self.path):
+                if not f.is_file() or f.name == INDEX_NAME:
+                    continue
+                stat = f.stat()
+                if _source_of(f.name) not in used:
+                    if now - stat.st_mtime > SWEEP_GRACE:
+                        self._delete(f.name)
+                        deleted += 1
+                        continue
+                found.add(f.name)
+                if f.name not in entries:
+                    self._add(f.name, stat.st_size, stat.st_mtime)
+            for name in set(entries) - found:
+                self._forget(name)
+            # the files found were added as the most recently used
+            self._entries = self._by_last_used(entries)
+            self.evict()
+            self.save()
+        log_i('Swept {} unused thumbnails'.format(deleted))
+        return deleted
+
+    def clear(self) -> None:
+        """Deletes every thumbnail"""
+        with self._lock:
+            if os.path.isdir(self.path):
+                for f in scandir.scandir(self.path):
+                    if f.is_file():
+                        try:
+                            os.remove(f.path)
+                        except OSError:
+                            log.exception('Failed to delete thumbnail {}'.format(f.name))
+            self._entries = collections.OrderedDict()
+            self._size = 0
+            self._dirty = False
+
+
+thumbnail_store = ThumbnailStore(db_constants.THUMBNAIL_PATH, app_constants.THUMBNAIL_STORE_SIZE * 1024 * 1024)
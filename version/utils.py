@@ -13,6 +13,8 @@
 # """
 from __future__ import annotations
 
+import bisect
+import collections
 import datetime
 import os
 import subprocess
@@ -23,8 +25,9 @@ import hashlib
 import shutil
 import uuid
 import re
+from io import BytesIO, TextIOWrapper
 import re as regex
-from typing import ClassVar, Union, List, Dict, AnyStr, io, Optional, TYPE_CHECKING
+from typing import ClassVar, Union, List, Dict, AnyStr, io, Optional, Set, Tuple, TYPE_CHECKING
 
 import webbrowser
 import scandir
@@ -32,7 +35,9 @@ import rarfile
 import json
 import send2trash
 import functools
+import threading
 import time
+from concurrent import futures
 
 from PyQt5.QtGui import QImage, qRgba
 from PIL import Image, ImageChops
@@ -63,7 +68,11 @@ if not app_constants.unrar_tool_path:
 class GMetafile:
     files: List[io.TextIO]
 
-    def __init__(self, path=None, archive=''):
+    def __init__(self, path=None, archive: Union[str, 'os.PathLike', ArchiveFile] = '', entries=None):
+        """
+        archive can be an open ArchiveFile, it is left open.
+        entries is the content of the directory at path if it has been scanned already.
+        """
         self.metadata = {
             "title": '',
             "artist": '',
@@ -79,13 +88,18 @@ class GMetafile:
         if path is None:
             return
         if archive:
-            f_zip = ArchiveFile(archive)
+            f_zip = archive if isinstance(archive, ArchiveFile) else ArchiveFile(archive)
             c = f_zip.dir_contents(path)
             for x in c:
                 if x.endswith(app_constants.GALLERY_METAFILE_KEYWORDS):
-                    self.files.append(open(f_zip.extract(x), encoding='utf-8'))
+                    # read in memory, the parsers only need the name and the text
+                    buffer = BytesIO(f_zip.open(x))
+                    buffer.name = x
+                    self.files.append(TextIOWrapper(buffer, encoding='utf-8'))
+            if f_zip is not archive:
+                f_zip.close()
         else:
-            for p in scandir.scandir(path):
+            for p in entries if entries is not None else scandir.scandir(path):
                 if p.name in app_constants.GALLERY_METAFILE_KEYWORDS:
                     self.files.append(open(p.path, encoding='utf-8'))
         if self.files:
@@ -333,8 +347,9 @@ def move_files(path, dest='', only_path=False):
     if new_path == os.path.join(*os.path.split(path)):  # need to unpack to make sure we get the corrct sep
         return path
     if not os.path.exists(new_path):
-        app_constants.TEMP_PATH_IGNORE.append(os.path.normcase(new_path))
+        app_constants.TEMP_PATH_IGNORE.add(os.path.normcase(new_path))
         if not only_path:
+            archive_handles.close(path)
             new_path = shutil.move(path, new_path)
     else:
         return path
@@ -397,7 +412,8 @@ def generate_img_hash(src):
     Generates sha1 hash based on the given bytes.
     Returns hex-digits
     """
-    chunk = 8129
+    # large reads, hashlib releases the GIL for buffers over 2 KiB so other threads can hash meanwhile
+    chunk = 1024 * 1024
     sha1 = hashlib.sha1()
     buffer = src.read(chunk)
     log_d("Generating hash")
@@ -407,6 +423,181 @@ def generate_img_hash(src):
     return sha1.hexdigest()
 
 
+class _ArchiveHandle:
+    """An open archive with the index of its names, shared by the ArchiveFile instances of the same file"""
+
+    def __init__(self, key: Tuple[str, int, int], filepath: str) -> None:
+        self.key = key
+        self.refs = 0
+        self.stale = False
+        # when refs last went to 0
+        self.released = 0.0
+        self._lock = threading.Lock()
+        if filepath.endswith(ARCHIVE_FILES[:2]):
+            self.archive = zipfile.ZipFile(os.path.normcase(filepath))
+            self.type = ArchiveFile.zip
+        else:
+            self.archive = rarfile.RarFile(os.path.normcase(filepath))
+            self.type = ArchiveFile.rar
+        self.tree: Optional[Dict[str, List[str]]] = None
+        # directory -> images in it
+        self.images: Dict[str, List[str]] = {}
+
+    def _parent(self, name: str) -> str:
+        """Returns the directory name is in, the way dir_contents expects it"""
+        if self.type == ArchiveFile.zip:
+            # zip directories end with a slash
+            return name[:name.rfind('/', 0, len(name) - 1) + 1]
+        return name[:max(name.rfind('/'), 0)]
+
+    def index(self) -> _ArchiveHandle:
+        with self._lock:
+            if self.tree is None:
+                self.names = self.archive.namelist()
+                self.name_set = set(self.names)
+                self.sorted_names = sorted(self.names)
+                if self.type == ArchiveFile.zip:
+                    self.dirs = [x for x in self.names if x.endswith('/')]
+                else:
+                    self.dirs = [x.filename for x in self.archive.infolist() if x.isdir()]
+                self.dir_set = set(self.dirs)
+                tree = {'': []}
+                for name in self.names:
+                    tree.setdefault(self._parent(name), []).append(name)
+                self.tree = tree
+        return self
+
+
+class _ArchiveHandles:
+    """
+    Keeps recently used archives open so the callers opening the same archive one after another,
+    e.g. while importing a gallery, share one handle and its index.
+    Archives nobody uses are closed after idle seconds, an open archive is locked on Windows.
+    """
+
+    def __init__(self, size: int, idle: float, clock=time.monotonic) -> None:
+        self.size = size
+        self.idle = idle
+        self._clock = clock
+        self._handles: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    @staticmethod
+    def key(filepath: str) -> Tuple[str, int, int]:
+        stat = os.stat(filepath)
+        return os.path.normcase(os.path.abspath(filepath)), stat.st_size, stat.st_mtime_ns
+
+    def acquire(self, filepath: str) -> _ArchiveHandle:
+        key = self.key(filepath)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = _ArchiveHandle(key, filepath)
+                self._handles[key] = handle
+            self._handles.move_to_end(key)
+            handle.refs += 1
+            self._trim()
+        return handle
+
+    def release(self, handle: _ArchiveHandle) -> None:
+        with self._lock:
+            handle.refs -= 1
+            if not handle.refs:
+                handle.released = self._clock()
+                if handle.stale:
+                    handle.archive.close()
+            self._trim()
+            self._schedule()
+
+    def _trim(self) -> None:
+        for key in [k for k, h in self._handles.items() if not h.refs][:max(len(self._handles) - self.size, 0)]:
+            self._handles.pop(key).archive.close()
+
+    def _schedule(self) -> None:
+        released = [h.released for h in self._handles.values() if not h.refs]
+        if self._timer is None and released:
+            self._timer = threading.Timer(max(min(released) + self.idle - self._clock(), 0), self.close_idle)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def close_idle(self) -> None:
+        """Closes the archives nobody used for idle seconds"""
+        with self._lock:
+            self._timer = None
+            now = self._clock()
+            for key, handle in list(self._handles.items()):
+                if not handle.refs and now - handle.released >= self.idle:
+                    del self._handles[key]
+                    handle.archive.close()
+            self._schedule()
+
+    def close(self, path: Union[str, 'os.PathLike', None] = None) -> None:
+        """
+        Closes the archives at or under path, all of them if path is None.
+        Needed before the archives can be moved or deleted on Windows.
+        """
+        if path is not None:
+            path = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            for key, handle in list(self._handles.items()):
+                if path is None or key[0] == path or key[0].startswith(os.path.join(path, '')):
+                    del self._handles[key]
+                    if handle.refs:
+                        handle.stale = True
+                    else:
+                        handle.archive.close()
+
+
+archive_handles = _ArchiveHandles(app_constants.ARCHIVE_HANDLES, app_constants.ARCHIVE_HANDLE_IDLE)
+
+# (path, size, mtime) -> passed the integrity check
+_archive_integrity: Dict[Tuple[str, int, int], bool] = {}
+_archive_integrity_pending: Set[Tuple[str, int, int]] = set()
+_archive_integrity_lock = threading.Lock()
+_archive_integrity_exec = futures.ThreadPoolExecutor(1)
+
+
+def _test_archive(archive: Union[zipfile.ZipFile, rarfile.RarFile]) -> bool:
+    """Checks the CRC of every file in the archive, returns True if they are all good"""
+    try:
+        if isinstance(archive, zipfile.ZipFile):
+            return archive.testzip() is None
+        archive.testrar()
+        return True
+    except Exception:
+        log.exception('Archive integrity check: FAIL')
+        return False
+
+
+def _test_archive_in_background(filepath: str, key: Tuple[str, int, int]) -> None:
+    with _archive_integrity_lock:
+        if key in _archive_integrity_pending:
+            return
+        _archive_integrity_pending.add(key)
+
+    def test():
+        try:
+            if filepath.endswith(ARCHIVE_FILES[:2]):
+                archive = zipfile.ZipFile(os.path.normcase(filepath))
+            else:
+                archive = rarfile.RarFile(os.path.normcase(filepath))
+            with archive:
+                ok = _test_archive(archive)
+        except Exception:
+            log.exception('Archive integrity check: FAIL')
+            ok = False
+        with _archive_integrity_lock:
+            _archive_integrity[key] = ok
+            _archive_integrity_pending.discard(key)
+        if not ok:
+            log_w('Bad file found in archive {}'.format(filepath.encode(errors='ignore')))
+            if app_constants.NOTIF_BAR:
+                app_constants.NOTIF_BAR.add_text('Bad file found in archive: {}'.format(os.path.basename(filepath)))
+
+    _archive_integrity_exec.submit(test)
+
+
 class ArchiveFile:
     """
     Work with archive files, raises exception if instance fails.
@@ -414,6 +605,10 @@ class ArchiveFile:
     extract <- Extracts one specific file to given path
     open -> open the given file in archive, returns bytes
     close -> close archive
+
+    Archives opened recently are kept open and shared, see archive_handles.
+    The names in the archive are indexed by directory the first time they are needed,
+    so the directory queries are lookups instead of scans over every name.
     """
     zip: ClassVar[int] = 0
     rar: ClassVar[int] = 1
@@ -421,22 +616,21 @@ class ArchiveFile:
     type: int
     archive: Union[zipfile.ZipFile, rarfile.RarFile]
 
-    def __init__(self, filepath: Union[str, 'os.PathLike']) -> None:
+    def __init__(self, filepath: Union[str, 'os.PathLike'], importing: bool = False) -> None:
+        """
+        The archive is checked for corrupt files according to app_constants.ARCHIVE_INTEGRITY_CHECK,
+        set importing when the archive is being imported
+        """
         self.type = 0
+        self._handle: Optional[_ArchiveHandle] = None
         try:
             if filepath.endswith(ARCHIVE_FILES):
-                b_f = None
-                if filepath.endswith(ARCHIVE_FILES[:2]):
-                    self.archive = zipfile.ZipFile(os.path.normcase(filepath))
-                    b_f = self.archive.testzip()
-                    self.type = self.zip
-                elif filepath.endswith(ARCHIVE_FILES[2:]):
-                    self.archive = rarfile.RarFile(os.path.normcase(filepath))
-                    b_f = self.archive.testrar()
-                    self.type = self.rar
+                self._handle = archive_handles.acquire(filepath)
+                self.archive = self._handle.archive
+                self.type = self._handle.type
 
                 # test for corruption
-                if b_f:
+                if not self._check_integrity(filepath, importing):
                     log_w('Bad file found in archive {}'.format(filepath.encode(errors='ignore')))
                     raise app_constants.CreateArchiveFail
             else:
@@ -444,11 +638,27 @@ class ArchiveFile:
                 raise app_constants.CreateArchiveFail
         except:
             log.exception('Create archive: FAIL')
+            self.close()
             raise app_constants.CreateArchiveFail
 
+    def _check_integrity(self, filepath: str, importing: bool) -> bool:
+        policy = app_constants.ARCHIVE_INTEGRITY_CHECK
+        if policy == 'never' or (policy == 'on import' and not importing):
+            return True
+        key = self._handle.key
+        ok = _archive_integrity.get(key)
+        if ok is None:
+            if policy == 'background':
+                _test_archive_in_background(filepath, key)
+                return True
+            ok = _archive_integrity[key] = _test_archive(self.archive)
+        return ok
+
+    def _index(self) -> _ArchiveHandle:
+        return self._handle.index()
+
     def namelist(self) -> List[str]:
-        filelist = self.archive.namelist()
-        return filelist
+        return list(self._index().names)
 
     def is_dir(self, name: str) -> bool:
         """
@@ -456,60 +666,55 @@ class ArchiveFile:
         """
         if not name:
             return False
-        if name not in self.namelist():
+        index = self._index()
+        if name not in index.name_set:
             log_e('File {} not found in archive'.format(name))
             raise app_constants.FileNotFoundInArchive
-        if self.type == self.zip:
-            if name.endswith('/'):
-                return True
-        elif self.type == self.rar:
-            info = self.archive.getinfo(name)
-            return info.isdir()
-        return False
+        return name in index.dir_set
 
     def dir_list(self, only_top_level=False) -> List[Union[str, 'os.PathLike']]:
         """
         Returns a list of all directories found recursively. For directories not in toplevel
         a path in the archive to the diretory will be returned.
         """
-
+        index = self._index()
         if only_top_level:
             if self.type == self.zip:
-                return [x for x in self.namelist() if x.endswith('/') and x.count('/') == 1]
-            elif self.type == self.rar:
-                potential_dirs = [x for x in self.namelist() if x.count('/') == 0]
-                return [x.filename for x in [self.archive.getinfo(y) for y in potential_dirs] if x.isdir()]
-        else:
-            if self.type == self.zip:
-                return [x for x in self.namelist() if x.endswith('/') and x.count('/') >= 1]
-            elif self.type == self.rar:
-                return [x.filename for x in self.archive.infolist() if x.isdir()]
+                return [x for x in index.dirs if x.count('/') == 1]
+            return [x for x in index.dirs if x.count('/') == 0]
+        return list(index.dirs)
 
     def dir_contents(self, dir_name: str) -> List:
         """
         Returns a list of contents in the directory
         An empty string will return the contents of the top folder
         """
-        if dir_name and not dir_name in self.namelist():
+        index = self._index()
+        if dir_name and not dir_name in index.name_set:
             log_e('Directory {} not found in archive'.format(dir_name))
             raise app_constants.FileNotFoundInArchive
-        if not dir_name:
-            con = []
-            if self.type == self.zip:
-                con = [x for x in self.namelist() if x.count('/') == 0
-                       or (x.count('/') == 1 and x.endswith('/'))]
-            elif self.type == self.rar:
-                con = [x for x in self.namelist() if x.count('/') == 0]
-            return con
-        if self.type == self.zip:
-            dir_con_start = [x for x in self.namelist() if x.startswith(dir_name)]
-            return [x for x in dir_con_start if x.count('/') == dir_name.count('/')
-                    and (x.count('/') == dir_name.count('/') and not x.endswith('/'))
-                    or (x.count('/') == 1 + dir_name.count('/') and x.endswith('/'))]
-        elif self.type == self.rar:
-            return [x for x in self.namelist() if x.startswith(dir_name)
-                    and x.count('/') == 1 + dir_name.count('/')]
-        return []
+        if self.type == self.zip and dir_name and not dir_name.endswith('/'):
+            # not a directory
+            return [x for x in index.names if x.startswith(dir_name) and x.count('/') == dir_name.count('/')
+                    and not x.endswith('/')]
+        return list(index.tree.get(dir_name, ()))
+
+    def dir_images(self, dir_name: str) -> List[str]:
+        """Returns the images in the directory, names starting with a dot excluded"""
+        images = self._handle.images
+        if dir_name not in images:
+            images[dir_name] = [x for x in self.dir_contents(dir_name)
+                                if x.lower().endswith(IMG_FILES) and not x.startswith('.')]
+        return list(images[dir_name])
+
+    def _with_prefix(self, prefix: str) -> List[str]:
+        """Returns the names starting with prefix"""
+        sorted_names = self._index().sorted_names
+        start = bisect.bisect_left(sorted_names, prefix)
+        end = start
+        while end < len(sorted_names) and sorted_names[end].startswith(prefix):
+            end += 1
+        return sorted_names[start:end]
 
     def extract(self, file_to_ext, path=None) -> Union[str, 'os.PathLike']:
         """
@@ -526,10 +731,7 @@ class ArchiveFile:
         else:
             temp_p = ''
             if self.type == self.zip:
-                membs = []
-                for name in self.namelist():
-                    if name.startswith(file_to_ext) and name != file_to_ext:
-                        membs.append(name)
+                membs = [name for name in self._with_prefix(file_to_ext) if name != file_to_ext]
                 temp_p = self.archive.extract(file_to_ext, path)
                 for m in membs:
                     self.archive.extract(m, path)
@@ -561,17 +763,27 @@ class ArchiveFile:
             return self.archive.open(file_to_open).read()
 
     def close(self) -> None:
-        self.archive.close()
+        """Releases the archive, it is kept open for a while in case it is opened again"""
+        if self._handle:
+            archive_handles.release(self._handle)
+            self._handle = None
 
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
-def check_archive(archive_path):
+
+def check_archive(archive_path: Union[str, 'os.PathLike', ArchiveFile]):
     """
     Checks archive path for potential galleries.
     Returns a list with a path in archive to galleries
     if there is no directories
+    archive_path can be an open ArchiveFile, it is left open
     """
     try:
-        f_zip = ArchiveFile(archive_path)
+        f_zip = archive_path if isinstance(archive_path, ArchiveFile) else ArchiveFile(archive_path, importing=True)
     except app_constants.CreateArchiveFail:
         return []
     if not f_zip:
@@ -582,10 +794,7 @@ def check_archive(archive_path):
     def gallery_eval(d):
         con = f_zip.dir_contents(d)
         if con:
-            gallery_probability = len(con)
-            for n in con:
-                if not n.lower().endswith(IMG_FILES):
-                    gallery_probability -= 1
+            gallery_probability = len([n for n in con if n.lower().endswith(IMG_FILES)])
             if gallery_probability >= (len(con) * 0.8):
                 return d
 
@@ -598,10 +807,10 @@ def check_archive(archive_path):
             r = gallery_eval(d)
             if r:
                 galleries.append(r)
-        f_zip.close()
     else:  # all pages are in top folder
         if isinstance(gallery_eval(''), str):
             galleries.append('')
+    if f_zip is not archive_path:
         f_zip.close()
 
     return galleries
@@ -790,10 +999,12 @@ def open_chapter(chapterpath, archive=None):
         log_e('Could not open chapter {}'.format(os.path.split(chapterpath)[1]))
 
 
-def get_gallery_img(gallery_or_path: Union[gallerydb.Gallery, str, 'os.PathLike'], chap_number: int = 0) \
-        -> Union[str, 'os.PathLike', None]:
+def get_gallery_img(gallery_or_path: Union[gallerydb.Gallery, str, 'os.PathLike'], chap_number: int = 0,
+                    in_memory: bool = False) -> Union[str, 'os.PathLike', BytesIO, None]:
     """
     Returns a path to image in gallery chapter
+    If in_memory is set, images in archives are read into a BytesIO named after the file in the archive
+    instead of being extracted to a temp dir
     """
     archive = None
     if isinstance(gallery_or_path, str):
@@ -815,16 +1026,20 @@ def get_gallery_img(gallery_or_path: Union[gallerydb.Gallery, str, 'os.PathLike'
         try:
             log_i('Getting image from archive')
             zip = ArchiveFile(real_path)
-            temp_path = os.path.join(app_constants.temp_dir, str(uuid.uuid4()))
-            os.mkdir(temp_path)
             if not archive:
                 f_img_name = \
                     sorted(
                         [img for img in zip.namelist() if img.lower().endswith(IMG_FILES) and not img.startswith('.')])[
                         0]
             else:
-                f_img_name = sorted([img for img in zip.dir_contents(path) if
-                                     img.lower().endswith(IMG_FILES) and not img.startswith('.')])[0]
+                f_img_name = sorted(zip.dir_images(path))[0]
+            if in_memory:
+                img = BytesIO(zip.open(f_img_name))
+                img.name = f_img_name
+                zip.close()
+                return img
+            temp_path = os.path.join(app_constants.temp_dir, str(uuid.uuid4()))
+            os.mkdir(temp_path)
             img_path = zip.extract(f_img_name, temp_path)
             zip.close()
         except app_constants.CreateArchiveFail:
@@ -1070,6 +1285,7 @@ def delete_path(path):
     """Deletes the provided recursively"""
     s = True
     if os.path.exists(path):
+        archive_handles.close(path)
         error = ''
         if app_constants.SEND_FILES_TO_TRASH:
             try:
@@ -0,0 +1,247 @@
+# This file is part of Happypanda.
+# Happypanda is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# any later version.
+# Happypanda is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import scandir
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+CREATED = 'created'
+DELETED = 'deleted'
+MOVED = 'moved'
+
+# (files, total size, newest mtime in ns)
+Signature = Tuple[int, int, int]
+# never equal to a signature, so a created path is always checked twice
+_UNSEEN = object()
+
+
+def tree_signature(path: Union[str, 'os.PathLike']) -> Optional[Signature]:
+    """Returns the signature of the file or of everything in the folder, None if path is gone"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    files, size, mtime = 1, stat.st_size, stat.st_mtime_ns
+    if os.path.isdir(path):
+        folders = [path]
+        while folders:
+            try:
+                entries = list(scandir.scandir(folders.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files += 1
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime_ns)
+    return files, size, mtime
+
+
+class _Pending:
+    __slots__ = ('kind', 'path', 'src', 'last', 'signature')
+
+    def __init__(self, kind: str, path: str, src: Optional[str], last: float):
+        self.kind = kind
+        # where the path is now, src is where a moved path was before
+        self.path = path
+        self.src = src
+        self.last = last
+        self.signature = _UNSEEN
+
+
+class EventCoalescer:
+    """
+    Collects file system events until their paths have been quiet for delay seconds.
+    The events of a path are merged, a path created and deleted again is dropped and a path moved twice is
+    one move. Events under a folder waiting to be created only delay it, so copying a folder gives one event.
+    A created path is only handed out once its size and mtime, or those of everything in it, stopped changing.
+    """
+
+    def __init__(self, delay: float, signature: Callable[[str], Optional[Signature]] = tree_signature,
+                 clock: Callable[[], float] = time.monotonic):
+        self.delay = delay
+        self._signature = signature
+        self._clock = clock
+        self._lock = threading.Lock()
+        # normcased path -> pending event, in the order they came
+        self._pending: Dict[str, _Pending] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @staticmethod
+    def _key(path: Union[str, 'os.PathLike']) -> str:
+        return os.path.normcase(os.path.normpath(path))
+
+    def _created_parent(self, key: str) -> Optional[_Pending]:
+        parent = os.path.dirname(key)
+        while parent != key:
+            pending = self._pending.get(parent)
+            if pending and pending.kind == CREATED:
+                return pending
+            key, parent = parent, os.path.dirname(parent)
+        return None
+
+    def _children(self, key: str) -> List[str]:
+        prefix = os.path.join(key, '')
+        return [k for k in self._pending if k.startswith(prefix)]
+
+    def touched(self, path: Union[str, 'os.PathLike']) -> bool:
+        """
+        Delays the created folder path is in, if any. Returns True if there was one,
+        the event is then part of creating the folder and needs nothing else.
+        """
+        with self._lock:
+            pending = self._created_parent(self._key(path))
+            if pending:
+                pending.last = self._clock()
+            return pending is not None
+
+    def created(self, path: Union[str, 'os.PathLike']) -> None:
+        key = self._key(path)
+        with self._lock:
+            # a deleted path created again is checked as a new path, it is skipped if still a gallery
+            self._pending.pop(key, None)
+            self._pending[key] = _Pending(CREATED, str(path), None, self._clock())
+
+    def deleted(self, path: Union[str, 'os.PathLike']) -> None:
+        key = self._key(path)
+        with self._lock:
+            for child in self._children(key):
+                if self._pending[child].kind == CREATED:
+                    del self._pending[child]
+            pending = self._pending.pop(key, None)
+            if pending and pending.kind == CREATED:
+                return
+            if pending and pending.kind == MOVED:
+                key, path = self._key(pending.src), pending.src
+                self._pending.pop(key, None)
+            self._pending[key] = _Pending(DELETED, str(path), None, self._clock())
+
+    def moved(self, src: Union[str, 'os.PathLike'], dest: Union[str, 'os.PathLike']) -> None:
+        key, dest_key = self._key(src), self._key(dest)
+        with self._lock:
+            now = self._clock()
+            for child in self._children(key):
+                if self._pending[child].kind == DELETED:
+                    continue
+                pending = self._pending.pop(child)
+                pending.path = os.path.join(str(dest), os.path.relpath(pending.path, str(src)))
+                pending.last = now
+                self._pending[self._key(pending.path)] = pending
+            pending = self._pending.pop(key, None)
+            self._pending.pop(dest_key, None)
+            if pending and pending.kind == CREATED:
+                self._pending[dest_key] = _Pending(CREATED, str(dest), None, now)
+                return
+            src = pending.src if pending and pending.kind == MOVED else str(src)
+            if self._key(src) != dest_key:
+                self._pending[dest_key] = _Pending(MOVED, str(dest), src, now)
+
+    def next_due(self) -> Optional[float]:
+        """Returns the seconds until the next path is due, None if nothing is pending"""
+        with self._lock:
+            if not self._pending:
+                return None
+            oldest = min(p.last for p in self._pending.values())
+            return max(0.0, oldest + self.delay - self._clock())
+
+    def pop_ready(self) -> Tuple[List[str], List[str], List[Tuple[str, str]]]:
+        """
+        Returns the created paths, deleted paths and (old path, new path) of moves that are due.
+        Created paths that changed since they were last checked, or are gone, are held back or dropped.
+        Reads the created paths, so it should not be called on the thread receiving the events.
+        """
+        with self._lock:
+            now = self._clock()
+            due = [(k, p) for k, p in self._pending.items() if now - p.last >= self.delay]
+        created, deleted, moved = [], [], []
+        for key, pending in due:
+            if pending.kind == CREATED:
+                signature = self._signature(pending.path)
+                with self._lock:
+                    if self._pending.get(key) is not pending:
+                        continue
+                    if signature is None:
+                        del self._pending[key]
+                    elif signature != pending.signature:
+                        pending.signature = signature
+                        pending.last = self._clock()
+                    elif now - pending.last >= self.delay:
+                        del self._pending[key]
+                        created.append(pending.path)
+                continue
+            with self._lock:
+                if self._pending.get(key) is not pending:
+                    continue
+                del self._pending[key]
+            if pending.kind == DELETED:
+                deleted.append(pending.path)
+            else:
+                moved.append((pending.src, pending.path))
+        return created, deleted, moved
+
+
+class ExpiringSet:
+    """A set forgetting each item ttl seconds after it was last added"""
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # item -> when it expires, in the order they expire
+        self._items: Dict[Hashable, float] = {}
+
+    def _expire(self) -> None:
+        now = self._clock()
+        for item, expires in list(self._items.items()):
+            if expires > now:
+                break
+            del self._items[item]
+
+    def add(self, item: Hashable) -> None:
+        with self._lock:
+            self._items.pop(item, None)
+            self._items[item] = self._clock() + self.ttl
+            self._expire()
+
+    def discard(self, item: Hashable) -> None:
+        with self._lock:
+            self._items.pop(item, None)
+
+    def __contains__(self, item: Hashable) -> bool:
+        with self._lock:
+            self._expire()
+            return item in self._items
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._items)
+